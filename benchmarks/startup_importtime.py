@@ -0,0 +1,146 @@
+# benchmarks/startup_importtime.py
+#
+# Cold start regression benchmark for the CLI.
+#
+# 1. Imports main under `python -X importtime` in a fresh interpreter and
+#    checks the cumulative import time against a budget.
+# 2. Runs main.main() against a scratch database up to the first prompt and
+#    checks the wall time (interpreter start included) against a budget.
+#
+# Both fail if one of the deferred heavy modules (plotting, numpy, the LLM SDK)
+# has crept back into the startup path. Exits with status 1 on failure.
+#
+#   python benchmarks/startup_importtime.py
+#   python benchmarks/startup_importtime.py --import-budget-ms 150 --runs 10
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+PROFILE = os.path.join(ROOT, 'data', 'kevin', 'profile-data.json')
+
+# Modules that must not be loaded before the first prompt
+DEFERRED_MODULES = ['matplotlib', 'numpy', 'openai', 'httpx', 'pydantic', 'readline']
+
+SETUP_SCRIPT = """
+import sys
+sys.path.insert(0, {src!r})
+from database import Database
+db = Database('agent.db')
+with open({profile!r}) as f:
+    dimensions = f.read()
+db.save_user_info({{'username': 'slippityj', 'birthdate': '', 'culture': '{{}}', 'dimensions': dimensions}})
+db.close()
+"""
+
+# Stops the CLI at its first prompt and reports the loaded heavy modules
+FIRST_PROMPT_SCRIPT = """
+import json, os, sys
+sys.path.insert(0, {src!r})
+import agent
+
+class FirstPromptIO(agent.ConsoleIO):
+    def read_input(self, prompt):
+        loaded = [name for name in {deferred!r} if name in sys.modules]
+        sys.stderr.write('FIRST_PROMPT ' + json.dumps(loaded) + '\\n')
+        sys.stderr.flush()
+        os._exit(0)
+
+agent.ConsoleIO = FirstPromptIO
+import main
+main.main()
+"""
+
+
+# Cumulative import time of main in microseconds and the modules imported
+def measure_imports():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=SRC, capture_output=True, text=True, check=True)
+    cumulative = None
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        if name.strip() == 'main':
+            cumulative = int(cumulative_us)
+    return cumulative, modules
+
+
+# Wall time in seconds from process start to the first prompt
+def measure_first_prompt(workdir):
+    script = FIRST_PROMPT_SCRIPT.format(src=SRC, deferred=DEFERRED_MODULES)
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        cwd=workdir, capture_output=True, text=True,
+        env=dict(os.environ, AGENT_PREFETCH_STATES='0'))
+    elapsed = time.perf_counter() - start
+    for line in result.stderr.splitlines():
+        if line.startswith('FIRST_PROMPT '):
+            return elapsed, json.loads(line[len('FIRST_PROMPT '):])
+    raise RuntimeError(f"The CLI exited before its first prompt:\n{result.stderr}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI cold start benchmark")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=250.0,
+                        help="Budget for the median cumulative import time of main")
+    parser.add_argument('--first-prompt-budget-ms', type=float, default=750.0,
+                        help="Budget for the median time from process start to the first prompt")
+    args = parser.parse_args()
+
+    failures = []
+
+    import_times = []
+    for _ in range(args.runs):
+        cumulative, modules = measure_imports()
+        import_times.append(cumulative / 1000.0)
+        loaded = sorted(name for name in DEFERRED_MODULES if name in modules)
+        if loaded:
+            failures.append(f"deferred modules imported by main: {', '.join(loaded)}")
+            break
+
+    first_prompt_times = []
+    with tempfile.TemporaryDirectory() as workdir:
+        subprocess.run(
+            [sys.executable, '-c', SETUP_SCRIPT.format(src=SRC, profile=PROFILE)],
+            cwd=workdir, check=True)
+        for _ in range(args.runs):
+            elapsed, loaded = measure_first_prompt(workdir)
+            first_prompt_times.append(elapsed * 1000.0)
+            if loaded:
+                failures.append(f"deferred modules loaded before the first prompt: {', '.join(loaded)}")
+                break
+
+    import_ms = statistics.median(import_times)
+    first_prompt_ms = statistics.median(first_prompt_times)
+    print(json.dumps({
+        'import_main_ms': round(import_ms, 1),
+        'import_budget_ms': args.import_budget_ms,
+        'first_prompt_ms': round(first_prompt_ms, 1),
+        'first_prompt_budget_ms': args.first_prompt_budget_ms,
+        'runs': args.runs,
+    }, indent=2))
+
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import of main took {import_ms:.1f}ms (budget {args.import_budget_ms}ms)")
+    if first_prompt_ms > args.first_prompt_budget_ms:
+        failures.append(f"first prompt took {first_prompt_ms:.1f}ms (budget {args.first_prompt_budget_ms}ms)")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
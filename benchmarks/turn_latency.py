@@ -0,0 +1,306 @@
+# benchmarks/turn_latency.py
+#
+# End-to-end turn latency benchmark.
+#
+# Runs concurrent sessions, each driving a scripted conversation through
+# Onboarding, DimensionAnalysis and Education (Agent.main_loop ->
+# StateManager.process_state -> enter_conversation) against a scratch
+# database. The model is the fake LLM backend (see src/llm_backends.py), so
+# the numbers are our own overhead plus the configured fake latency.
+#
+# Reports p50/p95/p99 per phase for 1, 10 and 100 concurrent sessions as JSON:
+#
+#   turn                 one StateManager.process_state() call
+#   prompt_assembly      Agent.build_conversation_prompt()
+#   db_read / db_write   Database get_* / save_*, update_*, delete_* calls
+#   json_parsing         validating a model reply (response_schemas.parse_response)
+#   metadata_extraction  the background conversation event extraction
+#   state_save           StateManager.save_state()
+#   llm                  model calls (fake backend) including the response cache
+#
+#   python benchmarks/turn_latency.py
+#   python benchmarks/turn_latency.py --sessions 1,10 --llm-latency-ms 200 --output turns.json
+import argparse
+import functools
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+DATA = os.path.join(ROOT, 'data')
+
+# Never open chart windows
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, SRC)
+
+# One input per prompt. (input, state) moves to state after the turn, like
+# the user asking to move on.
+SCRIPT = [
+    # Onboarding: goals, then the roadmap is shown
+    "I want to handle stress better and be more present with my family",
+    # DimensionAnalysis: the analysis is generated on the first visit
+    "Why is emotional regulation one of my growth areas?",
+    "show spider chart",
+    "What does the spider chart say about my mindfulness?",
+    "show analysis",
+    ("How do these areas relate to each other? I'd like to move on to Education.", 'Education'),
+    # Education
+    "Teach me about emotional regulation",
+    "How does culture influence it?",
+    "quit",
+]
+
+PHASES = ['turn', 'prompt_assembly', 'db_read', 'db_write', 'json_parsing',
+          'metadata_extraction', 'state_save', 'llm']
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {phase: [] for phase in PHASES}
+
+    def add(self, phase, seconds):
+        with self.lock:
+            self.samples[phase].append(seconds)
+
+    def reset(self):
+        with self.lock:
+            self.samples = {phase: [] for phase in PHASES}
+
+    def wrap(self, phase, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    # The streamed reply is timed until the generator is exhausted
+    def wrap_generator(self, phase, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                yield from fn(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return timed
+
+    def summary(self):
+        with self.lock:
+            return {phase: summarize(samples) for phase, samples in self.samples.items()}
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(samples):
+    if not samples:
+        return {'count': 0}
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000.0, 3),
+        'p50_ms': round(percentile(values, 0.50) * 1000.0, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000.0, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000.0, 3),
+        'max_ms': round(values[-1] * 1000.0, 3),
+    }
+
+
+# Time the phases by wrapping the methods that implement them
+def instrument(timer):
+    import agent
+    import response_schemas
+    import state_manager
+    from assistants.conversation import ConversationAssistant
+    from database import Database
+
+    Agent = agent.Agent
+    Agent.build_conversation_prompt = timer.wrap('prompt_assembly', Agent.build_conversation_prompt)
+    Agent.get_response = timer.wrap('llm', Agent.get_response)
+    Agent.get_response_stream = timer.wrap_generator('llm', Agent.get_response_stream)
+    StateManager = state_manager.StateManager
+    StateManager.process_state = timer.wrap('turn', StateManager.process_state)
+    StateManager.save_state = timer.wrap('state_save', StateManager.save_state)
+    ConversationAssistant.extract_conversation_event = timer.wrap(
+        'metadata_extraction', ConversationAssistant.extract_conversation_event)
+    # Looked up as a module global by complete_validated()
+    response_schemas.parse_response = timer.wrap('json_parsing', response_schemas.parse_response)
+
+    for name, fn in list(vars(Database).items()):
+        if not callable(fn) or name.startswith('_'):
+            continue
+        if name.startswith('get_'):
+            setattr(Database, name, timer.wrap('db_read', fn))
+        elif name.startswith(('save_', 'update_', 'delete_')):
+            setattr(Database, name, timer.wrap('db_write', fn))
+
+
+# Feeds the script to one session and discards the output
+class ScriptedIO:
+    def __init__(self, script):
+        self.script = list(script)
+        self.agent = None
+        self.inputs = 0
+        self.output_chars = 0
+        self.pending_state = None
+
+    def read_input(self, prompt):
+        self.output_chars += len(prompt)
+        if self.pending_state is not None:
+            # The turn that asked to move on is finished
+            getattr(self.agent.state_manager, f"to_{self.pending_state}")()
+            self.pending_state = None
+        if not self.script:
+            return 'quit'
+        line = self.script.pop(0)
+        if isinstance(line, tuple):
+            line, self.pending_state = line
+        self.inputs += 1
+        return line
+
+    def print(self, text=""):
+        self.output_chars += len(text)
+
+    def write(self, text):
+        self.output_chars += len(text)
+
+    def flush(self):
+        pass
+
+
+def load_profiles():
+    profiles = []
+    for name in sorted(os.listdir(DATA)):
+        path = os.path.join(DATA, name, 'profile-data.json')
+        if os.path.isfile(path):
+            with open(path) as file:
+                profiles.append(file.read())
+    return profiles
+
+
+def run_level(sessions, profiles, timer, db_pool_size):
+    from agent import Agent
+    from database import Database
+
+    workdir = tempfile.mkdtemp(prefix='turn-latency-')
+    db = Database(os.path.join(workdir, 'agent.db'), pool_size=db_pool_size)
+    users = []
+    for index in range(sessions):
+        users.append(db.save_user_info({
+            'username': f"bench-user-{index}",
+            'birthdate': '2000-01-01',
+            'culture': '{}',
+            'dimensions': profiles[index % len(profiles)],
+        }))
+
+    timer.reset()
+    barrier = threading.Barrier(sessions)
+    lock = threading.Lock()
+    results = {'completed': 0, 'errors': [], 'inputs': 0}
+
+    def run_session(user_info):
+        session_io = ScriptedIO(SCRIPT)
+        agent = None
+        try:
+            agent = Agent(user_info=user_info, db_connection=db, io=session_io)
+            session_io.agent = agent
+            barrier.wait()
+            agent.main_loop()
+        except SystemExit:
+            # The 'quit' command shuts the agent down and exits
+            with lock:
+                results['completed'] += 1
+        except Exception:
+            with lock:
+                results['errors'].append(traceback.format_exc(limit=5))
+            if agent is not None:
+                agent.shutdown()
+        with lock:
+            results['inputs'] += session_io.inputs
+
+    threads = [threading.Thread(target=run_session, args=(user,), name=f"session-{index}")
+               for index, user in enumerate(users)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+
+    db.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    phases = timer.summary()
+    return {
+        'sessions': sessions,
+        'completed_sessions': results['completed'],
+        'failed_sessions': len(results['errors']),
+        'errors': results['errors'][:3],
+        'user_inputs': results['inputs'],
+        'wall_seconds': round(wall, 3),
+        'turns_per_second': round(phases['turn']['count'] / wall, 1) if wall > 0 else None,
+        'phases': phases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end turn latency benchmark")
+    parser.add_argument('--sessions', default='1,10,100', help="Comma separated concurrency levels")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0, help="Fake LLM time to first token")
+    parser.add_argument('--llm-tokens-per-second', type=float, default=0.0, help="Fake LLM speed, 0 for instant")
+    parser.add_argument('--db-pool-size', type=int, default=None, help="Database connections (default AGENT_DB_POOL_SIZE)")
+    parser.add_argument('--output', default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.sessions.split(',') if level.strip()]
+
+    from llm_backends import FakeBackend, configure_llm_backend
+    configure_llm_backend(FakeBackend(latency=args.llm_latency_ms / 1000.0,
+                                      tokens_per_second=args.llm_tokens_per_second))
+    chart_dir = tempfile.mkdtemp(prefix='turn-latency-charts-')
+    os.environ['AGENT_CHART_CACHE_DIR'] = chart_dir
+
+    timer = PhaseTimer()
+    instrument(timer)
+    profiles = load_profiles()
+
+    try:
+        results = [run_level(sessions, profiles, timer, args.db_pool_size) for sessions in levels]
+    finally:
+        shutil.rmtree(chart_dir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'turn_latency',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'config': {
+            'llm_latency_ms': args.llm_latency_ms,
+            'llm_tokens_per_second': args.llm_tokens_per_second,
+            'db_pool_size': args.db_pool_size or int(os.getenv("AGENT_DB_POOL_SIZE", 8)),
+            'script_inputs': len(SCRIPT),
+            'stream_responses': os.getenv("AGENT_STREAM_RESPONSES", "1") != "0",
+            'prefetch_states': os.getenv("AGENT_PREFETCH_STATES", "1") != "0",
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    return 1 if any(result['failed_sessions'] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
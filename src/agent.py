@@ -2,17 +2,76 @@
 
 from state_manager import StateManager
 #from nlp_processor import NLPProcessor
-from openai import OpenAI
+from llm_backends import get_llm_backend
+from model_router import get_model_router
+from awareness_profile import Profile
+from profile_compactor import DEFAULT_DETAIL_LEVEL, compact_profile, profile_hash
+from prompt_builder import PromptBuilder, get_token_counter
+from response_cache import ResponseCache, cache_file_for, get_response_cache
+from stream_parser import JsonFieldStreamer
+from tracing import span
+from usage_ledger import current_usage_labels, get_usage_ledger
+import logging
 import os
-import readline
 import sys
 import textwrap
 import json
-from assistants.conversation import ConversationAssistant
+from assistants.conversation_pipeline import ConversationPipeline
+from assistants.conversation_memory import ConversationMemory
+
+logger = logging.getLogger(__name__)
+
+# The agent's global system role, shared by every prompt
+SYSTEM_ROLE = """
+You are a Neuropsychologist Agent dedicated to helping users measure and improve their self-awareness
+across multiple dimensions. Guide users on a personalized journey by providing insights and practical
+tools related to consciousness, perception, attention, and self-awareness, using established
+neuropsychological concepts and the latest neuroscience findings. Assist users with assessments, goal
+setting, and developing personalized roadmaps with clear milestones. Navigate them through the main
+states—Onboarding, DimensionAnalysis, Education, Practice, and Reflection—adapting conversations based
+on the specific dimension being discussed. Communicate empathetically and supportively, using clear,
+jargon-free language. Uphold confidentiality and privacy, respecting cultural sensitivities and ethical
+boundaries. Your ultimate goal is to empower users to understand and improve their awareness dimensions,
+ fostering self-efficacy and a growth mindset.
+"""
+
+# Shown when the model's reply to a turn is unusable after every attempt
+CONVERSATION_ERROR_MESSAGE = "Sorry, I wasn't able to respond to that. Could you say it again?"
+
+
+# Convert a prompt dict into the chat messages sent to the API
+def build_messages(prompt):
+    prompt_messages = []
+    prompt_messages.append({"role": "system", "content": prompt['system_role']})
+
+    # System Role Override
+    # if 'system_role' in prompt.keys() and prompt['system_role'] is not None:
+    #     prompt_messages.append({"role": "system", "content": prompt['system_role']})
+    # else:
+    #     prompt_messages.append({"role": "system", "content": self.system_role})
+    # Assistant Role
+    if 'assistant_role' in prompt.keys():
+        prompt_messages.append({"role": "assistant", "content": prompt['assistant_role']})
+    # User Prompt
+    prompt_messages.append({"role": "user", "content": prompt['user_prompt']})
+    return prompt_messages
+
+
+# Sampling parameters used for every completion
+def completion_params():
+    return {
+        "response_format": { "type": "json_object" },
+        "temperature": 0.5,
+        "top_p": 1.0,
+        "presence_penalty": 0.0,
+    }
+
 
 class MyInputClass:
     def __init__(self):
-        # Enable readline history and editing capabilities
+        # Enable readline history and editing capabilities. Importing
+        # readline installs it as the input() line editor.
+        import readline
         readline.parse_and_bind("tab: complete")
         readline.parse_and_bind("set editing-mode emacs")  # Enables Ctrl-A, Ctrl-E, etc.
         readline.parse_and_bind('"\\e[A": history-search-backward')  # Up arrow
@@ -31,28 +90,97 @@ class MyInputClass:
         return user_input
 
 
+# Terminal input/output for a single local session. Server sessions provide
+# their own object with the same methods.
+class ConsoleIO:
+    def __init__(self):
+        self.input_class = None
+
+    def read_input(self, prompt):
+        # Read input from the CLI prompt and use a known library to
+        # allow for more complex input methods like ctrl-a, ctrl-e, upo down history, etc.
+        if self.input_class is None:
+            self.input_class = MyInputClass()
+        return self.input_class.read_input(prompt)
+
+    # Print a line of text
+    def print(self, text=""):
+        print(text)
+
+    # Write raw text (used for streamed output)
+    def write(self, text):
+        sys.stdout.write(text)
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+# Writes streamed text to the screen with the same wrapping as Agent.write().
+# Words are printed as soon as they are complete.
+class WrappedStreamWriter:
+    def __init__(self, width=100, indent='    ', output=None):
+        self.width = width
+        self.indent = indent
+        self.output = output or sys.stdout
+        self.line_length = 0
+        self.word = ''
+
+    def write(self, text):
+        for ch in text:
+            if ch.isspace():
+                self.flush_word()
+            else:
+                self.word += ch
+
+    def flush_word(self):
+        if not self.word:
+            return
+        if self.line_length == 0:
+            text = f"{self.indent}{self.word}"
+        elif self.line_length + 1 + len(self.word) > self.width:
+            text = f"\n{self.indent}{self.word}"
+            self.line_length = 0
+        else:
+            text = f" {self.word}"
+        self.output.write(text)
+        self.output.flush()
+        self.line_length += len(text.lstrip('\n'))
+        self.word = ''
+
+    def close(self):
+        self.flush_word()
+        if self.line_length:
+            self.output.write('\n')
+            self.output.flush()
+        self.line_length = 0
+
+
 class Agent:
-    def __init__(self, user_info, db_connection):
+    def __init__(self, user_info, db_connection, io=None):
         self.user_info = user_info
+        # Where the conversation is read from and written to
+        self.io = io or ConsoleIO()
         self.db = db_connection
         self.user_id = user_info['id']
+        # Parsed Awareness Profile (see awareness_profile)
+        self.profile = user_info.get('profile')
+        if self.profile is None and user_info.get('dimensions'):
+            self.profile = Profile.from_json(user_info['dimensions'])
         #self.db.delete_dimension_analysis(self.user_id)
         self.conversation_state = self.db.get_conversation_state(self.user_id)
         #self.nlp_processor = NLPProcessor()
         self.focus_dimension = None  # The dimension currently being focused on
+        # Level of profile detail injected into prompts (see profile_compactor)
+        self.profile_detail_level = os.getenv("AGENT_PROFILE_DETAIL", DEFAULT_DETAIL_LEVEL)
+        self.compact_profiles = {}
+        # Token budget for the conversation history in a prompt
+        self.history_token_budget = int(os.getenv("AGENT_HISTORY_TOKEN_BUDGET", 2000))
+        # Per section token usage of the last conversation prompt
+        self.last_prompt_usage = None
+        # Print the agent's replies as they are generated
+        self.stream_responses = os.getenv("AGENT_STREAM_RESPONSES", "1") != "0"
 
-        self.system_role = """
-You are a Neuropsychologist Agent dedicated to helping users measure and improve their self-awareness
-across multiple dimensions. Guide users on a personalized journey by providing insights and practical
-tools related to consciousness, perception, attention, and self-awareness, using established
-neuropsychological concepts and the latest neuroscience findings. Assist users with assessments, goal
-setting, and developing personalized roadmaps with clear milestones. Navigate them through the main
-states—Onboarding, DimensionAnalysis, Education, Practice, and Reflection—adapting conversations based
-on the specific dimension being discussed. Communicate empathetically and supportively, using clear,
-jargon-free language. Uphold confidentiality and privacy, respecting cultural sensitivities and ethical
-boundaries. Your ultimate goal is to empower users to understand and improve their awareness dimensions,
- fostering self-efficacy and a growth mindset.
-"""
+        self.system_role = SYSTEM_ROLE
         self.assistant_role = """
 User Information
 username: {self.user_info['username']},
@@ -60,6 +188,21 @@ birthdate: {self.user_info['birthdate']}
 culture: {self.user_info['culture']}
 """
 
+        # Cache of LLM responses, stored alongside the database
+        self.response_cache = None
+        if not os.getenv("AGENT_CACHE_DISABLED"):
+            self.response_cache = get_response_cache(cache_file_for(self.db.db_file))
+
+        # Token usage and cost of the model calls, and the daily budget
+        self.usage_ledger = get_usage_ledger(self.db)
+        # Picks the model for each conversation turn
+        self.model_router = get_model_router()
+
+        # Conversation metadata extraction runs in the background
+        self.conversation_pipeline = ConversationPipeline(self)
+        # Rolling conversation summaries, also updated in the background
+        self.conversation_memory = ConversationMemory(self)
+
         self.state_manager = StateManager(agent=self)
 
 
@@ -80,6 +223,44 @@ culture: {self.user_info['culture']}
             #     self.receive_input(user_input)
             # if self
 
+    # Finish any background work before the agent exits so no conversation
+    # events are lost
+    def shutdown(self):
+        self.state_manager.close()
+        self.conversation_pipeline.close()
+        self.conversation_memory.close()
+        self.usage_ledger.flush()
+
+    # The user's Awareness Profile in the compact form used in prompts.
+    # Computed once per user and detail level and stored in the database.
+    def get_profile_prompt(self, detail_level=None):
+        detail_level = detail_level or self.profile_detail_level
+        if detail_level in self.compact_profiles:
+            return self.compact_profiles[detail_level]
+
+        if detail_level == 'full':
+            # The profile JSON isn't kept in memory
+            return compact_profile(self.db.get_profile_data(self.user_id), detail_level)
+        dimensions_hash = profile_hash(self.profile)
+        saved = self.db.get_compact_profile(self.user_id, detail_level)
+        if saved is not None and saved[0] == dimensions_hash:
+            profile = saved[1]
+        else:
+            profile = compact_profile(self.profile, detail_level)
+            self.db.save_compact_profile(self.user_id, detail_level, dimensions_hash, profile)
+        self.compact_profiles[detail_level] = profile
+        return profile
+
+    # Save any conversation events and summaries produced in the background
+    # since the last turn and start a summary update if enough new events
+    # have arrived. Called before each turn.
+    def flush_background_work(self):
+        with self.db.transaction():
+            self.conversation_pipeline.flush()
+            self.conversation_memory.flush()
+            self.usage_ledger.flush()
+        self.conversation_memory.update(self.state_manager.state)
+
     # Prints text to the screen using textwrap to limit to 100 characters per line
     def write(self, text, quiet=False):
         wrapped_text = textwrap.fill(
@@ -88,14 +269,17 @@ culture: {self.user_info['culture']}
             initial_indent='    ',
             subsequent_indent='    ')
         if not quiet:
-            print(wrapped_text)
+            self.io.print(wrapped_text)
         return wrapped_text
 
+    # Prints text to the screen as is
+    def print(self, text=""):
+        self.io.print(text)
+
     def read_input(self, prompt):
-        # Read input from the CLI prompt and use a known library to
-        # allow for more complex input methods like ctrl-a, ctrl-e, upo down history, etc.
-        input_class = MyInputClass()
-        response = input_class.read_input(f"{prompt}\n\nUser:\n    > ")
+        # Don't hold the turn's writes (and the sqlite write lock) while the user types
+        self.db.commit_pending()
+        response = self.io.read_input(f"{prompt}\n\nUser:\n    > ")
         return response
 
     def receive_input(self, user_input):
@@ -115,38 +299,165 @@ culture: {self.user_info['culture']}
         self.db.update_agent_state(self.user_id, self.current_state)
 
     # Interact with ChatGPT via the Open AI API
-    def get_response(self, prompt, model="gpt-4o-mini"):
-        # Init OpenAI Client
-        client = OpenAI(
-            # This is the default and can be omitted
-            api_key=os.getenv("OPENAI_API_KEY")
-        )
-        prompt_messages = []
-        prompt_messages.append({"role": "system", "content": prompt['system_role']})
-
-        # System Role Override
-        # if 'system_role' in prompt.keys() and prompt['system_role'] is not None:
-        #     prompt_messages.append({"role": "system", "content": prompt['system_role']})
-        # else:
-        #     prompt_messages.append({"role": "system", "content": self.system_role})
-        # Assistant Role
-        if 'assistant_role' in prompt.keys():
-            prompt_messages.append({"role": "assistant", "content": prompt['assistant_role']})
-        # User Prompt
-        prompt_messages.append({"role": "user", "content": prompt['user_prompt']})
-        completion = client.chat.completions.create(
-            model=model,
-            response_format={ "type": "json_object" },
-            temperature=0.5,
-            top_p=1.0,
-            presence_penalty=0.0,
-            messages=prompt_messages
-        )
-
-        #print(completion.choices[0].message.content)
-        result = completion.choices[0].message.content
-
-        return result
+    # Identical requests are answered from the response cache unless use_cache is False
+    # Over the daily token budget the budget model is used instead of model
+    def get_response(self, prompt, model="gpt-4o-mini", use_cache=True):
+        model = self.usage_ledger.choose_model(self.user_id, model)
+        with span('llm.complete', model=model, user_id=self.user_id) as current:
+            prompt_messages = self.build_messages(prompt)
+            params = self.completion_params()
+            cache_key = None
+            if use_cache and self.response_cache is not None:
+                cache_key = ResponseCache.make_key(model, prompt, params)
+                result = self.response_cache.get(cache_key)
+                if result is not None:
+                    current.set(cached=True)
+                    return result
+
+            # OpenAI, or a recording/fake backend (see llm_backends)
+            completion = get_llm_backend().complete(model, prompt_messages, params)
+
+            #print(completion.content)
+            result = completion.content
+
+            self.calibrate_token_counter(prompt_messages, completion.usage)
+            if completion.usage is not None:
+                current.set(prompt_tokens=completion.usage.prompt_tokens,
+                            completion_tokens=completion.usage.completion_tokens)
+            self.record_usage(model, prompt_messages, completion.usage, result)
+
+            if cache_key is not None:
+                self.response_cache.put(cache_key, model, result)
+
+            return result
+
+    # get_response() for a reply that must match a response_schemas schema.
+    # Returns (response, JSON text). Invalid replies are repaired or asked
+    # again without the cache, and only a validated reply is cached.
+    # Raises ResponseValidationError when every attempt fails.
+    def get_validated_response(self, prompt, schema, model="gpt-4o-mini"):
+        from response_schemas import complete_validated
+        model = self.usage_ledger.choose_model(self.user_id, model)
+        cache_key = None
+        cached = None
+        if self.response_cache is not None:
+            cache_key = ResponseCache.make_key(model, prompt, self.completion_params())
+            cached = self.response_cache.get(cache_key)
+        response, text = complete_validated(
+            lambda attempt_prompt: self.get_response(prompt=attempt_prompt, model=model, use_cache=False),
+            prompt,
+            schema,
+            # Validated again, in case it was cached by an older version
+            response=cached)
+        if cache_key is not None and text != cached:
+            self.response_cache.put(cache_key, model, text)
+        return response, text
+
+    # Keep the token estimator calibrated against the real prompt size
+    def calibrate_token_counter(self, prompt_messages, usage):
+        if usage is not None:
+            prompt_length = sum(len(message['content'] or "") for message in prompt_messages)
+            get_token_counter().calibrate(prompt_length, usage.prompt_tokens)
+
+    # Count a model call in the usage ledger, under the session's state and
+    # sub state unless the caller set its own (see usage_ledger.usage_labels).
+    # Calls that report no usage (the fake backend, a stream abandoned before
+    # its usage arrived) are estimated from the text.
+    def record_usage(self, model, prompt_messages, usage, content):
+        labels = current_usage_labels()
+        state = labels.get('state')
+        sub_state = labels.get('sub_state')
+        state_manager = getattr(self, 'state_manager', None)
+        if state is None and state_manager is not None:
+            state = state_manager.state
+        if sub_state is None and state_manager is not None:
+            # Without building a state that doesn't exist yet
+            state_obj = state_manager.state_class_obj.get(state)
+            sub_state = state_obj.state if state_obj is not None else None
+        if usage is not None:
+            self.usage_ledger.record(self.user_id, state, sub_state, model,
+                                     usage.prompt_tokens, usage.completion_tokens)
+            return
+        counter = get_token_counter()
+        prompt_tokens = sum(counter.count(message['content']) for message in prompt_messages)
+        self.usage_ledger.record(self.user_id, state, sub_state, model,
+                                 prompt_tokens, counter.count(content), estimated=True)
+
+    # Count a streamed call, with the usage the backend reported if any
+    def record_stream_usage(self, current, model, prompt_messages, usages, chunks):
+        usage = usages[-1] if usages else None
+        if usage is not None:
+            self.calibrate_token_counter(prompt_messages, usage)
+            current.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+        self.record_usage(model, prompt_messages, usage, ''.join(chunks))
+
+    # Stream a response from ChatGPT, yielding the content as it is generated
+    def get_response_stream(self, prompt, model="gpt-4o-mini"):
+        model = self.usage_ledger.choose_model(self.user_id, model)
+        with span('llm.stream', model=model, user_id=self.user_id) as current:
+            prompt_messages = self.build_messages(prompt)
+            chunks = []
+            # The usage the backend reports once the stream has ended
+            usages = []
+            try:
+                for text in get_llm_backend().stream(model, prompt_messages, self.completion_params(),
+                                                     on_usage=usages.append):
+                    chunks.append(text)
+                    yield text
+            finally:
+                # Estimated when the stream was abandoned before the usage
+                # arrived, including what was generated so far
+                self.record_stream_usage(current, model, prompt_messages, usages, chunks)
+
+    # Convert a prompt dict into the chat messages sent to the API
+    def build_messages(self, prompt):
+        return build_messages(prompt)
+
+    # Sampling parameters used for every completion
+    def completion_params(self):
+        return completion_params()
+
+    # Stream a conversation reply, printing its 'agent_response' field as it
+    # arrives. Returns the full JSON text and whether anything was printed.
+    def stream_conversation_response(self, prompt, model):
+        field_streamer = JsonFieldStreamer('agent_response')
+        writer = WrappedStreamWriter(output=self.io)
+        field_started = False
+        chunks = []
+        for content in self.get_response_stream(prompt, model=model):
+            chunks.append(content)
+            text = field_streamer.feed(content)
+            if text:
+                if not field_started:
+                    # The header is not part of the wrapped reply text
+                    self.write("\nAgent:\n")
+                    field_started = True
+                writer.write(text)
+        writer.close()
+        return ''.join(chunks), field_streamer.found
+
+    # Assemble a conversation prompt within the token budget. The conversation
+    # history has the lowest priority and is trimmed first (oldest events first).
+    def build_conversation_prompt(self, state_obj, prompt_context, history, user_prompt):
+        with span('prompt.build') as current:
+            builder = PromptBuilder()
+            builder.add_section('system_role', 'system_role', self.system_role, priority=100, trim=None)
+            builder.add_section('state_system_role', 'system_role', state_obj.system_role, priority=90, trim='head')
+            builder.add_section('assistant_role', 'assistant_role', self.assistant_role, priority=80, trim='head')
+            builder.add_section('state_assistant_role', 'assistant_role', state_obj.assistant_role, priority=70, trim='head')
+            builder.add_section('history', 'assistant_role', history, priority=10, budget=self.history_token_budget, trim='tail')
+            builder.add_section('prompt_context', 'user_prompt', prompt_context, priority=100, trim=None)
+            builder.add_section('user_input', 'user_prompt', f"\nUser input:\n{user_prompt}", priority=100, trim=None)
+            prompt = builder.build()
+            self.last_prompt_usage = builder.usage()
+            current.set(prompt_tokens_estimate=self.last_prompt_usage['total_tokens'])
+            return prompt
+
+    # Send acknowledgements and navigation to the small model (see
+    # model_router), other turns to the requested model
+    def route_turn(self, user_prompt, model, state, state_obj):
+        return self.model_router.route(user_prompt, model, user_id=self.user_id,
+                                       state=state, sub_state=state_obj.state)
 
     # Handles the Agent conversation within a particular state
     def enter_conversation(self, prompt_context, assistant_role=None, agent_prompt=None, model="gpt-4o-mini", state=None, system_role=None):
@@ -154,8 +465,11 @@ culture: {self.user_info['culture']}
         if agent_prompt is None:
             agent_prompt = self.conversation_state['next_agent_question']
 
+        if state is None:
+            state = self.state_manager.state
+
         if assistant_role is None:
-            assistant_role = self.db.get_conversation_events(self.user_id)
+            assistant_role = self.conversation_memory.get_context(state)
 
         state_obj = self.state_manager.state_class_obj[self.state_manager.state]
         # Display State and Commands
@@ -167,27 +481,49 @@ culture: {self.user_info['culture']}
             # Execute the command
             state_obj.commands[user_prompt]['handler']()
             return None
-        prompt = {
-            "user_prompt": f"{prompt_context}\n\nUser input:\n{user_prompt}",
-            "assistant_role": f"{self.assistant_role}\n{state_obj.assistant_role}",
-            "system_role": f"{self.system_role}\n{state_obj.system_role}",
-        }
-        results = self.get_response(
-            prompt=prompt,
-            model=model,
-            system_role=system_role
-        )
+        route = self.route_turn(user_prompt, model, state, state_obj)
+        model = route.model
+        prompt = self.build_conversation_prompt(state_obj, prompt_context, assistant_role, user_prompt)
+        # Conversation turns are never answered from the cache
+        streamed = False
+        if self.stream_responses:
+            results, streamed = self.stream_conversation_response(prompt, model)
+        else:
+            results = self.get_response(
+                prompt=prompt,
+                model=model,
+                use_cache=False
+            )
+        # Repaired if possible, asked again only if the reply is unusable
+        from response_schemas import ConversationResponse, ResponseValidationError, complete_validated
+        retries = []
+        def complete(retry_prompt):
+            retries.append(retry_prompt)
+            # A small model reply that failed is retried on the requested model
+            if route.routed and len(retries) == 1:
+                self.model_router.record_escalation()
+            return self.get_response(prompt=retry_prompt, model=route.requested_model, use_cache=False)
+        try:
+            with span('response.validate', model=model):
+                response, results = complete_validated(complete, prompt, ConversationResponse, response=results)
+        except ResponseValidationError as e:
+            # Keep the previous conversation state so the turn can be retried
+            logger.warning("Invalid conversation response: %s", e)
+            self.write(f"\nAgent:\n{CONVERSATION_ERROR_MESSAGE}\n")
+            return None
         conversation = {
             "user_input": user_prompt,
             "agent_response": results,
         }
-        agent_response = json.loads(conversation['agent_response'])
+        agent_response = response.model_dump()
         self.db.save_conversation_state(self.user_id, conversation['agent_response'])
         self.conversation_state = agent_response
 
-        self.write(f"\nAgent:\n{agent_response['agent_response']}\n")
+        # A retried reply was not streamed
+        if not streamed or retries:
+            self.write(f"\nAgent:\n{agent_response['agent_response']}\n")
 
-        conversation_assistant = ConversationAssistant(self)
-        conversation_assistant.save_conversation(state, conversation)
+        # Extract and save the conversation metadata off the critical path
+        self.conversation_pipeline.submit(state, conversation)
 
         return conversation
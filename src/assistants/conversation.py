@@ -1,6 +1,11 @@
 # An Agent Assistant class that manages system roles for various
 # assistanted tasks.
 from .base_assistant import Assistant
+from tracing import span
+from usage_ledger import usage_labels
+
+# Sub state the metadata extraction's tokens are counted under
+EXTRACTION_SUB_STATE = 'ConversationExtraction'
 
 class ConversationAssistant( Assistant ):
     def __init__(self, agent):
@@ -136,7 +141,8 @@ ENTITY_TYPE_VALUES: {self.ENTITY_TYPE_LIST}
 EMOTIONAL_TONE_VALUES: {self.EMOTIONAL_TONE_LIST}
 """
 
-    def save_conversation(self, state, conversation):
+    # Build the metadata extraction prompt for a finished user/agent exchange
+    def build_prompt(self, conversation):
 
         user_prompt = f"""
 Message: {conversation['user_input']}
@@ -145,10 +151,22 @@ Speaker: user
 Message: {conversation['agent_response']}
 Speaker: agent
 """
-        prompt = {
+        return {
             'user_prompt': user_prompt,
             'system_role': self.system_role
         }
-        response = self.agent.get_response(prompt, model="gpt-4o")
 
-        self.agent.db.save_conversation_event(self.agent.user_id, state, response)
\ No newline at end of file
+    # Run the metadata extraction for a finished user/agent exchange and
+    # return the raw JSON produced by the model. The tokens are counted
+    # under state and the ConversationExtraction sub state.
+    def extract_conversation_event(self, conversation, state=None):
+        with span('conversation.extract', user_id=self.agent.user_id, state=state):
+            with usage_labels(state=state, sub_state=EXTRACTION_SUB_STATE):
+                prompt = self.build_prompt(conversation)
+                return self.agent.get_response(prompt, model="gpt-4o")
+
+    def save_conversation(self, state, conversation):
+        with span('conversation.save', user_id=self.agent.user_id, state=state):
+            response = self.extract_conversation_event(conversation, state)
+
+            self.agent.db.save_conversation_event(self.agent.user_id, state, response)
@@ -0,0 +1,162 @@
+# Rolling conversation memory.
+#
+# Keeps a summary of the conversation per user, both across all states and
+# per state, plus a window of the most recent events. The summaries are
+# updated in the background once enough new events have been saved, so the
+# conversation context in a prompt stays bounded however long the history is.
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import threading
+from .base_assistant import Assistant
+from usage_ledger import usage_labels
+
+logger = logging.getLogger(__name__)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_summary_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("AGENT_SUMMARY_WORKERS", 2)),
+                thread_name_prefix='conversation-memory')
+        return _executor
+
+
+class ConversationMemory( Assistant ):
+    def __init__(self, agent, summary_batch_size=None, recent_events=None, max_summary_events=None):
+        super().__init__(agent)
+        # Number of new events that triggers a summary update
+        self.summary_batch_size = int(summary_batch_size or os.getenv("AGENT_SUMMARY_BATCH_SIZE", 10))
+        # Number of recent events included verbatim next to the summary
+        self.recent_events = int(recent_events or os.getenv("AGENT_RECENT_EVENTS", 10))
+        # Most events folded into the summary by one update, the rest are
+        # left for the next one
+        self.max_summary_events = max(self.summary_batch_size, int(
+            max_summary_events or os.getenv("AGENT_SUMMARY_MAX_EVENTS", 50)))
+
+        # Shared by every Agent in the process. Only one update per user and
+        # state is in flight at a time.
+        self.executor = get_summary_executor()
+        # In flight summary updates: {state: future}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+        self.system_role = """
+You are an AI language assistant that maintains a rolling summary of a conversation between a user
+and a Neuropsychologist Agent that helps the user improve their self-awareness.
+
+You are given the current summary (which may be empty) and the metadata of the newest conversation
+events. Produce an updated summary that:
+    * Keeps the facts, goals, preferences, concerns and emotional context the agent needs to continue
+      the conversation with empathy and continuity.
+    * Includes the important information from the new events.
+    * Drops details that are no longer relevant.
+    * Is at most 200 words.
+
+JSON Output Format:
+{
+    "summary": "<the updated summary>"
+}
+"""
+
+    # Conversation context for a prompt: the rolling summary followed by the
+    # most recent events that are not part of it yet. With a state, the
+    # summary across all states comes first, then the state's own summary and
+    # its recent events.
+    def get_context(self, state=None):
+        context = ""
+        if state is not None:
+            saved = self.agent.db.get_conversation_summary(self.agent.user_id, None)
+            if saved is not None and saved[0]:
+                context += f"Conversation summary:\n{saved[0]}\n\n"
+
+        summary = None
+        last_event_id = 0
+        saved = self.agent.db.get_conversation_summary(self.agent.user_id, state)
+        if saved is not None:
+            summary, last_event_id = saved
+
+        recent = self.agent.db.get_conversation_events(
+            self.agent.user_id,
+            state=state,
+            num_events=self.recent_events,
+            after_id=last_event_id)
+
+        if summary:
+            title = "Conversation summary" if state is None else f"Conversation summary in the {state} state"
+            context += f"{title}:\n{summary}\n\n"
+        if recent:
+            context += f"Recent conversation events:\n{recent}"
+        return context
+
+    # Start a background summary update for the states that have collected
+    # enough new events
+    def update(self, state=None):
+        if self.closed:
+            return
+        states = [None] if state is None else [None, state]
+        for summary_state in states:
+            with self.lock:
+                if summary_state in self.pending:
+                    continue
+            saved = self.agent.db.get_conversation_summary(self.agent.user_id, summary_state)
+            summary, last_event_id = saved if saved is not None else ("", 0)
+            new_events = self.agent.db.count_conversation_events(
+                self.agent.user_id,
+                state=summary_state,
+                after_id=last_event_id,
+                limit=self.summary_batch_size)
+            if new_events < self.summary_batch_size:
+                continue
+            rows = self.agent.db.get_conversation_event_rows(
+                self.agent.user_id,
+                state=summary_state,
+                after_id=last_event_id,
+                limit=self.max_summary_events)
+            future = self.executor.submit(self.summarize, summary, [row[1] for row in rows])
+            with self.lock:
+                self.pending[summary_state] = (future, rows[-1][0])
+
+    # Ask the model to fold the new events into the summary
+    def summarize(self, summary, events):
+        events_text = "\n".join(events)
+        prompt = {
+            'system_role': self.system_role,
+            'user_prompt': f"Current summary:\n{summary}\n\nNew conversation events:\n{events_text}",
+        }
+        with usage_labels(sub_state='ConversationSummary'):
+            response = self.agent.get_response(prompt, model="gpt-4o-mini")
+        return json.loads(response)['summary']
+
+    # Save the finished summary updates. Runs on the thread that owns the
+    # database connection. With wait=True block until all updates are done.
+    def flush(self, wait=False):
+        with self.lock:
+            ready = {
+                state: item for state, item in self.pending.items()
+                if wait or item[0].done()
+            }
+            for state in ready:
+                del self.pending[state]
+
+        for state, (future, last_event_id) in ready.items():
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.warning("Conversation summary update failed: %s", e, exc_info=e)
+                continue
+            self.agent.db.save_conversation_summary(self.agent.user_id, state, summary, last_event_id)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.flush(wait=True)
@@ -0,0 +1,86 @@
+# Background pipeline for conversation event extraction.
+#
+# The metadata extraction (intent, entities, emotional tone) is a full model
+# round trip, so it runs on a small thread pool instead of blocking the next
+# prompt. Finished extractions are written to the conversations table by the
+# thread that owns the Agent (and so the sqlite connection) whenever flush()
+# or drain() is called.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import logging
+import os
+import threading
+from .conversation import ConversationAssistant
+from tracing import bind_context
+
+logger = logging.getLogger(__name__)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# The extraction thread pool is shared by every Agent in the process so that
+# many concurrent sessions don't each start their own threads
+def get_extraction_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("AGENT_EXTRACTION_WORKERS", 8)),
+                thread_name_prefix='conversation-extraction')
+        return _executor
+
+
+class ConversationPipeline:
+    def __init__(self, agent, executor=None):
+        self.agent = agent
+        self.assistant = ConversationAssistant(agent)
+        self.executor = executor or get_extraction_executor()
+        # Submitted extractions that have not been written yet:
+        # [(future, state, timestamp), ...]
+        self.pending = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    # Queue a finished turn for extraction. Returns immediately.
+    def submit(self, state, conversation):
+        if self.closed:
+            # After shutdown fall back to the synchronous path so nothing is lost
+            self.assistant.save_conversation(state, conversation)
+            return
+        # Record the time of the turn, not the time the extraction finished
+        timestamp = datetime.now()
+        # Traced as part of the turn that submitted it
+        future = self.executor.submit(bind_context(self.assistant.extract_conversation_event), conversation, state)
+        with self.lock:
+            self.pending.append((future, state, timestamp))
+
+    # Save every finished extraction. With wait=True block until all
+    # submitted extractions are finished and saved.
+    def flush(self, wait=False):
+        with self.lock:
+            if wait:
+                ready = self.pending
+                self.pending = []
+            else:
+                ready = [item for item in self.pending if item[0].done()]
+                self.pending = [item for item in self.pending if not item[0].done()]
+
+        for future, state, timestamp in ready:
+            try:
+                response = future.result()
+            except Exception as e:
+                logger.warning("Conversation event extraction failed: %s", e, exc_info=e)
+                continue
+            self.agent.db.save_conversation_event(self.agent.user_id, state, response, timestamp=timestamp)
+
+    # Wait for all in-flight extractions and save them
+    def drain(self):
+        self.flush(wait=True)
+
+    def close(self):
+        if self.closed:
+            return
+        self.drain()
+        self.closed = True
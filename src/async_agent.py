@@ -0,0 +1,269 @@
+# src/async_agent.py
+#
+# Async-native Agent.
+#
+# The conversation turn (read input -> build prompt -> LLM call -> persist ->
+# extract metadata) runs as coroutines on an event loop: the model is called
+# with the shared AsyncOpenAI client, the database through AsyncDatabase and
+# the metadata extraction as an asyncio task. While a turn waits on the user,
+# the model or sqlite, the loop is free to serve other sessions.
+#
+# The states are unchanged. Their handlers run on a handler thread and call
+# enter_conversation() as usual, which hands the turn to the event loop and
+# waits for it. So a waiting session only holds a parked thread, the I/O
+# itself is multiplexed on the loop. The turn's writes stay on the handler
+# thread, in the transaction of StateManager.process_state.
+#
+#   agent = AsyncAgent(user_info, db, io=async_io)
+#   await agent.main_loop_async()
+#
+# The io object must provide an async read_input(prompt) and the usual
+# non-blocking print/write/flush (see server.AsyncSessionIO).
+import asyncio
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from agent import CONVERSATION_ERROR_MESSAGE, Agent, WrappedStreamWriter
+from assistants.conversation import EXTRACTION_SUB_STATE, ConversationAssistant
+from database import get_async_database
+from llm_backends import get_llm_backend
+from response_cache import ResponseCache
+from stream_parser import JsonFieldStreamer
+from tracing import attach_span, current_span, span
+from usage_ledger import usage_labels
+
+logger = logging.getLogger(__name__)
+
+
+# Raised in place of SystemExit when state code calls exit() (the quit
+# command). A SystemExit reaching an asyncio task stops the event loop and so
+# every session on it; this only ends the session that quit.
+class SessionExit(BaseException):
+    pass
+
+
+# Run state code, turning exit() into SessionExit
+def call_state_code(fn):
+    try:
+        return fn()
+    except SystemExit as e:
+        raise SessionExit(*e.args) from None
+
+
+_handler_executor = None
+_handler_executor_lock = threading.Lock()
+
+
+# Threads the state handlers run on, shared by every AsyncAgent in the process
+def get_handler_executor():
+    global _handler_executor
+    with _handler_executor_lock:
+        if _handler_executor is None:
+            _handler_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("AGENT_ASYNC_HANDLER_THREADS", 256)),
+                thread_name_prefix='agent-handler')
+        return _handler_executor
+
+
+class AsyncAgent(Agent):
+    def __init__(self, user_info, db_connection, io=None):
+        super().__init__(user_info, db_connection, io=io)
+        self.adb = get_async_database(db_connection)
+        self.handler_executor = get_handler_executor()
+        # Set when the main loop starts
+        self.loop = None
+        # Metadata extractions still running
+        self.extraction_tasks = set()
+        self.extraction_assistant = ConversationAssistant(self)
+
+    # Agent Main Loop. Runs one state handler per iteration on a handler thread.
+    async def main_loop_async(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            keep_going = True
+            while keep_going:
+                keep_going = await self.run_blocking(self.state_manager.process_state)
+        except SessionExit:
+            # The user quit
+            pass
+        finally:
+            await self.shutdown_async()
+
+    # Wait for the running extractions, then the background work of the base Agent
+    async def shutdown_async(self):
+        if self.extraction_tasks:
+            await asyncio.gather(*self.extraction_tasks, return_exceptions=True)
+        await self.run_blocking(self.shutdown)
+
+    # Run blocking (state handler) code without stalling the event loop
+    async def run_blocking(self, fn, *args, **kwargs):
+        return await self.loop.run_in_executor(
+            self.handler_executor, call_state_code, functools.partial(fn, *args, **kwargs))
+
+    # Adapter for the state handlers: runs the turn on the event loop and
+    # waits for it on the handler thread
+    def enter_conversation(self, *args, **kwargs):
+        if self.loop is None:
+            raise RuntimeError("AsyncAgent.enter_conversation() called before main_loop_async()")
+        # The turn reads input on the loop: commit this thread's writes so far
+        # instead of holding them while the user types
+        self.db.commit_pending()
+        # The conversation is part of the turn running on this thread
+        parent = current_span()
+        async def run():
+            attach_span(parent)
+            return await self.enter_conversation_async(*args, **kwargs)
+        future = asyncio.run_coroutine_threadsafe(run(), self.loop)
+        conversation = future.result()
+        if conversation is not None:
+            # Saved on this thread, as part of the turn's transaction
+            self.db.save_conversation_state(self.user_id, conversation['agent_response'])
+        return conversation
+
+    # Async version of Agent.get_response()
+    async def get_response_async(self, prompt, model="gpt-4o-mini", use_cache=True):
+        model = await self.choose_model_async(model)
+        with span('llm.complete', model=model, user_id=self.user_id) as current:
+            prompt_messages = self.build_messages(prompt)
+            params = self.completion_params()
+            cache_key = None
+            if use_cache and self.response_cache is not None:
+                cache_key = ResponseCache.make_key(model, prompt, params)
+                result = await self.adb.call(self.response_cache.get, cache_key)
+                if result is not None:
+                    current.set(cached=True)
+                    return result
+
+            completion = await get_llm_backend().complete_async(model, prompt_messages, params)
+            result = completion.content
+            self.calibrate_token_counter(prompt_messages, completion.usage)
+            if completion.usage is not None:
+                current.set(prompt_tokens=completion.usage.prompt_tokens,
+                            completion_tokens=completion.usage.completion_tokens)
+            self.record_usage(model, prompt_messages, completion.usage, result)
+
+            if cache_key is not None:
+                await self.adb.call(self.response_cache.put, cache_key, model, result)
+
+            return result
+
+    # Async version of Agent.get_response_stream()
+    async def get_response_stream_async(self, prompt, model="gpt-4o-mini"):
+        model = await self.choose_model_async(model)
+        with span('llm.stream', model=model, user_id=self.user_id) as current:
+            prompt_messages = self.build_messages(prompt)
+            chunks = []
+            # The usage the backend reports once the stream has ended
+            usages = []
+            try:
+                async for text in get_llm_backend().stream_async(model, prompt_messages, self.completion_params(),
+                                                                 on_usage=usages.append):
+                    chunks.append(text)
+                    yield text
+            finally:
+                self.record_stream_usage(current, model, prompt_messages, usages, chunks)
+
+    # The budget check reads the user's usage from the database once a day
+    async def choose_model_async(self, model):
+        if not self.usage_ledger.daily_token_budget:
+            return model
+        return await self.adb.call(self.usage_ledger.choose_model, self.user_id, model)
+
+    # Async version of Agent.stream_conversation_response()
+    async def stream_conversation_response_async(self, prompt, model):
+        field_streamer = JsonFieldStreamer('agent_response')
+        writer = WrappedStreamWriter(output=self.io)
+        field_started = False
+        chunks = []
+        async for content in self.get_response_stream_async(prompt, model=model):
+            chunks.append(content)
+            text = field_streamer.feed(content)
+            if text:
+                if not field_started:
+                    # The header is not part of the wrapped reply text
+                    self.write("\nAgent:\n")
+                    field_started = True
+                writer.write(text)
+        writer.close()
+        return ''.join(chunks), field_streamer.found
+
+    # Async version of Agent.enter_conversation()
+    async def enter_conversation_async(self, prompt_context, assistant_role=None, agent_prompt=None, model="gpt-4o-mini", state=None, system_role=None):
+        if agent_prompt is None:
+            agent_prompt = self.conversation_state['next_agent_question']
+
+        if state is None:
+            state = self.state_manager.state
+
+        if assistant_role is None:
+            assistant_role = await self.adb.call(self.conversation_memory.get_context, state)
+
+        state_obj = self.state_manager.state_class_obj[self.state_manager.state]
+        # Display State and Commands
+        self.state_manager.display_console_hud()
+        wrapped_agent_prompt = self.write(agent_prompt, quiet=True)
+        user_prompt = await self.io.read_input(f"Agent:\n{wrapped_agent_prompt}\n\nUser:\n    > ")
+        # Commands are regular (blocking) state code
+        if user_prompt in state_obj.commands.keys():
+            await self.run_blocking(state_obj.commands[user_prompt]['handler'])
+            return None
+        route = self.route_turn(user_prompt, model, state, state_obj)
+        model = route.model
+        prompt = self.build_conversation_prompt(state_obj, prompt_context, assistant_role, user_prompt)
+        # Conversation turns are never answered from the cache
+        streamed = False
+        if self.stream_responses:
+            results, streamed = await self.stream_conversation_response_async(prompt, model)
+        else:
+            results = await self.get_response_async(prompt, model=model, use_cache=False)
+        # Repaired if possible, asked again only if the reply is unusable
+        from response_schemas import ConversationResponse, ResponseValidationError, complete_validated_async
+        retries = []
+        async def complete(retry_prompt):
+            retries.append(retry_prompt)
+            if route.routed and len(retries) == 1:
+                self.model_router.record_escalation()
+            return await self.get_response_async(retry_prompt, model=route.requested_model, use_cache=False)
+        try:
+            with span('response.validate', model=model):
+                response, results = await complete_validated_async(complete, prompt, ConversationResponse, response=results)
+        except ResponseValidationError as e:
+            # Keep the previous conversation state so the turn can be retried
+            logger.warning("Invalid conversation response: %s", e)
+            self.write(f"\nAgent:\n{CONVERSATION_ERROR_MESSAGE}\n")
+            return None
+        conversation = {
+            "user_input": user_prompt,
+            "agent_response": results,
+        }
+        # Saved by enter_conversation() on the handler thread, which holds
+        # the turn's transaction
+        agent_response = response.model_dump()
+        self.conversation_state = agent_response
+
+        # A retried reply was not streamed
+        if not streamed or retries:
+            self.write(f"\nAgent:\n{agent_response['agent_response']}\n")
+
+        # Extract and save the conversation metadata off the critical path
+        task = asyncio.ensure_future(self.extract_conversation_event_async(state, conversation))
+        self.extraction_tasks.add(task)
+        task.add_done_callback(self.extraction_tasks.discard)
+
+        return conversation
+
+    # Background task: extract the metadata of a turn and save it
+    async def extract_conversation_event_async(self, state, conversation):
+        # Record the time of the turn, not the time the extraction finished
+        timestamp = datetime.now()
+        try:
+            with span('conversation.extract', user_id=self.user_id, state=state), \
+                    usage_labels(state=state, sub_state=EXTRACTION_SUB_STATE):
+                prompt = self.extraction_assistant.build_prompt(conversation)
+                response = await self.get_response_async(prompt, model="gpt-4o")
+                await self.adb.save_conversation_event(self.user_id, state, response, timestamp=timestamp)
+        except Exception as e:
+            logger.warning("Conversation event extraction failed: %s", e, exc_info=e)
@@ -0,0 +1,142 @@
+# src/awareness_profile.py
+#
+# In-memory Awareness Profile.
+#
+# profile-data.json holds every question and answer (~30KB). A session only
+# ever needs the scores, so the JSON is parsed once when the user is loaded
+# (Database.get_user_info) into flat parallel lists with one entry per
+# sub-dimension, and neither the parsed document nor the JSON text is kept.
+# The numpy arrays used for scoring are built from those lists on first use
+# and cached, which keeps numpy out of the CLI cold start.
+#
+#   profile = Profile.from_json(profile_data)
+#   profile.dimension_percentages       # array([82., 61., ...])
+#   profile.hash                        # of the stored JSON
+#
+# The scoring functions (profile_scoring, profile_compactor, roadmap) accept a
+# Profile anywhere they accept the raw profile data.
+import hashlib
+import json
+
+# Answers are on a 1-5 scale
+MAX_ANSWER_SCORE = 5
+
+
+class Profile:
+    __slots__ = ('labels', 'scores', 'sub_labels', 'sub_scores', 'sub_max_scores', 'dimension_index',
+                 '_hash', '_arrays', '_sub_percentages', '_dimension_percentages')
+
+    def __init__(self, labels, sub_labels, sub_scores, sub_max_scores, dimension_index, scores=None, hash=None):
+        # Dimension labels in profile order
+        self.labels = labels
+        # The percentage stored with each dimension (the one in the user's
+        # profile-snapshot.json), None where the profile has none
+        self.scores = scores if scores is not None else [None] * len(labels)
+        # One entry per sub-dimension, grouped by dimension in profile order
+        self.sub_labels = sub_labels
+        self.sub_scores = sub_scores
+        self.sub_max_scores = sub_max_scores
+        # Index into labels of each sub-dimension's dimension
+        self.dimension_index = dimension_index
+        self._hash = hash
+        self._arrays = None
+        self._sub_percentages = None
+        self._dimension_percentages = None
+
+    # Parse profile-data.json (a string or an already decoded dict)
+    @classmethod
+    def from_json(cls, profile_data):
+        if isinstance(profile_data, str):
+            raw = profile_data
+            profile_data = json.loads(profile_data)
+        else:
+            raw = json.dumps(profile_data)
+
+        labels = list(profile_data.keys())
+        scores = []
+        sub_labels = []
+        sub_scores = []
+        sub_max_scores = []
+        dimension_index = []
+        for index, dimension in enumerate(labels):
+            score = profile_data[dimension].get('score')
+            scores.append(float(score) if score is not None else None)
+            for sub_label, sub_dimension in profile_data[dimension].items():
+                # Skip the dimension level 'score' entry
+                if not isinstance(sub_dimension, dict):
+                    continue
+                questions = sub_dimension.get('questions', [])
+                score = sub_dimension.get('score')
+                if score is None:
+                    score = sum(question.get('answer', 0) for question in questions)
+                sub_labels.append(sub_label)
+                sub_scores.append(float(score))
+                sub_max_scores.append(float(len(questions) * MAX_ANSWER_SCORE))
+                dimension_index.append(index)
+        # Hashed now so the JSON text doesn't have to be kept
+        return cls(labels, sub_labels, sub_scores, sub_max_scores, dimension_index, scores=scores,
+                   hash=hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+    # Scores only, without the questions. Suitable for json.dumps.
+    def to_compact(self):
+        return {
+            'labels': self.labels,
+            'scores': self.scores,
+            'sub_labels': self.sub_labels,
+            'sub_scores': self.sub_scores,
+            'sub_max_scores': self.sub_max_scores,
+            'dimension_index': self.dimension_index,
+        }
+
+    # Hash of the stored profile JSON, used to detect stale derived data
+    @property
+    def hash(self):
+        if self._hash is None:
+            source = json.dumps(self.to_compact(), sort_keys=True)
+            self._hash = hashlib.sha1(source.encode('utf-8')).hexdigest()
+        return self._hash
+
+    # (labels, sub_labels, sub_scores, sub_max_scores, dimension_index) with
+    # numpy arrays, in the form returned by profile_scoring.flatten_profile()
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            import numpy as np
+            self._arrays = (self.labels,
+                            self.sub_labels,
+                            np.asarray(self.sub_scores, dtype=float),
+                            np.asarray(self.sub_max_scores, dtype=float),
+                            np.asarray(self.dimension_index, dtype=np.intp))
+        return self._arrays
+
+    # Unrounded percentage of every sub-dimension
+    @property
+    def sub_percentages(self):
+        if self._sub_percentages is None:
+            import numpy as np
+            _, _, sub_scores, sub_max_scores, _ = self.arrays
+            self._sub_percentages = np.divide(sub_scores * 100.0, sub_max_scores,
+                                              out=np.zeros_like(sub_scores), where=sub_max_scores > 0)
+        return self._sub_percentages
+
+    # Percentage of every dimension: the stored score, or for a dimension
+    # without one the unrounded share of its sub-dimension maximum
+    @property
+    def dimension_percentages(self):
+        if self._dimension_percentages is None:
+            import numpy as np
+            labels, _, sub_scores, sub_max_scores, dimension_index = self.arrays
+            totals = np.bincount(dimension_index, weights=sub_scores, minlength=len(labels))
+            maxima = np.bincount(dimension_index, weights=sub_max_scores, minlength=len(labels))
+            percentages = np.divide(totals * 100.0, maxima, out=np.zeros_like(totals), where=maxima > 0)
+            for index, score in enumerate(self.scores):
+                if score is not None:
+                    percentages[index] = score
+            self._dimension_percentages = percentages
+        return self._dimension_percentages
+
+    def __len__(self):
+        return len(self.sub_labels)
+
+    def __repr__(self):
+        return f"Profile({len(self.labels)} dimensions, {len(self.sub_labels)} sub-dimensions)"
@@ -0,0 +1,398 @@
+# src/batch_analysis.py
+#
+# Batch profile analysis.
+#
+# Scans a directory with one folder per user (each holding a
+# profile-data.json, like data/) and generates the profile artifacts for every
+# user in parallel:
+#
+#   dimension-analysis.json   the Dimensional Analysis (same prompt as the
+#                             DimensionAnalysis state)
+#   profile-snapshot.json     spider chart data and a synopsis
+#   roadmap.json              the ThreeStepRoadmap (see roadmap.py)
+#   profile-spider-chart.png  the spider chart
+#
+# The number of users processed at once is bounded by --workers. Finished
+# artifacts are recorded in a checkpoint file, so an interrupted run picks up
+# where it stopped (an artifact is redone when the profile changes). When the
+# API rate limits, every worker backs off together.
+#
+# The tokens and cost of the run are part of the summary. With --db they are
+# also added to the llm_usage table (see usage_ledger.py) under the
+# BatchAnalysis state, for the users that exist in the database.
+#
+#   python batch_analysis.py ../data --workers 16
+#   python batch_analysis.py ../data --db agent.db      # also store the analyses
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from agent import SYSTEM_ROLE, build_messages, completion_params
+from awareness_profile import Profile
+from llm_backends import get_llm_backend
+from llm_client import configure_llm_client
+from profile_compactor import DEFAULT_DETAIL_LEVEL, compact_profile, profile_hash
+from profile_scoring import compute_spider_chart_data
+from prompt_builder import get_token_counter
+from roadmap import generate_roadmap
+from states.state_dimension_analysis import build_analysis_prompt
+from usage_ledger import current_usage_labels, get_usage_ledger, usage_cost, usage_labels
+
+PROFILE_FILE = 'profile-data.json'
+CHECKPOINT_FILE = '.batch-analysis-checkpoint.jsonl'
+
+# Artifact name -> output file
+ARTIFACTS = {
+    'analysis': 'dimension-analysis.json',
+    'snapshot': 'profile-snapshot.json',
+    'roadmap': 'roadmap.json',
+    'chart': 'profile-spider-chart.png',
+}
+
+
+def build_snapshot_prompt(profile_prompt):
+    return {
+        'system_role': SYSTEM_ROLE,
+        'user_prompt': f"""Write a synopsis of the user's self-awareness profile.
+
+        - List the dimensions or sub-dimensions that stand out as strengths and as weaknesses.
+        - Describe how the dimensions relate to and influence each other.
+        - Give overall guidance on where their growth will have the most impact.
+        - Be compassionate with non-judgmental, empathetic and supportive language.
+Awareness Profile:
+{profile_prompt}
+
+JSON Response Format:
+{{
+    "Guidance": "<overall guidance for the user>",
+    "Relationships": [
+        {{ "From": "<dimension>", "To": "<dimension>", "Connection": "<how they are connected>" }}
+    ],
+    "Strengths": [
+        {{ "dimension": "<dimension or sub-dimension>", "description": "<why it is a strength>" }}
+    ],
+    "Weaknesses": [
+        {{ "dimension": "<dimension or sub-dimension>", "description": "<why it is an area for growth>" }}
+    ]
+}}
+"""
+    }
+
+
+# Artifacts finished in earlier runs, appended to as artifacts are written
+class Checkpoint:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # {(user, artifact): profile hash}
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial last line from an interrupted run
+                        continue
+                    self.done[(entry['user'], entry['artifact'])] = entry['profile_hash']
+
+    def is_done(self, user, artifact, digest):
+        with self.lock:
+            return self.done.get((user, artifact)) == digest
+
+    def has(self, user, artifact):
+        with self.lock:
+            return (user, artifact) in self.done
+
+    def record(self, user, artifact, digest):
+        entry = json.dumps({'user': user, 'artifact': artifact, 'profile_hash': digest})
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(entry + '\n')
+            self.done[(user, artifact)] = digest
+
+
+# Shared backoff: when one request is rate limited every worker waits
+class RateLimitBackoff:
+    def __init__(self, base_delay=1.0, max_delay=60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+        self.retries = 0
+
+    def wait(self):
+        with self.lock:
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        delay = retry_after
+        if delay is None:
+            # Exponential backoff with jitter
+            delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+        with self.lock:
+            self.retries += 1
+            self.resume_at = max(self.resume_at, time.monotonic() + delay)
+
+
+class BatchAnalyzer:
+    def __init__(self, data_dir, output_dir=None, workers=8, model='gpt-4o', artifacts=None,
+                 force=False, db=None, max_attempts=6):
+        self.data_dir = data_dir
+        # Artifacts are written next to the profiles unless an output directory is given
+        self.output_dir = output_dir
+        self.workers = workers
+        self.model = model
+        self.artifacts = artifacts or list(ARTIFACTS)
+        # Regenerate every artifact, even those that are done
+        self.force = force
+        # Store the analyses for the users that exist in this Database
+        self.db = db
+        self.max_attempts = max_attempts
+
+        checkpoint_dir = output_dir or data_dir
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint = Checkpoint(os.path.join(checkpoint_dir, CHECKPOINT_FILE))
+        self.backoff = RateLimitBackoff()
+        self.lock = threading.Lock()
+        self.counts = {'generated': 0, 'skipped': 0, 'failed': 0, 'llm_calls': 0,
+                       'prompt_tokens': 0, 'completion_tokens': 0}
+        self.cost = 0.0
+        self.usage_ledger = get_usage_ledger(db) if db is not None else None
+
+    # User folders that contain a profile, sorted by name
+    def find_profiles(self):
+        users = []
+        for name in sorted(os.listdir(self.data_dir)):
+            if os.path.isfile(os.path.join(self.data_dir, name, PROFILE_FILE)):
+                users.append(name)
+        return users
+
+    def run(self):
+        users = self.find_profiles()
+        start = time.monotonic()
+        failed_users = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch-analysis') as executor:
+            futures = {executor.submit(self.process_user, user): user for user in users}
+            for index, future in enumerate(as_completed(futures), 1):
+                user = futures[future]
+                try:
+                    future.result()
+                    status = "done"
+                except Exception as e:
+                    failed_users.append(user)
+                    status = f"failed: {e}"
+                print(f"[{index}/{len(users)}] {user}: {status}", flush=True)
+
+        summary = dict(self.counts)
+        summary.update({
+            'cost_usd': round(self.cost, 4),
+            'users': len(users),
+            'failed_users': failed_users,
+            'rate_limit_retries': self.backoff.retries,
+            'elapsed_seconds': round(time.monotonic() - start, 1),
+        })
+        return summary
+
+    def process_user(self, user):
+        with open(os.path.join(self.data_dir, user, PROFILE_FILE)) as file:
+            # Parsed once for every artifact
+            profile_data = Profile.from_json(file.read())
+        digest = profile_hash(profile_data)
+        output_dir = os.path.join(self.output_dir or self.data_dir, user)
+        os.makedirs(output_dir, exist_ok=True)
+        profile_prompt = None
+        # Usage is only stored for users in the database
+        user_id = None
+        if self.usage_ledger is not None:
+            user_id = self.db.get_user_info(user)['id']
+
+        errors = []
+        for artifact in self.artifacts:
+            path = os.path.join(output_dir, ARTIFACTS[artifact])
+            if not self.force:
+                if self.checkpoint.is_done(user, artifact, digest):
+                    self.count('skipped')
+                    continue
+                if not self.checkpoint.has(user, artifact) and os.path.exists(path):
+                    # Artifacts from outside the batch run are kept
+                    self.count('skipped')
+                    continue
+            if profile_prompt is None:
+                profile_prompt = compact_profile(profile_data, DEFAULT_DETAIL_LEVEL)
+            try:
+                with usage_labels(user_id=user_id, state='BatchAnalysis', sub_state=artifact):
+                    content = self.generate(artifact, user, profile_data, profile_prompt)
+            except Exception as e:
+                self.count('failed')
+                errors.append(f"{artifact}: {e}")
+                continue
+            write_file(path, content)
+            self.checkpoint.record(user, artifact, digest)
+            self.count('generated')
+
+        # Saved per user, like the checkpoint
+        if self.usage_ledger is not None:
+            self.usage_ledger.flush()
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+    # Returns the artifact file content (bytes)
+    def generate(self, artifact, user, profile_data, profile_prompt):
+        if artifact == 'analysis':
+            from response_schemas import DimensionAnalysisResponse
+            analysis = self.complete(build_analysis_prompt(profile_prompt, SYSTEM_ROLE), DimensionAnalysisResponse)
+            if self.db is not None:
+                self.save_analysis(user, analysis)
+            return json_bytes(analysis)
+        if artifact == 'snapshot':
+            snapshot = compute_spider_chart_data(profile_data)
+            snapshot['synopsis'] = self.complete(build_snapshot_prompt(profile_prompt))
+            return json_bytes(snapshot)
+        if artifact == 'roadmap':
+            # Ranked locally, one call for the reasons of all the steps
+            roadmap = generate_roadmap(
+                profile_data,
+                complete=lambda prompt: json.dumps(self.complete(prompt)),
+                system_role=SYSTEM_ROLE)
+            return json_bytes(roadmap)
+        if artifact == 'chart':
+            from chart_renderer import get_chart_renderer
+            return get_chart_renderer().render(compute_spider_chart_data(profile_data), fmt='png')
+        raise ValueError(f"Unknown artifact: {artifact}")
+
+    # One JSON completion, validated against schema like the interactive
+    # path (any JSON object without one). A reply that doesn't decode or
+    # validate is repaired if possible, otherwise asked for again.
+    def complete(self, prompt, schema=None):
+        from response_schemas import JsonObjectResponse, complete_validated
+        response, text = complete_validated(self.complete_text, prompt, schema or JsonObjectResponse)
+        return json.loads(text)
+
+    # The reply text, retried with backoff on rate limits and transient errors
+    def complete_text(self, prompt):
+        import openai
+        retryable = (openai.RateLimitError, openai.APITimeoutError,
+                     openai.APIConnectionError, openai.InternalServerError)
+        backend = get_llm_backend()
+        for attempt in range(self.max_attempts):
+            self.backoff.wait()
+            try:
+                self.count('llm_calls')
+                messages = build_messages(prompt)
+                completion = backend.complete(self.model, messages, completion_params())
+                self.record_usage(messages, completion)
+                return completion.content
+            except retryable as e:
+                if attempt == self.max_attempts - 1:
+                    raise
+                self.backoff.backoff(attempt, retry_after_seconds(e))
+
+    # Add a call to the run's totals and, with a database, the usage ledger.
+    # Estimated when the backend reports no usage.
+    def record_usage(self, messages, completion):
+        estimated = completion.usage is None
+        if estimated:
+            counter = get_token_counter()
+            prompt_tokens = sum(counter.count(message['content']) for message in messages)
+            completion_tokens = counter.count(completion.content)
+        else:
+            prompt_tokens = completion.usage.prompt_tokens
+            completion_tokens = completion.usage.completion_tokens
+        with self.lock:
+            self.counts['prompt_tokens'] += prompt_tokens
+            self.counts['completion_tokens'] += completion_tokens
+            self.cost += usage_cost(self.model, prompt_tokens, completion_tokens)
+        labels = current_usage_labels()
+        if self.usage_ledger is not None and labels.get('user_id') is not None:
+            self.usage_ledger.record(labels['user_id'], labels['state'], labels['sub_state'], self.model,
+                                     prompt_tokens, completion_tokens, estimated=estimated)
+
+    def save_analysis(self, user, analysis):
+        user_info = self.db.get_user_info(user)
+        if user_info['id'] is None:
+            return
+        self.db.save_dimension_analysis(user_info['id'], analysis)
+
+    def count(self, counter):
+        with self.lock:
+            self.counts[counter] += 1
+
+
+# The Retry-After header of a rate limit response, in seconds
+def retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def json_bytes(data):
+    return json.dumps(data, indent=4).encode('utf-8')
+
+
+# Write then rename, so an interrupted run never leaves a partial artifact
+def write_file(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate profile artifacts for a directory of users")
+    parser.add_argument('data_dir', help="Directory with one folder per user containing profile-data.json")
+    parser.add_argument('--output-dir', default=None, help="Write the artifacts here instead of the user folders")
+    parser.add_argument('--workers', type=int, default=8, help="Users processed at once")
+    parser.add_argument('--model', default='gpt-4o')
+    parser.add_argument('--artifacts', default=','.join(ARTIFACTS),
+                        help=f"Comma separated subset of: {', '.join(ARTIFACTS)}")
+    parser.add_argument('--force', action='store_true', help="Regenerate artifacts that are already done")
+    parser.add_argument('--db', default=None, help="Also save the analyses to this database")
+    parser.add_argument('--max-attempts', type=int, default=6, help="Attempts per LLM call")
+    args = parser.parse_args()
+
+    artifacts = [artifact.strip() for artifact in args.artifacts.split(',') if artifact.strip()]
+    for artifact in artifacts:
+        if artifact not in ARTIFACTS:
+            parser.error(f"unknown artifact: {artifact}")
+
+    # One connection per worker. Retries are left to RateLimitBackoff so
+    # that all workers back off together.
+    configure_llm_client(max_connections=max(args.workers, 1), max_retries=0)
+
+    db = None
+    if args.db:
+        from database import Database
+        db = Database(args.db, pool_size=args.workers)
+
+    analyzer = BatchAnalyzer(
+        args.data_dir,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        model=args.model,
+        artifacts=artifacts,
+        force=args.force,
+        db=db,
+        max_attempts=args.max_attempts)
+    try:
+        summary = analyzer.run()
+    finally:
+        if db is not None:
+            db.close()
+    print(json.dumps(summary, indent=2))
+    return 1 if summary['failed_users'] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
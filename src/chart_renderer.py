@@ -0,0 +1,198 @@
+# src/chart_renderer.py
+#
+# Headless spider chart rendering.
+#
+# Charts are drawn on Agg canvases that are never registered with pyplot, so
+# rendering works without a display, from any session thread, and a figure
+# is freed as soon as it is dropped. One figure per label set is kept as a
+# template: the axes, grid and labels are laid out once and each render only
+# replaces the score polygon.
+#
+# Rendered charts are cached by content (labels, scores, format and size).
+# Showing the same chart again is a cache hit, and two users with different
+# scores can never overwrite each other's file.
+#
+#   renderer = get_chart_renderer()
+#   png = renderer.render(data)                    # bytes
+#   svg = renderer.render(data, fmt='svg')
+#   path = renderer.render_to_file(data)           # cached file on disk
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+FORMATS = ['png', 'svg']
+
+
+class ChartTemplate:
+    def __init__(self, labels, figsize, dpi):
+        # matplotlib is imported on first render (see benchmarks/startup_importtime.py)
+        import numpy as np
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        self.lock = threading.Lock()
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(polar=True)
+
+        # Compute angle of each axis and close the loop
+        angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()
+        self.angles = angles + angles[:1]
+
+        self.ax.set_yticklabels([])
+        self.ax.set_xticks(angles)
+        self.ax.set_xticklabels(labels)
+        self.ax.set_ylim(0, 100)
+        # Lay out once, the labels don't change between renders
+        self.figure.tight_layout()
+
+        self.fill = None
+        self.line, = self.ax.plot([], [], color='red', linewidth=2)
+
+    def render(self, scores, fmt):
+        values = list(scores) + list(scores[:1])
+        with self.lock:
+            if self.fill is not None:
+                self.fill.remove()
+            self.fill, = self.ax.fill(self.angles, values, color='red', alpha=0.25)
+            self.line.set_data(self.angles, values)
+            self.ax.set_ylim(0, max(100, max(values)))
+            buffer = io.BytesIO()
+            self.figure.savefig(buffer, format=fmt)
+        return buffer.getvalue()
+
+    def close(self):
+        with self.lock:
+            self.figure.clear()
+
+
+class ChartRenderer:
+    def __init__(self, cache_dir=None, max_cached=None, max_templates=None, figsize=(8, 8), dpi=100):
+        self.cache_dir = cache_dir or os.getenv(
+            "AGENT_CHART_CACHE_DIR", os.path.join(tempfile.gettempdir(), 'awareness-agent-charts'))
+        # Rendered charts kept in memory
+        self.max_cached = int(max_cached or os.getenv("AGENT_CHART_CACHE_ENTRIES", 256))
+        # Figure templates kept alive (one per label set)
+        self.max_templates = int(max_templates or os.getenv("AGENT_CHART_TEMPLATES", 4))
+        self.figsize = figsize
+        self.dpi = dpi
+
+        self.lock = threading.Lock()
+        # {key: bytes}, least recently used first
+        self.cache = OrderedDict()
+        # {labels: ChartTemplate}, least recently used first
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.renders = 0
+
+    # Content address of a chart
+    def make_key(self, labels, scores, fmt):
+        key = json.dumps({
+            'labels': list(labels),
+            'scores': [round(float(score), 2) for score in scores],
+            'format': fmt,
+            'figsize': list(self.figsize),
+            'dpi': self.dpi,
+        })
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    # Render the chart for compute_spider_chart_data() output to bytes
+    def render(self, data, fmt='png'):
+        return self.render_chart(data, fmt)[1]
+
+    # Render the chart and return the path of its cached file
+    def render_to_file(self, data, fmt='png'):
+        key, content = self.render_chart(data, fmt)
+        path = os.path.join(self.cache_dir, f"spider-chart-{key}.{fmt}")
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write then rename so a reader never sees a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=f".{fmt}")
+            with os.fdopen(fd, 'wb') as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+        return path
+
+    # Returns (key, content)
+    def render_chart(self, data, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown chart format: {fmt}")
+        labels = tuple(data['spiderChartData']['labels'])
+        scores = [float(score) for score in data['spiderChartData']['scores']]
+        key = self.make_key(labels, scores, fmt)
+
+        with self.lock:
+            content = self.cache.get(key)
+            if content is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return key, content
+            self.misses += 1
+
+        content = self.get_template(labels).render(scores, fmt)
+
+        with self.lock:
+            self.renders += 1
+            self.cache[key] = content
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return key, content
+
+    def get_template(self, labels):
+        with self.lock:
+            template = self.templates.get(labels)
+            if template is not None:
+                self.templates.move_to_end(labels)
+                return template
+        template = ChartTemplate(labels, self.figsize, self.dpi)
+        evicted = []
+        with self.lock:
+            # Another thread may have built the same template meanwhile
+            existing = self.templates.get(labels)
+            if existing is not None:
+                evicted.append(template)
+                template = existing
+            else:
+                self.templates[labels] = template
+                while len(self.templates) > self.max_templates:
+                    evicted.append(self.templates.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        return template
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'renders': self.renders,
+                'cached': len(self.cache),
+                'templates': len(self.templates),
+            }
+
+    def close(self):
+        with self.lock:
+            templates = list(self.templates.values())
+            self.templates.clear()
+            self.cache.clear()
+        for template in templates:
+            template.close()
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+# Return the process-wide chart renderer
+def get_chart_renderer():
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = ChartRenderer()
+        return _renderer
@@ -1,13 +1,355 @@
 # src/database.py
+import functools
 import json
+import os
+import queue
 import sqlite3
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import quote
+
+from awareness_profile import Profile
+from tracing import bind_context, span
+
+# Schema migrations, applied in order on top of the tables created by
+# create_tables(). The number of applied migrations is stored in the
+# database's PRAGMA user_version, so each migration runs exactly once.
+# Add new migrations to the end of the list; never edit an applied one.
+SCHEMA_MIGRATIONS = [
+    # 1: Indexes for the per turn lookups, and the unique keys that the
+    #    INSERT OR REPLACE statements in save_state and save_user_goals need
+    #    to replace rows rather than append them.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_context (
+            user_id INTEGER PRIMARY KEY,
+            context TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp ON conversations (user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_user_state_timestamp ON conversations (user_id, state, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_dimension_analysis_user ON dimension_analysis (user_id)',
+        # Keep only the newest row of any duplicates before adding the unique keys
+        'DELETE FROM state WHERE id NOT IN (SELECT MAX(id) FROM state GROUP BY user_id, state, sub_state)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_state_user_state_sub_state ON state (user_id, state, sub_state)',
+        'DELETE FROM user_goals WHERE id NOT IN (SELECT MAX(id) FROM user_goals GROUP BY user_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_user_goals_user ON user_goals (user_id)',
+    ],
+    # 2: Roadmaps from the roadmap engine, keyed by the profile they were
+    #    ranked from so a changed profile gets a new roadmap.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS roadmaps (
+            user_id INTEGER PRIMARY KEY,
+            profile_hash TEXT,
+            roadmap TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        ''',
+    ],
+    # 3: Token usage and cost per user, state, sub state, model and day
+    #    (see usage_ledger.py). Rows are added to, never replaced.
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS llm_usage (
+            user_id INTEGER,
+            state TEXT,
+            sub_state TEXT,
+            model TEXT,
+            day TEXT,
+            calls INTEGER NOT NULL DEFAULT 0,
+            estimated_calls INTEGER NOT NULL DEFAULT 0,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cost_usd REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, state, sub_state, model),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_llm_usage_day ON llm_usage (day)',
+    ],
+    # 4: One dimension analysis per user, so save_dimension_analysis can
+    #    replace it instead of appending rows that get_dimension_analysis
+    #    picks from in no particular order. The newest analysis is kept.
+    [
+        'DELETE FROM dimension_analysis WHERE id NOT IN (SELECT MAX(id) FROM dimension_analysis GROUP BY user_id)',
+        'DROP INDEX IF EXISTS idx_dimension_analysis_user',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_dimension_analysis_user ON dimension_analysis (user_id)',
+    ],
+    # 5: Dimension percentages are the scores stored in the profile again, so
+    #    the prompts and roadmaps derived from the aggregated ones are redone.
+    [
+        'DELETE FROM compact_profiles',
+        'DELETE FROM roadmaps',
+    ],
+]
+
+# Columns llm_usage rollups can be grouped by
+LLM_USAGE_COLUMNS = ['user_id', 'state', 'sub_state', 'model', 'day']
+
+# Queries run on every turn, used by check_query_plans().
+# name: (query, example parameters)
+HOT_QUERIES = {
+    'conversation_events': (
+        'SELECT id, message FROM (SELECT id, timestamp, message FROM conversations WHERE user_id = ? AND id > ? ORDER BY timestamp DESC, id DESC LIMIT ?) ORDER BY timestamp ASC, id ASC',
+        (1, 0, 10)),
+    'conversation_events_by_state': (
+        'SELECT id, message FROM (SELECT id, timestamp, message FROM conversations WHERE user_id = ? AND id > ? AND state = ? ORDER BY timestamp DESC, id DESC LIMIT ?) ORDER BY timestamp ASC, id ASC',
+        (1, 0, 'Onboarding', 10)),
+    'new_conversation_events_by_state': (
+        'SELECT COUNT(*) FROM (SELECT 1 FROM conversations WHERE user_id = ? AND id > ? AND state = ? LIMIT ?)',
+        (1, 0, 'Onboarding', 10)),
+    'conversation_summary': (
+        'SELECT summary, last_event_id FROM conversation_summaries WHERE user_id = ? AND state = ?',
+        (1, '')),
+    'state': (
+        'SELECT state_data FROM state WHERE user_id = ? AND state = ? AND sub_state = ?',
+        (1, 'Onboarding', 'OnboardingGoals')),
+    'dimension_analysis': (
+        'SELECT analysis FROM dimension_analysis WHERE user_id = ?',
+        (1,)),
+    'user_goals': (
+        'SELECT goals FROM user_goals WHERE user_id = ?',
+        (1,)),
+}
+
+
+# A bounded pool of sqlite connections shared by the threads of a process
+class ConnectionPool:
+    def __init__(self, connect, max_connections):
+        self.connect = connect
+        self.max_connections = max_connections
+        self.idle = queue.LifoQueue()
+        self.available = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def acquire(self, timeout=None):
+        if not self.available.acquire(timeout=timeout):
+            raise TimeoutError("Timed out waiting for a database connection")
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            conn = self.connect()
+        except Exception:
+            self.available.release()
+            raise
+        with self.lock:
+            self.connections.append(conn)
+        return conn
+
+    def release(self, conn):
+        # Never hand out a connection with a half finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+        self.available.release()
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections:
+                conn.close()
+            self.connections = []
+
+
+# Run a Database method with a pooled connection bound to the calling thread.
+# Traced as db.<method>, including the wait for a connection.
+def pooled(method):
+    span_name = f"db.{method.__name__}"
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with span(span_name):
+            with self.connection():
+                return method(self, *args, **kwargs)
+    return wrapper
+
 
 class Database:
-    def __init__(self, db_file='agent.db'):
-        self.conn = sqlite3.connect(db_file)
-        self.create_tables()
+    # read_only opens an existing database for reports, without creating or
+    # migrating its tables
+    def __init__(self, db_file='agent.db', pool_size=None, read_only=False):
+        self.db_file = db_file
+        self.read_only = read_only
+        pool_size = int(pool_size or os.getenv("AGENT_DB_POOL_SIZE", 8))
+        if db_file == ':memory:':
+            # Every connection to ':memory:' is a separate database
+            pool_size = 1
+        self.pool = ConnectionPool(self.connect, pool_size)
+        # Per thread connection and transaction depth
+        self.local = threading.local()
+        if not read_only:
+            self.create_tables()
+            self.migrate()
+
+    # Open a connection configured for many short write transactions
+    def connect(self):
+        if self.read_only:
+            conn = sqlite3.connect(
+                f"file:{quote(os.path.abspath(self.db_file))}?mode=ro", uri=True, check_same_thread=False)
+            conn.execute('PRAGMA busy_timeout = 5000')
+            return conn
+        conn = sqlite3.connect(
+            self.db_file,
+            # Pooled connections move between threads (one thread at a time)
+            check_same_thread=False)
+        if self.db_file != ':memory:':
+            # WAL lets readers run alongside a writer and turns each commit
+            # into a sequential append to the log
+            conn.execute('PRAGMA journal_mode = WAL')
+        # In WAL mode NORMAL only syncs at checkpoints. The database stays
+        # consistent after a crash; the last few commits may be lost on power loss.
+        synchronous = os.getenv("AGENT_DB_SYNCHRONOUS", "NORMAL")
+        conn.execute(f'PRAGMA synchronous = {synchronous}')
+        # Wait for other writers instead of failing with "database is locked"
+        conn.execute('PRAGMA busy_timeout = 5000')
+        return conn
+
+    # The connection bound to the calling thread. Only valid inside a
+    # @pooled method or a transaction() block.
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            raise RuntimeError("No database connection is bound to this thread")
+        return conn
+
+    @property
+    def transaction_depth(self):
+        return getattr(self.local, 'transaction_depth', 0)
+
+    # Bind a pooled connection to the calling thread for the duration of the
+    # block. The connection goes back to the pool afterwards, unless it holds
+    # uncommitted writes of an open transaction() block.
+    @contextmanager
+    def connection(self):
+        if getattr(self.local, 'conn', None) is not None:
+            yield self.local.conn
+            return
+        conn = self.pool.acquire()
+        self.local.conn = conn
+        try:
+            yield conn
+        finally:
+            if not (self.transaction_depth > 0 and conn.in_transaction):
+                self.local.conn = None
+                self.pool.release(conn)
+
+    # Unit of work: the writes made inside the block are committed together
+    # when the outermost block exits, and rolled back if it raises. The block
+    # only holds a pooled connection from its first write onwards.
+    #
+    #   with db.transaction():
+    #       db.save_conversation_state(...)
+    #       db.save_agent_state(...)
+    @contextmanager
+    def transaction(self):
+        self.local.transaction_depth = self.transaction_depth + 1
+        try:
+            yield self
+        except Exception:
+            self._end_transaction(commit=False)
+            raise
+        except BaseException:
+            # Keep the work done so far on exit()/Ctrl-C
+            self._end_transaction(commit=True)
+            raise
+        else:
+            self._end_transaction(commit=True)
+
+    # Commit the writes made so far in the open transaction() block and give
+    # its connection back to the pool. The block goes on, holding a connection
+    # again from its next write. Called before waiting on the user, so a turn
+    # doesn't keep the write lock and a pool slot while the user types.
+    def commit_pending(self):
+        if self.transaction_depth == 0:
+            return
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            return
+        self.local.conn = None
+        try:
+            conn.commit()
+        finally:
+            self.pool.release(conn)
+
+    def _end_transaction(self, commit):
+        self.local.transaction_depth -= 1
+        if self.transaction_depth > 0:
+            return
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            return
+        self.local.conn = None
+        try:
+            if commit:
+                conn.commit()
+            else:
+                conn.rollback()
+        finally:
+            self.pool.release(conn)
+
+    # Commit unless a transaction() block is open
+    def commit(self):
+        if self.transaction_depth == 0:
+            self.conn.commit()
+
+    # Apply any schema migrations that have not been applied yet
+    @pooled
+    def migrate(self):
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        for new_version in range(version + 1, len(SCHEMA_MIGRATIONS) + 1):
+            cursor.execute('BEGIN')
+            try:
+                for statement in SCHEMA_MIGRATIONS[new_version - 1]:
+                    cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {new_version}')
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    @pooled
+    def schema_version(self):
+        cursor = self.conn.cursor()
+        cursor.execute('PRAGMA user_version')
+        return cursor.fetchone()[0]
 
+    # Return the EXPLAIN QUERY PLAN details for a query
+    @pooled
+    def explain_query_plan(self, query, params=()):
+        cursor = self.conn.cursor()
+        cursor.execute(f'EXPLAIN QUERY PLAN {query}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+    # Check that none of the per turn queries does a full table scan.
+    # Returns the plans by query name and raises an AssertionError naming the
+    # queries that scan a table.
+    def check_query_plans(self):
+        plans = {}
+        full_scans = []
+        for name, (query, params) in HOT_QUERIES.items():
+            plan = self.explain_query_plan(query, params)
+            plans[name] = plan
+            for detail in plan:
+                # 'SCAN <table>' without an index is a full table scan, and so
+                # is a rowid range search; scanning a subquery result is fine
+                table_scan = detail.startswith('SCAN') and 'INDEX' not in detail and 'subquery' not in detail
+                rowid_range = 'rowid>' in detail or 'rowid<' in detail
+                if table_scan or rowid_range:
+                    full_scans.append(f"{name}: {detail}")
+        if full_scans:
+            raise AssertionError(f"Full table scans in hot queries: {full_scans}")
+        return plans
+
+    @pooled
     def create_tables(self):
         cursor = self.conn.cursor()
         # Create users table
@@ -26,8 +368,8 @@ class Database:
 
         # Create agent_state table
         # Drop the table first
-        cursor.execute('DROP TABLE IF EXISTS agent_state')
-        self.conn.commit()
+        #cursor.execute('DROP TABLE IF EXISTS agent_state')
+        #self.conn.commit()
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS agent_state (
                 user_id INTEGER PRIMARY KEY,
@@ -52,6 +394,21 @@ class Database:
         ''')
         self.conn.commit()
 
+        # Create a table for the rolling conversation summaries.
+        # state is '' for the summary across all states.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id INTEGER,
+                state TEXT,
+                summary TEXT,
+                last_event_id INTEGER,
+                timestamp TIMESTAMP,
+                PRIMARY KEY(user_id, state),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        ''')
+        self.conn.commit()
+
         # Create Dimension Analysis table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS dimension_analysis (
@@ -77,6 +434,19 @@ class Database:
         ''')
         self.conn.commit()
 
+        # Create a table for the compacted profiles injected into prompts
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS compact_profiles (
+                user_id INTEGER,
+                detail_level TEXT,
+                profile_hash TEXT,
+                profile TEXT,
+                PRIMARY KEY(user_id, detail_level),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        ''')
+        self.conn.commit()
+
         # Createa  table for storing user goals
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS user_goals (
@@ -91,6 +461,7 @@ class Database:
 
     # Save user information to the database
     # Insert if it is new, otherwise update
+    @pooled
     def save_user_info(self, user_info):
         cursor = self.conn.cursor()
         cursor.execute('''
@@ -110,13 +481,19 @@ class Database:
             user_info.get('language'),
             user_info.get('dimensions')
         ))
-        self.conn.commit()
+        self.commit()
         # Check if a new row was inserted and add the 'id' to the user_info dictionary
         if cursor.lastrowid:
             user_info['id'] = cursor.lastrowid
+        if user_info.get('dimensions') and 'profile' not in user_info:
+            user_info['profile'] = Profile.from_json(user_info['dimensions'])
+        # Sessions work from the Profile, the JSON is read again when needed
+        # (get_profile_data)
+        user_info.pop('dimensions', None)
 
         return user_info
 
+    @pooled
     def get_user_info(self, username):
         cursor = self.conn.cursor()
         cursor.execute('SELECT id, birthdate, gender, culture, language, dimensions FROM users WHERE username = ?', (username,))
@@ -129,11 +506,22 @@ class Database:
                 'gender': row[2],
                 'culture': row[3],
                 'language': row[4],
-                'dimensions': row[5 ]
+                # Parsed once here, the sessions work from the Profile. The
+                # JSON itself is not kept (see get_profile_data).
+                'profile': Profile.from_json(row[5]) if row[5] else None
             }
         else:
-            return {'id': None, 'username': None, 'birthdate': None, 'gender': None, 'culture': None, 'language': None, 'dimensions': None}
+            return {'id': None, 'username': None, 'birthdate': None, 'gender': None, 'culture': None, 'language': None, 'profile': None}
 
+    # The user's profile-data.json as stored
+    @pooled
+    def get_profile_data(self, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT dimensions FROM users WHERE id = ?', (user_id,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
+    @pooled
     def save_user_info_field(self, user_id, field_name, field_value):
         cursor = self.conn.cursor()
         cursor.execute(f'''
@@ -141,8 +529,48 @@ class Database:
             SET {field_name} = ?
             WHERE id = ?
         ''', (field_value, user_id))
-        self.conn.commit()
+        self.commit()
+
+    # Get a compacted profile. Returns (profile_hash, profile) or None
+    @pooled
+    def get_compact_profile(self, user_id, detail_level):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT profile_hash, profile FROM compact_profiles WHERE user_id = ? AND detail_level = ?', (user_id, detail_level))
+        return cursor.fetchone()
 
+    # Save a compacted profile and replace it if it already exists
+    @pooled
+    def save_compact_profile(self, user_id, detail_level, profile_hash, profile):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO compact_profiles (user_id, detail_level, profile_hash, profile)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, detail_level, profile_hash, profile))
+        self.commit()
+
+    # Get the user's roadmap. Returns (profile_hash, roadmap) or None
+    @pooled
+    def get_roadmap(self, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT profile_hash, roadmap FROM roadmaps WHERE user_id = ?', (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    # Save the user's roadmap and replace it if it already exists
+    @pooled
+    def save_roadmap(self, user_id, profile_hash, roadmap):
+        if isinstance(roadmap, dict):
+            roadmap = json.dumps(roadmap)
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO roadmaps (user_id, profile_hash, roadmap)
+            VALUES (?, ?, ?)
+        ''', (user_id, profile_hash, roadmap))
+        self.commit()
+
+    @pooled
     def save_profile(self, user_id, profile_data):
         cursor = self.conn.cursor()
         # Delete existing profile data for the user
@@ -153,8 +581,9 @@ class Database:
                 INSERT INTO profiles (user_id, dimension, score)
                 VALUES (?, ?, ?)
             ''', (user_id, dimension, score))
-        self.conn.commit()
+        self.commit()
 
+    @pooled
     def get_profile(self, user_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT dimension, score FROM profiles WHERE user_id = ?', (user_id,))
@@ -164,6 +593,7 @@ class Database:
             profile[dimension] = score
         return profile
 
+    @pooled
     def save_agent_state(self, user_id, state):
         cursor = self.conn.cursor()
         timestamp = datetime.now()
@@ -171,20 +601,24 @@ class Database:
             INSERT OR REPLACE INTO agent_state (user_id, state, last_updated)
             VALUES (?, ?, ?)
         ''', (user_id, state, timestamp))
-        self.conn.commit()
+        self.commit()
 
+    @pooled
     def get_agent_state(self, user_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT state FROM agent_state WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
         return result[0] if result else None
 
+    @pooled
     def get_dimension_analysis(self, user_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT analysis FROM dimension_analysis WHERE user_id = ?', (user_id,))
         result = cursor.fetchone()
         return result[0] if result else None
 
+    # Save the user's dimension analysis and replace it if it already exists
+    @pooled
     def save_dimension_analysis(self, user_id, analysis):
         # convert analysis to a json string if it is a dict
         if isinstance(analysis, dict):
@@ -193,47 +627,102 @@ class Database:
         cursor.execute('''
             INSERT INTO dimension_analysis (user_id, analysis)
             VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET analysis = excluded.analysis
         ''', (user_id, analysis))
-        self.conn.commit()
+        self.commit()
 
+    @pooled
     def delete_dimension_analysis(self, user_id):
         cursor = self.conn.cursor()
         cursor.execute('DELETE FROM dimension_analysis WHERE user_id = ?', (user_id,))
-        self.conn.commit()
+        self.commit()
 
-    def save_conversation_event(self, user_id, state, message):
+    @pooled
+    def save_conversation_event(self, user_id, state, message, timestamp=None):
 
         cursor = self.conn.cursor()
-        timestamp = datetime.now()
+        if timestamp is None:
+            timestamp = datetime.now()
         cursor.execute('''
             INSERT INTO conversations (user_id, timestamp, state, message)
             VALUES (?, ?, ?, ?)
         ''', (user_id, timestamp, state, message))
-        self.conn.commit()
+        self.commit()
+
+    # Get conversation event rows as (id, message), ordered from oldest to newest.
+    # Only events with an id greater than after_id are returned. With num_events
+    # set, the most recent num_events of those are returned, with limit the
+    # oldest limit of them.
+    @pooled
+    def get_conversation_event_rows(self, user_id, state=None, num_events=None, after_id=0, limit=None):
+        cursor = self.conn.cursor()
+        query = 'SELECT id, timestamp, message FROM conversations WHERE user_id = ? AND id > ?'
+        params = [user_id, after_id or 0]
+        if state is not None:
+            query += ' AND state = ?'
+            params.append(state)
+        if num_events is not None:
+            query += ' ORDER BY timestamp DESC, id DESC LIMIT ?'
+            params.append(num_events)
+        elif limit is not None:
+            query += ' ORDER BY timestamp ASC, id ASC LIMIT ?'
+            params.append(limit)
+        cursor.execute(f'SELECT id, message FROM ({query}) ORDER BY timestamp ASC, id ASC', params)
+        return cursor.fetchall()
 
-    def get_conversation_events(self, user_id, state=None, num_events=10):
+    # Number of conversation events with an id greater than after_id. With
+    # limit set, counting stops there.
+    @pooled
+    def count_conversation_events(self, user_id, state=None, after_id=0, limit=None):
         cursor = self.conn.cursor()
-        state_str = ""
-        if state != None:
-            state_str = f"AND state = '{state}'"
+        query = 'SELECT 1 FROM conversations WHERE user_id = ? AND id > ?'
+        params = [user_id, after_id or 0]
+        if state is not None:
+            query += ' AND state = ?'
+            params.append(state)
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        cursor.execute(f'SELECT COUNT(*) FROM ({query})', params)
+        return cursor.fetchone()[0]
 
+    def get_conversation_events(self, user_id, state=None, num_events=10, after_id=0):
         # Get the last 10 conversation events ordered from oldest to newest
-        cursor.execute(f'SELECT message FROM conversations WHERE user_id = ? {state_str} ORDER BY timestamp ASC LIMIT {num_events}', (user_id,))
         conversation = ""
-        rows = cursor.fetchall()
+        rows = self.get_conversation_event_rows(user_id, state, num_events, after_id)
         for row in rows:
-            conversation += row[0] + "\n"
+            conversation += row[1] + "\n"
         return conversation
 
+    # Get the rolling conversation summary for a user and state (None for all
+    # states). Returns (summary, last_event_id) or None.
+    @pooled
+    def get_conversation_summary(self, user_id, state=None):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT summary, last_event_id FROM conversation_summaries WHERE user_id = ? AND state = ?', (user_id, state or ''))
+        return cursor.fetchone()
+
+    # Save the rolling conversation summary and replace it if it already exists
+    @pooled
+    def save_conversation_summary(self, user_id, state, summary, last_event_id):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO conversation_summaries (user_id, state, summary, last_event_id, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, state or '', summary, last_event_id, datetime.now()))
+        self.commit()
+
     # Save th conversation state and repalce it if it already exists
+    @pooled
     def save_conversation_state(self, user_id, context):
         cursor = self.conn.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO conversation_context (user_id, context)
             VALUES (?, ?)
         ''', (user_id, context))
-        self.conn.commit()
+        self.commit()
 
+    @pooled
     def get_conversation_state(self, user_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT context FROM conversation_context WHERE user_id = ?', (user_id,))
@@ -242,6 +731,7 @@ class Database:
         return context
 
     # Get a state context
+    @pooled
     def get_state(self, user_id, state, sub_state):
         cursor = self.conn.cursor()
         cursor.execute('SELECT state_data FROM state WHERE user_id = ? AND state = ? AND sub_state = ?', (user_id, state, sub_state))
@@ -250,15 +740,17 @@ class Database:
         return state_data
 
     # Save a state context
+    @pooled
     def save_state(self, user_id, state, sub_state, state_data):
         cursor = self.conn.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO state (user_id, state, sub_state, state_data, timestamp)
             VALUES (?, ?, ?, ?, ?)
         ''', (user_id, state, sub_state, json.dumps(state_data), datetime.now()))
-        self.conn.commit()
+        self.commit()
 
     # Get user goals
+    @pooled
     def get_user_goals(self, user_id):
         cursor = self.conn.cursor()
         cursor.execute('SELECT goals FROM user_goals WHERE user_id = ?', (user_id,))
@@ -267,13 +759,129 @@ class Database:
         return goals
 
     # Save user goals
+    @pooled
     def save_user_goals(self, user_id, goals):
         cursor = self.conn.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO user_goals (user_id, goals)
             VALUES (?, ?)
         ''', (user_id, json.dumps(goals)))
-        self.conn.commit()
+        self.commit()
+
+    # Add token usage to the daily totals. rows are (user_id, state,
+    # sub_state, model, day, calls, estimated_calls, prompt_tokens,
+    # completion_tokens, cost_usd) tuples.
+    @pooled
+    def save_llm_usage(self, rows):
+        cursor = self.conn.cursor()
+        cursor.executemany('''
+            INSERT INTO llm_usage (user_id, state, sub_state, model, day, calls, estimated_calls,
+                                   prompt_tokens, completion_tokens, cost_usd)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, day, state, sub_state, model) DO UPDATE SET
+                calls = calls + excluded.calls,
+                estimated_calls = estimated_calls + excluded.estimated_calls,
+                prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                completion_tokens = completion_tokens + excluded.completion_tokens,
+                cost_usd = cost_usd + excluded.cost_usd
+        ''', rows)
+        self.commit()
+
+    # Tokens a user has used on a day (YYYY-MM-DD)
+    @pooled
+    def get_llm_usage_tokens(self, user_id, day):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0)
+            FROM llm_usage WHERE user_id = ? AND day = ?
+        ''', (user_id, day))
+        return cursor.fetchone()[0]
+
+    # Token usage and cost summed by the group_by columns (see
+    # LLM_USAGE_COLUMNS), most expensive first. Returns a list of dicts.
+    @pooled
+    def get_llm_usage(self, group_by=('state', 'sub_state', 'model'), user_id=None, since=None, until=None):
+        group_by = list(group_by)
+        unknown = [column for column in group_by if column not in LLM_USAGE_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cannot group llm_usage by: {', '.join(unknown)}")
+        conditions, params = [], []
+        if user_id is not None:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if since is not None:
+            conditions.append('day >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('day <= ?')
+            params.append(until)
+        columns = ', '.join(group_by)
+        query = f'''
+            SELECT {columns + ',' if columns else ''} SUM(calls), SUM(estimated_calls),
+                   SUM(prompt_tokens), SUM(completion_tokens), SUM(cost_usd)
+            FROM llm_usage
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            {'GROUP BY ' + columns if columns else ''}
+            ORDER BY SUM(cost_usd) DESC
+        '''
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        names = group_by + ['calls', 'estimated_calls', 'prompt_tokens', 'completion_tokens', 'cost_usd']
+        return [dict(zip(names, row)) for row in cursor.fetchall() if row[len(group_by)] is not None]
 
     def close(self):
-        self.conn.close()
+        self.pool.close()
+
+
+# Async access layer over a Database for code running on an event loop.
+# Every Database method is available as a coroutine that runs the query on a
+# small thread pool (sized like the connection pool), so the loop never blocks
+# on sqlite.
+#
+#   adb = AsyncDatabase(db)
+#   await adb.save_conversation_state(user_id, context)
+#   await adb.run_in_transaction(lambda db: (db.save_state(...), db.save_agent_state(...)))
+class AsyncDatabase:
+    def __init__(self, db, executor=None):
+        self.db = db
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=db.pool.max_connections,
+            thread_name_prefix='async-database')
+
+    # Run any blocking function on the database threads
+    async def call(self, fn, *args, **kwargs):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        # Traced as part of the calling task's span
+        return await loop.run_in_executor(self.executor, bind_context(functools.partial(fn, *args, **kwargs)))
+
+    # Run fn(db) in a single transaction on one database thread
+    async def run_in_transaction(self, fn):
+        def run():
+            with self.db.transaction():
+                return fn(self.db)
+        return await self.call(run)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args, **kwargs):
+            return await self.call(attr, *args, **kwargs)
+        return method
+
+
+_async_databases = weakref.WeakKeyDictionary()
+_async_databases_lock = threading.Lock()
+
+
+# The AsyncDatabase for a Database, shared so that every async session uses
+# the same database threads
+def get_async_database(db):
+    with _async_databases_lock:
+        adb = _async_databases.get(db)
+        if adb is None:
+            adb = AsyncDatabase(db)
+            _async_databases[db] = adb
+        return adb
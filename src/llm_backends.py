@@ -0,0 +1,456 @@
+# src/llm_backends.py
+#
+# Pluggable LLM backends.
+#
+# Every completion goes through the process-wide backend returned by
+# get_llm_backend(), selected with AGENT_LLM_BACKEND:
+#
+#   openai   the OpenAI API (default)
+#   record   the OpenAI API, saving every request/response pair to
+#            AGENT_LLM_RECORDING (default llm-recording.jsonl)
+#   replay   answers from AGENT_LLM_RECORDING without any network access. A
+#            request that was not recorded raises ReplayMissError, or is
+#            answered by the fake backend with AGENT_LLM_REPLAY_FALLBACK=fake.
+#            AGENT_LLM_REPLAY_REALTIME=1 waits as long as the recorded call took.
+#   fake     canned replies in the format each prompt asks for, after
+#            AGENT_FAKE_LLM_LATENCY_MS and at AGENT_FAKE_LLM_TOKENS_PER_SECOND
+#
+# Replay and fake make runs offline and deterministic, so our own overhead
+# can be measured separately from the model's latency.
+#
+#   backend = get_llm_backend()
+#   completion = backend.complete('gpt-4o', messages, params)
+#   completion.content, completion.usage
+#   for text in backend.stream('gpt-4o', messages, params, on_usage=usages.append): ...
+#
+# A stream calls on_usage(usage) once it has ended, if the backend knows the
+# token counts.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+
+class Usage:
+    def __init__(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+
+
+class Completion:
+    def __init__(self, content, usage=None):
+        self.content = content
+        # Usage or None when the backend doesn't know the token counts
+        self.usage = usage
+
+
+class ReplayMissError(KeyError):
+    pass
+
+
+# Key of a request in the recording
+def report_usage(on_usage, usage):
+    if on_usage is not None and usage is not None:
+        on_usage(usage)
+
+
+def request_key(model, messages, params):
+    key_data = json.dumps({'model': model, 'messages': messages, 'params': params}, sort_keys=True)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+
+class LLMBackend:
+    def complete(self, model, messages, params):
+        raise NotImplementedError
+
+    # Yields the content as it is generated
+    def stream(self, model, messages, params, on_usage=None):
+        completion = self.complete(model, messages, params)
+        yield completion.content
+        report_usage(on_usage, completion.usage)
+
+    async def complete_async(self, model, messages, params):
+        raise NotImplementedError
+
+    async def stream_async(self, model, messages, params, on_usage=None):
+        completion = await self.complete_async(model, messages, params)
+        yield completion.content
+        report_usage(on_usage, completion.usage)
+
+    def close(self):
+        pass
+
+
+class OpenAIBackend(LLMBackend):
+    def complete(self, model, messages, params):
+        from llm_client import get_llm_client
+        completion = get_llm_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            **params
+        )
+        return Completion(completion.choices[0].message.content, completion.usage)
+
+    # The last chunk of the stream has no choices, only the usage
+    def stream(self, model, messages, params, on_usage=None):
+        from llm_client import get_llm_client
+        stream = get_llm_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            report_usage(on_usage, getattr(chunk, 'usage', None))
+
+    async def complete_async(self, model, messages, params):
+        from llm_client import get_async_llm_client
+        completion = await get_async_llm_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            **params
+        )
+        return Completion(completion.choices[0].message.content, completion.usage)
+
+    async def stream_async(self, model, messages, params, on_usage=None):
+        from llm_client import get_async_llm_client
+        stream = await get_async_llm_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            report_usage(on_usage, getattr(chunk, 'usage', None))
+
+    def close(self):
+        from llm_client import close_llm_client
+        close_llm_client()
+
+
+# Recorded responses, one JSON object per line:
+#   {"k": request key, "m": model, "r": response, "u": [prompt, completion tokens], "t": seconds}
+# The prompts are not stored, only their key. A request recorded twice keeps
+# the last response.
+class RecordingStore:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Partial last line from an interrupted recording
+                        continue
+                    self.entries[entry['k']] = entry
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, model, response, usage=None, elapsed=None):
+        entry = {'k': key, 'm': model, 'r': response}
+        if usage is not None:
+            entry['u'] = [usage.prompt_tokens, usage.completion_tokens]
+        if elapsed is not None:
+            entry['t'] = round(elapsed, 3)
+        line = json.dumps(entry, separators=(',', ':'))
+        with self.lock:
+            with open(self.path, 'a') as file:
+                file.write(line + '\n')
+            self.entries[key] = entry
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+
+# Passes requests to another backend and records the responses
+class RecordingBackend(LLMBackend):
+    def __init__(self, backend, store):
+        self.backend = backend
+        self.store = store
+
+    def complete(self, model, messages, params):
+        start = time.monotonic()
+        completion = self.backend.complete(model, messages, params)
+        self.store.put(request_key(model, messages, params), model, completion.content,
+                       completion.usage, time.monotonic() - start)
+        return completion
+
+    def stream(self, model, messages, params, on_usage=None):
+        start = time.monotonic()
+        chunks = []
+        usages = []
+        for text in self.backend.stream(model, messages, params, on_usage=usages.append):
+            chunks.append(text)
+            yield text
+        usage = usages[-1] if usages else None
+        # Only complete responses are recorded
+        self.store.put(request_key(model, messages, params), model, ''.join(chunks),
+                       usage, time.monotonic() - start)
+        report_usage(on_usage, usage)
+
+    async def complete_async(self, model, messages, params):
+        start = time.monotonic()
+        completion = await self.backend.complete_async(model, messages, params)
+        self.store.put(request_key(model, messages, params), model, completion.content,
+                       completion.usage, time.monotonic() - start)
+        return completion
+
+    async def stream_async(self, model, messages, params, on_usage=None):
+        start = time.monotonic()
+        chunks = []
+        usages = []
+        async for text in self.backend.stream_async(model, messages, params, on_usage=usages.append):
+            chunks.append(text)
+            yield text
+        usage = usages[-1] if usages else None
+        self.store.put(request_key(model, messages, params), model, ''.join(chunks),
+                       usage, time.monotonic() - start)
+        report_usage(on_usage, usage)
+
+    def close(self):
+        self.backend.close()
+
+
+# Streamed replies are served in chunks of this many characters
+STREAM_CHUNK_SIZE = 16
+
+
+# Answers from a recording
+class ReplayBackend(LLMBackend):
+    def __init__(self, store, fallback=None, realtime=False):
+        self.store = store
+        # Backend for requests that were not recorded
+        self.fallback = fallback
+        # Wait as long as the recorded call took
+        self.realtime = realtime
+
+    def lookup(self, model, messages, params):
+        entry = self.store.get(request_key(model, messages, params))
+        if entry is None and self.fallback is None:
+            raise ReplayMissError(f"No recorded response for this {model} request")
+        return entry
+
+    def completion(self, entry):
+        usage = Usage(*entry['u']) if 'u' in entry else None
+        return Completion(entry['r'], usage)
+
+    def complete(self, model, messages, params):
+        entry = self.lookup(model, messages, params)
+        if entry is None:
+            return self.fallback.complete(model, messages, params)
+        if self.realtime:
+            time.sleep(entry.get('t', 0))
+        return self.completion(entry)
+
+    def stream(self, model, messages, params, on_usage=None):
+        entry = self.lookup(model, messages, params)
+        if entry is None:
+            yield from self.fallback.stream(model, messages, params, on_usage=on_usage)
+            return
+        chunks = split_chunks(entry['r'])
+        for text in chunks:
+            if self.realtime:
+                time.sleep(entry.get('t', 0) / len(chunks))
+            yield text
+        report_usage(on_usage, self.completion(entry).usage)
+
+    async def complete_async(self, model, messages, params):
+        import asyncio
+        entry = self.lookup(model, messages, params)
+        if entry is None:
+            return await self.fallback.complete_async(model, messages, params)
+        if self.realtime:
+            await asyncio.sleep(entry.get('t', 0))
+        return self.completion(entry)
+
+    async def stream_async(self, model, messages, params, on_usage=None):
+        import asyncio
+        entry = self.lookup(model, messages, params)
+        if entry is None:
+            async for text in self.fallback.stream_async(model, messages, params, on_usage=on_usage):
+                yield text
+            return
+        chunks = split_chunks(entry['r'])
+        for text in chunks:
+            if self.realtime:
+                await asyncio.sleep(entry.get('t', 0) / len(chunks))
+            yield text
+        report_usage(on_usage, self.completion(entry).usage)
+
+
+def split_chunks(text):
+    return [text[index:index + STREAM_CHUNK_SIZE] for index in range(0, len(text), STREAM_CHUNK_SIZE)] or ['']
+
+
+# States a fake conversation reply can detect in the user input
+FAKE_DETECTED_STATES = ['Analysis', 'Education', 'Practice', 'Reflection']
+
+
+# Canned replies in the JSON format each prompt asks for, after a
+# configurable delay. No usage is reported, so the token counter is not
+# calibrated against made up numbers.
+class FakeBackend(LLMBackend):
+    def __init__(self, latency=None, tokens_per_second=None):
+        # Seconds before the first token
+        if latency is None:
+            latency = float(os.getenv("AGENT_FAKE_LLM_LATENCY_MS", 0)) / 1000.0
+        self.latency = float(latency)
+        # Generation speed, 0 for instant
+        if tokens_per_second is None:
+            tokens_per_second = os.getenv("AGENT_FAKE_LLM_TOKENS_PER_SECOND", 0)
+        self.tokens_per_second = float(tokens_per_second)
+
+    # Seconds to generate text (about 4 characters per token)
+    def generation_time(self, text):
+        if not self.tokens_per_second:
+            return 0.0
+        return len(text) / 4.0 / self.tokens_per_second
+
+    def complete(self, model, messages, params):
+        content = fake_response(messages)
+        time.sleep(self.latency + self.generation_time(content))
+        return Completion(content)
+
+    def stream(self, model, messages, params, on_usage=None):
+        time.sleep(self.latency)
+        for text in split_chunks(fake_response(messages)):
+            time.sleep(self.generation_time(text))
+            yield text
+
+    async def complete_async(self, model, messages, params):
+        import asyncio
+        content = fake_response(messages)
+        await asyncio.sleep(self.latency + self.generation_time(content))
+        return Completion(content)
+
+    async def stream_async(self, model, messages, params, on_usage=None):
+        import asyncio
+        await asyncio.sleep(self.latency)
+        for text in split_chunks(fake_response(messages)):
+            await asyncio.sleep(self.generation_time(text))
+            yield text
+
+
+# The fake reply to a request, chosen by the response format in the prompt
+def fake_response(messages):
+    system_role = messages[0]['content'] if messages else ""
+    user_prompt = messages[-1]['content'] if messages else ""
+    # The format the reply should have comes last, the context before it may
+    # quote other formats (e.g. a stored analysis)
+    response_format = user_prompt.rsplit("JSON Response", 1)[-1] if "JSON Response" in user_prompt else ""
+
+    if '"agent_response"' in response_format:
+        return fake_conversation_response(user_prompt)
+    if '"AreasForGrowth"' in response_format:
+        # Dimensional Analysis
+        return json.dumps({
+            'Strengths': {dimension: fake_analysis_section() for dimension in ['Mindfulness', 'Cultural Awareness']},
+            'AreasForGrowth': {dimension: fake_analysis_section() for dimension in ['Emotional Regulation', 'Interpersonal Awareness']},
+            'summary': {
+                'growth_summary': "Both growth areas are about responding instead of reacting.",
+                'strength_summary': "Mindful attention supports cultural curiosity.",
+                'next_steps': "We will practice short daily check-ins.",
+            },
+            'assistant_role': "Focus on emotional regulation first.",
+        })
+    if '"reasons"' in response_format:
+        # Roadmap reasons, one per numbered step
+        steps = len(re.findall(r'^\d+\. ', user_prompt, re.MULTILINE))
+        return json.dumps({'reasons': [f"Step {number} builds on your strengths." for number in range(1, steps + 1)]})
+    if '"Weaknesses"' in response_format:
+        # Profile snapshot synopsis (batch_analysis.py)
+        return json.dumps({
+            'Guidance': "Start with the areas for growth.",
+            'Relationships': [],
+            'Strengths': [{'dimension': 'Mindfulness', 'description': "A steady base."}],
+            'Weaknesses': [{'dimension': 'Emotional Regulation', 'description': "Room to grow."}],
+        })
+    if '"summary": "<the updated summary>"' in system_role:
+        # Conversation summary (see ConversationMemory)
+        return json.dumps({'summary': "The user is working on their self-awareness goals."})
+    if '"emotionalTone"' in system_role:
+        # Conversation event metadata (see ConversationAssistant)
+        event = {
+            'timestamp': "2024-01-01T00:00:00Z",
+            'intent': "provide_information",
+            'entities': [{'entity': "goals", 'type': "other"}],
+            'emotionalTone': "neutral",
+            'summary': "The user talked about their goals.",
+        }
+        return json.dumps({'user': event, 'agent': event})
+    return fake_conversation_response(user_prompt)
+
+
+# Conversation turn. A state named in the user input is detected.
+def fake_conversation_response(user_prompt):
+    user_input = user_prompt.rsplit("User input:", 1)[-1].strip()
+    detected = next((state for state in FAKE_DETECTED_STATES if state.lower() in user_input.lower()), None)
+    return json.dumps({
+        'next_agent_action': "Conversation",
+        'next_detected_state': detected,
+        'agent_response': f"Thank you for sharing that. You said: {user_input[:200]}",
+        'next_agent_question': "What would you like to explore next?",
+        'assistant_role': "The user is engaged.",
+    })
+
+
+def fake_analysis_section():
+    return {
+        'score_understanding': "This shapes how you notice your inner experience.",
+        'why_this_matters': "It helps you respond with intention.",
+        'leveraging_this_strength': "Use it as an anchor in difficult moments.",
+        'an_interesting_fact': "Attention can be trained like a muscle.",
+    }
+
+
+# Build the backend selected by the environment
+def backend_from_env():
+    name = os.getenv("AGENT_LLM_BACKEND", "openai")
+    if name == 'openai':
+        return OpenAIBackend()
+    if name == 'fake':
+        return FakeBackend()
+    store = RecordingStore(os.getenv("AGENT_LLM_RECORDING", "llm-recording.jsonl"))
+    if name == 'record':
+        return RecordingBackend(OpenAIBackend(), store)
+    if name == 'replay':
+        fallback = FakeBackend() if os.getenv("AGENT_LLM_REPLAY_FALLBACK") == 'fake' else None
+        return ReplayBackend(store, fallback=fallback, realtime=os.getenv("AGENT_LLM_REPLAY_REALTIME") == "1")
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+# Return the process-wide LLM backend, creating it on first use
+def get_llm_backend():
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = backend_from_env()
+    return _backend
+
+
+# Replace the process-wide backend (None to select it from the environment again)
+def configure_llm_backend(backend=None):
+    global _backend
+    with _backend_lock:
+        _backend = backend
@@ -0,0 +1,144 @@
+# src/llm_client.py
+#
+# Process-wide LLM client.
+#
+# Building an OpenAI client creates a new httpx connection pool, so doing it
+# per request pays for a TCP connect and TLS handshake on every call. This
+# module keeps a single long-lived client (with keep-alive pooling) that is
+# shared by the Agent, the states and the assistants.
+#
+# The openai SDK (and httpx) are imported when the first client is built,
+# which keeps them out of the agent's cold start.
+import os
+import threading
+import weakref
+
+
+class LLMClientConfig:
+    def __init__(self,
+                 api_key=None,
+                 base_url=None,
+                 max_connections=None,
+                 max_keepalive_connections=None,
+                 keepalive_expiry=None,
+                 connect_timeout=None,
+                 read_timeout=None,
+                 max_retries=None):
+        # Every setting can be overridden with an environment variable so the
+        # pool can be tuned (or pointed at a local stub server) without code changes.
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.base_url = base_url or os.getenv("OPENAI_BASE_URL")
+        self.max_connections = int(max_connections or os.getenv("AGENT_LLM_MAX_CONNECTIONS", 20))
+        self.max_keepalive_connections = int(max_keepalive_connections or os.getenv("AGENT_LLM_MAX_KEEPALIVE", 10))
+        self.keepalive_expiry = float(keepalive_expiry or os.getenv("AGENT_LLM_KEEPALIVE_EXPIRY", 60.0))
+        self.connect_timeout = float(connect_timeout or os.getenv("AGENT_LLM_CONNECT_TIMEOUT", 10.0))
+        self.read_timeout = float(read_timeout or os.getenv("AGENT_LLM_READ_TIMEOUT", 120.0))
+        if max_retries is None:
+            max_retries = os.getenv("AGENT_LLM_MAX_RETRIES", 2)
+        self.max_retries = int(max_retries)
+
+    def http_limits(self):
+        import httpx
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def http_timeout(self):
+        import httpx
+        return httpx.Timeout(
+            self.read_timeout,
+            connect=self.connect_timeout,
+        )
+
+
+_config = None
+_client = None
+_client_lock = threading.Lock()
+# Async clients are bound to the event loop they were created on
+_async_clients = weakref.WeakKeyDictionary()
+
+
+# Replace the client configuration. The next call to get_llm_client() builds
+# a fresh client with the new settings.
+def configure_llm_client(config=None, **kwargs):
+    global _config
+    with _client_lock:
+        _close_locked()
+        _config = config or LLMClientConfig(**kwargs)
+
+
+# Return the shared OpenAI client, creating it on first use
+def get_llm_client():
+    global _config, _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            import httpx
+            from openai import OpenAI
+            if _config is None:
+                _config = LLMClientConfig()
+            http_client = httpx.Client(
+                limits=_config.http_limits(),
+                timeout=_config.http_timeout(),
+            )
+            _client = OpenAI(
+                api_key=_config.api_key,
+                base_url=_config.base_url,
+                max_retries=_config.max_retries,
+                timeout=_config.http_timeout(),
+                http_client=http_client,
+            )
+    return _client
+
+
+# Return the shared AsyncOpenAI client for the running event loop
+def get_async_llm_client():
+    global _config
+    import asyncio
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            import httpx
+            from openai import AsyncOpenAI
+            if _config is None:
+                _config = LLMClientConfig()
+            http_client = httpx.AsyncClient(
+                limits=_config.http_limits(),
+                timeout=_config.http_timeout(),
+            )
+            client = AsyncOpenAI(
+                api_key=_config.api_key,
+                base_url=_config.base_url,
+                max_retries=_config.max_retries,
+                timeout=_config.http_timeout(),
+                http_client=http_client,
+            )
+            _async_clients[loop] = client
+    return client
+
+
+# Close the shared clients and their connection pools
+def close_llm_client():
+    with _client_lock:
+        _close_locked()
+
+
+def _close_locked():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+    for loop, client in list(_async_clients.items()):
+        # An async client can only be closed on its own loop
+        if loop.is_closed():
+            pass
+        elif loop.is_running():
+            import asyncio
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+        else:
+            loop.run_until_complete(client.close())
+    _async_clients.clear()
@@ -43,7 +43,11 @@ def main():
 
     agent = Agent(user_info=user_info, db_connection=db)
 
-    agent.main_loop()
+    try:
+        agent.main_loop()
+    finally:
+        # Drain background work (e.g. conversation event extraction) on exit
+        agent.shutdown()
 
     # while True:
     #     user_input = input("> ")
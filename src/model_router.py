@@ -0,0 +1,159 @@
+# src/model_router.py
+#
+# Tiered model routing for conversation turns.
+#
+# A state asks for the model its conversation needs (gpt-4o for the goals,
+# analysis and education conversations). Acknowledgements ("ok, thanks") and
+# navigation ("next", "move on to education") don't need it: the reply is a
+# short transition to the next question. Agent.enter_conversation classifies
+# every turn locally (NLPProcessor.classify_turn) and sends those turns to the
+# small model. Questions and statements keep the requested model, and so does
+# the retry of a small model reply that failed validation.
+#
+# Every decision is counted (routing_stats(), /metrics in server mode), is a
+# model.route span when tracing, and with AGENT_ROUTING_LOG is appended to that
+# JSON lines file. The user's text is not logged.
+#
+#   AGENT_MODEL_ROUTING=0       always use the requested model
+#   AGENT_ROUTER_SMALL_MODEL    the small model (default gpt-4o-mini)
+#
+#   route = get_model_router().route(user_input, 'gpt-4o', state='Education')
+#   route.model, route.category, route.routed
+import atexit
+import json
+import os
+import threading
+import time
+
+from nlp_processor import NLPProcessor
+from tracing import span
+
+# Turn categories the small model answers
+SMALL_MODEL_CATEGORIES = ('acknowledgement', 'navigation')
+
+
+class RoutingDecision:
+    __slots__ = ('category', 'reason', 'requested_model', 'model')
+
+    def __init__(self, category, reason, requested_model, model):
+        self.category = category
+        self.reason = reason
+        self.requested_model = requested_model
+        self.model = model
+
+    # True when the turn was sent to another model than requested
+    @property
+    def routed(self):
+        return self.model != self.requested_model
+
+
+class RoutingStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # Turns by category
+            self.categories = {'acknowledgement': 0, 'navigation': 0, 'question': 0, 'statement': 0}
+            # Turns sent to the small model
+            self.routed = 0
+            # Small model replies that failed validation and were retried on
+            # the requested model
+            self.escalations = 0
+
+    def record(self, decision):
+        with self.lock:
+            self.categories[decision.category] = self.categories.get(decision.category, 0) + 1
+            if decision.routed:
+                self.routed += 1
+
+    def record_escalation(self):
+        with self.lock:
+            self.escalations += 1
+
+    def snapshot(self):
+        with self.lock:
+            turns = sum(self.categories.values())
+            snapshot = {
+                'turns': turns,
+                'routed': self.routed,
+                'escalations': self.escalations,
+                'routed_rate': self.routed / turns if turns else 0.0,
+            }
+            snapshot.update(self.categories)
+            return snapshot
+
+
+_stats = RoutingStats()
+
+
+def routing_stats():
+    return _stats.snapshot()
+
+
+class ModelRouter:
+    def __init__(self, small_model=None, enabled=None, log_file=None, classifier=None):
+        self.small_model = small_model or os.getenv("AGENT_ROUTER_SMALL_MODEL", "gpt-4o-mini")
+        if enabled is None:
+            enabled = os.getenv("AGENT_MODEL_ROUTING", "1") != "0"
+        self.enabled = enabled
+        self.classifier = classifier or NLPProcessor()
+        self.lock = threading.Lock()
+        self.log = None
+        log_file = log_file or os.getenv("AGENT_ROUTING_LOG")
+        if log_file:
+            self.log = open(log_file, 'a', buffering=1)
+
+    # Choose the model for a turn. labels (user_id, state, sub_state) are
+    # only used for logging.
+    def route(self, user_input, model, **labels):
+        with span('model.route', requested_model=model) as current:
+            category, reason = self.classifier.classify_turn(user_input)
+            routed_model = model
+            if self.enabled and category in SMALL_MODEL_CATEGORIES:
+                routed_model = self.small_model
+            decision = RoutingDecision(category, reason, model, routed_model)
+            current.set(category=category, routed_model=routed_model)
+        _stats.record(decision)
+        if self.log is not None:
+            self.write_log(decision, user_input, labels)
+        return decision
+
+    def record_escalation(self):
+        _stats.record_escalation()
+
+    def write_log(self, decision, user_input, labels):
+        entry = dict(labels)
+        entry.update({
+            'timestamp': round(time.time(), 3),
+            'category': decision.category,
+            'reason': decision.reason,
+            'requested_model': decision.requested_model,
+            'model': decision.model,
+            'input_chars': len(user_input),
+        })
+        line = json.dumps(entry, default=str)
+        with self.lock:
+            if self.log is not None:
+                self.log.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+# Return the process-wide router
+def get_model_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+            atexit.register(_router.close)
+        return _router
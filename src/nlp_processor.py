@@ -1,14 +1,79 @@
 # src/nlp_processor.py
+#
+# Local, keyword based understanding of user input. No model calls.
+import re
+
+WORD_PATTERN = re.compile(r"[a-z']+")
+
+AFFIRMATIVE_WORDS = {'yes', 'sure', 'ok', 'okay', 'affirmative', 'yeah', 'yep', 'yup', 'alright', 'k'}
+NEGATIVE_WORDS = {'no', 'not', "don't", 'negative', 'nope', 'nah'}
+
+# Words a short acknowledgement is made of ("ok thanks", "got it, makes sense")
+ACKNOWLEDGEMENT_WORDS = AFFIRMATIVE_WORDS | NEGATIVE_WORDS | {
+    'thanks', 'thank', 'you', 'thx', 'got', 'it', 'i', 'see', 'cool', 'great', 'nice', 'good',
+    'sounds', 'makes', 'sense', 'understood', 'right', 'fine', 'hmm', 'ah', 'oh', 'perfect',
+    'awesome', 'interesting', 'that', "that's", 'is', 'really', 'very', 'so', 'much', 'helpful',
+    'agreed', 'absolutely', 'definitely', 'indeed', 'true', 'fair', 'enough', 'all', 'of', 'course',
+}
+MAX_ACKNOWLEDGEMENT_WORDS = 6
+
+# Requests to move along the conversation ("next", "move on to education")
+NAVIGATION_PHRASES = [
+    'next', 'continue', 'go on', 'move on', 'keep going', 'carry on', 'skip', 'go back', 'back',
+    'proceed', "let's go", 'lets go', 'done', 'finished', 'ready', 'start', 'begin',
+]
+# Words that may surround a navigation phrase
+NAVIGATION_WORDS = {
+    'to', 'the', 'a', 'please', 'now', 'step', 'section', 'state', 'part', 'topic', 'one', 'let',
+    "let's", 'lets', 'us', 'me', 'i', 'am', "i'm", 'want', 'would', 'like', 'can', 'we', 'go',
+    'move', 'on', 'ok', 'okay', 'yes', 'sure', 'and', 'with', 'for', 'thanks', 'then',
+    'onboarding', 'goals', 'roadmap', 'analysis', 'education', 'practice', 'reflection',
+}
+MAX_NAVIGATION_WORDS = 8
+
+# First words of a question without a question mark ("explain the chart")
+QUESTION_WORDS = {
+    'what', "what's", 'why', 'how', 'when', 'where', 'who', 'which', 'whose', 'can', 'could',
+    'would', 'should', 'is', 'are', 'do', 'does', 'did', 'will', 'explain', 'tell', 'describe',
+}
+
 
 class NLPProcessor:
     def interpret_input(self, user_input):
-        # Simple keyword-based intent recognition
+        # Simple keyword-based intent recognition, on whole words so that
+        # e.g. "know" isn't read as "no"
         user_input = user_input.lower()
-        if any(word in user_input for word in ['yes', 'sure', 'ok', 'affirmative', 'yeah', 'yep']):
+        words = set(WORD_PATTERN.findall(user_input))
+        if words & AFFIRMATIVE_WORDS:
             return 'affirmative'
-        elif any(word in user_input for word in ['no', 'not', "don't", 'negative', 'nope']):
+        elif words & NEGATIVE_WORDS:
             return 'negative'
         elif '?' in user_input:
             return 'question'
         else:
             return 'statement'
+
+    # Classify a conversation turn as 'acknowledgement', 'navigation',
+    # 'question' or 'statement'. Returns (category, reason).
+    def classify_turn(self, user_input):
+        text = user_input.strip().lower()
+        words = WORD_PATTERN.findall(text)
+        if not words:
+            return 'acknowledgement', 'empty'
+
+        if len(words) <= MAX_NAVIGATION_WORDS:
+            joined = ' '.join(words)
+            for phrase in NAVIGATION_PHRASES:
+                if re.search(rf"\b{re.escape(phrase)}\b", joined):
+                    rest = set(words) - set(phrase.split())
+                    if rest <= NAVIGATION_WORDS:
+                        return 'navigation', phrase
+
+        if '?' in text or words[0] in QUESTION_WORDS:
+            return 'question', 'question mark' if '?' in text else words[0]
+
+        if len(words) <= MAX_ACKNOWLEDGEMENT_WORDS and set(words) <= ACKNOWLEDGEMENT_WORDS:
+            intent = self.interpret_input(text)
+            return 'acknowledgement', intent if intent in ('affirmative', 'negative') else 'short reply'
+
+        return 'statement', f"{len(words)} words"
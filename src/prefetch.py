@@ -0,0 +1,160 @@
+# src/prefetch.py
+#
+# Speculative prefetch of the next state.
+#
+# Every conversation reply carries next_detected_state, the model's guess of
+# where the user wants to go next. When it points at another state the
+# scheduler builds that state in the background and runs its prefetch() hook
+# (for DimensionAnalysis that is the gpt-4o analysis), so the transition
+# itself doesn't wait on the model.
+#
+# Prefetch hits and wasted prefetches are counted for the whole process, see
+# prefetch_stats().
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# next_detected_state values and the state they lead to. Practice and
+# Reflection have no state class yet.
+DETECTED_STATES = {
+    'Analysis': 'DimensionAnalysis',
+    'Education': 'Education',
+}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Threads that build states ahead of time, shared by every session
+def get_prefetch_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("AGENT_PREFETCH_WORKERS", 4)),
+                thread_name_prefix='state-prefetch')
+        return _executor
+
+
+class PrefetchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # Prefetches started
+            self.started = 0
+            # Transitions into a state that was already prefetched
+            self.hits = 0
+            # Transitions that had to wait for a running prefetch
+            self.late_hits = 0
+            # Transitions into a state that was not prefetched
+            self.misses = 0
+            # Prefetches that were never used
+            self.wasted = 0
+            self.failed = 0
+            # Prefetches dropped before they started
+            self.cancelled = 0
+
+    def increment(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            transitions = self.hits + self.late_hits + self.misses
+            finished = self.started - self.cancelled
+            return {
+                'started': self.started,
+                'hits': self.hits,
+                'late_hits': self.late_hits,
+                'misses': self.misses,
+                'wasted': self.wasted,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'hit_rate': (self.hits + self.late_hits) / transitions if transitions else 0.0,
+                'waste_rate': self.wasted / finished if finished else 0.0,
+            }
+
+
+_stats = PrefetchStats()
+
+
+def prefetch_stats():
+    return _stats.snapshot()
+
+
+class PrefetchScheduler:
+    def __init__(self, state_manager, executor=None):
+        self.state_manager = state_manager
+        self.executor = executor or get_prefetch_executor()
+        # States being built in the background: {state: future}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.closed = False
+
+    # Prefetch the state the model detected in a conversation reply
+    def observe(self, conversation_state):
+        if not conversation_state:
+            return
+        state = DETECTED_STATES.get(conversation_state.get('next_detected_state'))
+        if state is None or state == self.state_manager.state:
+            return
+        self.schedule(state)
+
+    # Start building a state (and loading its data) in the background
+    def schedule(self, state):
+        with self.lock:
+            if self.closed or state in self.pending:
+                return
+            if state in self.state_manager.state_class_obj:
+                return
+            self.pending[state] = self.executor.submit(self.run, state)
+        _stats.increment('started')
+
+    def run(self, state):
+        state_obj = self.state_manager.build_state(state)
+        state_obj.prefetch()
+        return state_obj
+
+    # The prefetched object for a state that is being entered, or None if it
+    # was not prefetched. Waits for a prefetch that is still running.
+    # transition is False when another state looks the state up for its data;
+    # that is not counted as a miss.
+    def take(self, state, transition=True):
+        with self.lock:
+            future = self.pending.get(state)
+        if future is None:
+            if transition:
+                _stats.increment('misses')
+            return None
+        _stats.increment('hits' if future.done() else 'late_hits')
+        try:
+            return future.result()
+        except Exception as e:
+            _stats.increment('failed')
+            logger.warning("Prefetch of state %s failed: %s", state, e, exc_info=e)
+            return None
+
+    # The state object is in use, forget the prefetch
+    def release(self, state):
+        with self.lock:
+            self.pending.pop(state, None)
+
+    # Drop the prefetches that were never used
+    def close(self):
+        with self.lock:
+            self.closed = True
+            pending = self.pending
+            self.pending = {}
+        for future in pending.values():
+            if future.cancel():
+                _stats.increment('cancelled')
+            else:
+                _stats.increment('wasted')
@@ -0,0 +1,78 @@
+# src/profile_compactor.py
+#
+# Compact representations of an Awareness Profile for prompt injection.
+#
+# The raw profile-data.json (every question and answer) is ~30KB, which is
+# far more than a conversation prompt needs. These helpers reduce it to the
+# scores the model actually reasons about, at a configurable level of detail.
+import hashlib
+import json
+from awareness_profile import Profile
+
+# Detail levels from smallest to largest
+#   dimensions: top-level dimension percentages only
+#   outliers:   dimension percentages plus the unusually high/low sub-dimensions
+#   scores:     dimension and every sub-dimension percentage
+#   full:       the raw profile JSON (only from the JSON itself, a Profile
+#               keeps just its scores)
+DETAIL_LEVELS = ['dimensions', 'outliers', 'scores', 'full']
+DEFAULT_DETAIL_LEVEL = 'scores'
+
+# Sub-dimensions further than this many standard deviations from the
+# profile mean are treated as outliers
+OUTLIER_THRESHOLD = 1.0
+
+
+# Hash of the raw profile, used to detect when a stored compact profile is stale
+def profile_hash(profile_data):
+    if isinstance(profile_data, Profile):
+        return profile_data.hash
+    if not isinstance(profile_data, str):
+        profile_data = json.dumps(profile_data, sort_keys=True)
+    return hashlib.sha1(profile_data.encode('utf-8')).hexdigest()
+
+
+def compact_profile(profile_data, detail_level=DEFAULT_DETAIL_LEVEL):
+    if detail_level not in DETAIL_LEVELS:
+        raise ValueError(f"Unknown profile detail level: {detail_level}")
+
+    if detail_level == 'full':
+        if isinstance(profile_data, Profile):
+            profile_data = profile_data.to_compact()
+        if not isinstance(profile_data, str):
+            profile_data = json.dumps(profile_data)
+        return profile_data
+
+    # numpy is loaded on first use to keep it out of the agent's startup
+    import numpy as np
+    from profile_scoring import as_profile, to_percentages
+
+    profile = as_profile(profile_data)
+    labels, sub_labels, sub_scores, sub_max_scores, dimension_index = profile.arrays
+    dimension_percentages = np.rint(profile.dimension_percentages).astype(int)
+    sub_percentages = to_percentages(sub_scores, sub_max_scores)
+
+    # Select which sub-dimensions are listed under each dimension
+    if detail_level == 'dimensions':
+        included = np.zeros(len(sub_labels), dtype=bool)
+    elif detail_level == 'outliers':
+        std = sub_percentages.std()
+        if std > 0:
+            z_scores = (sub_percentages - sub_percentages.mean()) / std
+            included = np.abs(z_scores) >= OUTLIER_THRESHOLD
+        else:
+            included = np.zeros(len(sub_labels), dtype=bool)
+    else:
+        included = np.ones(len(sub_labels), dtype=bool)
+
+    lines = ["Scores are percentages of the maximum possible score."]
+    for index, label in enumerate(labels):
+        line = f"{label}: {dimension_percentages[index]}%"
+        subs = [
+            f"{sub_labels[sub_index]} {sub_percentages[sub_index]}%"
+            for sub_index in np.flatnonzero((dimension_index == index) & included)
+        ]
+        if subs:
+            line += f" ({', '.join(subs)})"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,66 @@
+# src/profile_scoring.py
+#
+# Local scoring engine for Awareness Profiles.
+#
+# profile-data.json already holds the answers and a 'score' for every
+# dimension and sub-dimension, so the Spider Chart data can be computed
+# directly instead of asking the model for it. A dimension's stored score is
+# used as is (it is the one in profile-snapshot.json); only a dimension
+# without one is aggregated from its sub-dimensions.
+import numpy as np
+from awareness_profile import Profile
+
+
+# Flatten a profile into parallel arrays with one entry per sub-dimension so
+# aggregations can be done in a single vectorized pass. Accepts a Profile, in
+# which case its cached arrays are returned without parsing.
+# Returns (labels, sub_labels, sub_scores, sub_max_scores, dimension_index)
+def flatten_profile(profile_data):
+    return as_profile(profile_data).arrays
+
+
+# The Profile of profile data, parsed unless it already is one
+def as_profile(profile_data):
+    if not isinstance(profile_data, Profile):
+        profile_data = Profile.from_json(profile_data)
+    return profile_data
+
+
+# Integer percentages, 0 where the maximum is 0
+def to_percentages(scores, max_scores):
+    percentages = np.divide(scores * 100.0, max_scores, out=np.zeros_like(scores, dtype=float), where=max_scores > 0)
+    return np.rint(percentages).astype(int)
+
+
+def compute_dimension_scores(profile_data):
+    """
+    The percentage of every top-level dimension of a profile: the stored
+    dimension score, or the aggregated sub-dimension scores where there is none.
+
+    Args:
+    profile_data (dict, str or Profile): The contents of profile-data.json.
+
+    Returns:
+    tuple: (labels, scores) where scores are integer percentages (0-100) in
+           the same order as labels.
+    """
+    profile = as_profile(profile_data)
+    return profile.labels, np.rint(profile.dimension_percentages).astype(int).tolist()
+
+
+# Percentage score of every sub-dimension
+# Returns (sub_labels, scores, dimension_index)
+def compute_sub_dimension_scores(profile_data):
+    _, sub_labels, sub_scores, sub_max_scores, dimension_index = flatten_profile(profile_data)
+    return sub_labels, to_percentages(sub_scores, sub_max_scores), dimension_index
+
+
+# Build the Spider Chart data in the same shape as profile-snapshot.json
+def compute_spider_chart_data(profile_data):
+    labels, scores = compute_dimension_scores(profile_data)
+    return {
+        'spiderChartData': {
+            'labels': labels,
+            'scores': scores,
+        }
+    }
@@ -0,0 +1,159 @@
+# src/prompt_builder.py
+#
+# Token-aware prompt assembly.
+#
+# A prompt is built from named sections (system role, state role, history,
+# profile, user input, ...). Each section has a priority and an optional
+# token budget. When the assembled prompt is larger than the target, the
+# lowest priority sections are trimmed first so the prompt size (and with it
+# the request latency) stays predictable as the conversation history grows.
+import os
+import threading
+
+TRIM_MARKER = "[...]"
+
+
+# Counts tokens with tiktoken when it is installed. Otherwise tokens are
+# estimated from the character count, using a chars-per-token ratio that is
+# calibrated against the prompt token counts reported by the API.
+class TokenCounter:
+    def __init__(self, model="gpt-4o", chars_per_token=4.0):
+        self.chars_per_token = chars_per_token
+        self.lock = threading.Lock()
+        self.encoding = None
+        try:
+            import tiktoken
+            self.encoding = tiktoken.encoding_for_model(model)
+        except Exception:
+            self.encoding = None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return int(len(text) / self.chars_per_token + 0.5)
+
+    # Update the estimator with the real token count for a piece of text
+    def calibrate(self, text_length, actual_tokens):
+        if self.encoding is not None or not text_length or not actual_tokens:
+            return
+        with self.lock:
+            # Exponential moving average so a single odd prompt can't skew it
+            observed = text_length / actual_tokens
+            self.chars_per_token = 0.9 * self.chars_per_token + 0.1 * observed
+
+    # Cut text down to max_tokens. keep='tail' keeps the end of the text
+    # (e.g. the most recent history), keep='head' keeps the start.
+    def truncate(self, text, max_tokens, keep='tail'):
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        # Leave room for the marker that shows the text was cut
+        max_tokens -= self.count(TRIM_MARKER)
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)
+            if keep == 'tail':
+                return TRIM_MARKER + self.encoding.decode(tokens[-max_tokens:])
+            return self.encoding.decode(tokens[:max_tokens]) + TRIM_MARKER
+        max_chars = int(max_tokens * self.chars_per_token)
+        if keep == 'tail':
+            return TRIM_MARKER + text[-max_chars:]
+        return text[:max_chars] + TRIM_MARKER
+
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+
+# Return the process-wide token counter
+def get_token_counter():
+    global _token_counter
+    with _token_counter_lock:
+        if _token_counter is None:
+            _token_counter = TokenCounter()
+        return _token_counter
+
+
+class PromptSection:
+    def __init__(self, name, role, text, priority=0, budget=None, trim='tail'):
+        self.name = name
+        # Which part of the prompt dict the section goes into:
+        # 'system_role', 'assistant_role' or 'user_prompt'
+        self.role = role
+        self.text = text or ""
+        # Higher priority sections are trimmed last
+        self.priority = priority
+        # Maximum tokens for this section (None for no limit)
+        self.budget = budget
+        # 'tail' or 'head' to say which end to keep, None if it must not be trimmed
+        self.trim = trim
+        self.original_tokens = 0
+        self.tokens = 0
+
+
+class PromptBuilder:
+    def __init__(self, max_tokens=None, counter=None):
+        self.max_tokens = int(max_tokens or os.getenv("AGENT_PROMPT_MAX_TOKENS", 8000))
+        self.counter = counter or get_token_counter()
+        self.sections = []
+
+    def add_section(self, name, role, text, priority=0, budget=None, trim='tail'):
+        self.sections.append(PromptSection(name, role, text, priority, budget, trim))
+        return self
+
+    # Assemble the prompt dict passed to Agent.get_response()
+    def build(self):
+        for section in self.sections:
+            section.original_tokens = self.counter.count(section.text)
+            section.tokens = section.original_tokens
+
+        # Apply the per section budgets
+        for section in self.sections:
+            if section.budget is not None and section.trim and section.tokens > section.budget:
+                self._trim(section, section.budget)
+
+        # Trim the lowest priority sections until the prompt fits
+        overflow = self.total_tokens() - self.max_tokens
+        for section in sorted(self.sections, key=lambda section: section.priority):
+            if overflow <= 0:
+                break
+            if not section.trim or section.tokens == 0:
+                continue
+            before = section.tokens
+            self._trim(section, max(before - overflow, 0))
+            overflow -= before - section.tokens
+
+        prompt = {}
+        for section in self.sections:
+            if section.role in prompt:
+                prompt[section.role] += f"\n{section.text}"
+            else:
+                prompt[section.role] = section.text
+        return prompt
+
+    def _trim(self, section, max_tokens):
+        section.text = self.counter.truncate(section.text, max_tokens, keep=section.trim)
+        section.tokens = self.counter.count(section.text)
+
+    def total_tokens(self):
+        return sum(section.tokens for section in self.sections)
+
+    # Per section token usage of the last build()
+    def usage(self):
+        return {
+            'max_tokens': self.max_tokens,
+            'total_tokens': self.total_tokens(),
+            'sections': {
+                section.name: {
+                    'tokens': section.tokens,
+                    'original_tokens': section.original_tokens,
+                    'budget': section.budget,
+                    'trimmed': section.tokens < section.original_tokens,
+                }
+                for section in self.sections
+            },
+        }
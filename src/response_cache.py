@@ -0,0 +1,197 @@
+# src/response_cache.py
+#
+# Persistent, content-addressed cache for LLM responses.
+#
+# Responses are keyed on a hash of everything that determines the completion
+# (model, roles, user prompt and sampling parameters) and stored in a SQLite
+# file next to agent.db. Entries expire after a TTL and the least recently
+# used entries are evicted once the cache grows past max_entries.
+#
+# A hit doesn't write to the file. Its access time is queued, and only when
+# the stored one is older than touch_interval, so the LRU order is accurate to
+# touch_interval. The queue is written in one batch before an insert or once
+# it is full. The number of entries is kept in memory and recounted when the
+# expired entries are swept.
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Queued access times are written once there are this many
+MAX_PENDING_TOUCHES = 64
+
+
+class ResponseCache:
+    def __init__(self, cache_file, ttl=None, max_entries=None, touch_interval=None):
+        self.cache_file = cache_file
+        # Default: keep responses for a week and at most 5000 of them
+        self.ttl = float(ttl or os.getenv("AGENT_CACHE_TTL", 7 * 24 * 60 * 60))
+        self.max_entries = int(max_entries or os.getenv("AGENT_CACHE_MAX_ENTRIES", 5000))
+        # Seconds within which another hit doesn't update the access time
+        if touch_interval is None:
+            touch_interval = os.getenv("AGENT_CACHE_TOUCH_INTERVAL", 60)
+        self.touch_interval = float(touch_interval)
+        # The cache is shared by the agent and the background extraction
+        # threads, so access is serialized with a lock
+        self.conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Access times not written yet: {key: last_access}
+        self.pending_touches = {}
+        self.entries = 0
+        # Expired entries are swept at most this often, or when the cache is full
+        self.sweep_interval = min(self.ttl, 60 * 60)
+        self.next_sweep = 0.0
+        self.create_tables()
+
+    def create_tables(self):
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_response_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT,
+                    response TEXT,
+                    created REAL,
+                    last_access REAL
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_access
+                ON llm_response_cache (last_access)
+            ''')
+            self.conn.commit()
+            cursor.execute('SELECT COUNT(*) FROM llm_response_cache')
+            self.entries = cursor.fetchone()[0]
+
+    # Build the cache key for a request
+    @staticmethod
+    def make_key(model, prompt, params):
+        key_data = json.dumps({
+            'model': model,
+            'system_role': prompt.get('system_role'),
+            'assistant_role': prompt.get('assistant_role'),
+            'user_prompt': prompt.get('user_prompt'),
+            'params': params,
+        }, sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    # Return the cached response for key, or None on a miss
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT response, created, last_access FROM llm_response_cache WHERE key = ?', (key,))
+            row = cursor.fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            response, created, last_access = row
+            if now - created > self.ttl:
+                cursor.execute('DELETE FROM llm_response_cache WHERE key = ?', (key,))
+                self.entries -= cursor.rowcount
+                self.pending_touches.pop(key, None)
+                self.conn.commit()
+                self.misses += 1
+                return None
+            last_access = self.pending_touches.get(key, last_access)
+            if now - last_access >= self.touch_interval:
+                self.pending_touches[key] = now
+                if len(self.pending_touches) >= MAX_PENDING_TOUCHES:
+                    self._write_touches(cursor)
+                    self.conn.commit()
+            self.hits += 1
+            return response
+
+    def put(self, key, model, response):
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT 1 FROM llm_response_cache WHERE key = ?', (key,))
+            if cursor.fetchone() is None:
+                self.entries += 1
+            cursor.execute('''
+                INSERT OR REPLACE INTO llm_response_cache (key, model, response, created, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (key, model, response, now, now))
+            self.pending_touches.pop(key, None)
+            # Eviction goes by the current access times
+            self._write_touches(cursor)
+            self._evict(cursor, now)
+            self.conn.commit()
+
+    # Write the queued access times
+    def _write_touches(self, cursor):
+        if self.pending_touches:
+            cursor.executemany('UPDATE llm_response_cache SET last_access = ? WHERE key = ?',
+                               [(last_access, key) for key, last_access in self.pending_touches.items()])
+            self.pending_touches.clear()
+
+    # Drop expired entries and trim the cache to max_entries (least recently used first)
+    def _evict(self, cursor, now):
+        if now >= self.next_sweep or self.entries > self.max_entries:
+            cursor.execute('DELETE FROM llm_response_cache WHERE created < ?', (now - self.ttl,))
+            self.evictions += cursor.rowcount
+            # Also counts the entries other processes added
+            cursor.execute('SELECT COUNT(*) FROM llm_response_cache')
+            self.entries = cursor.fetchone()[0]
+            self.next_sweep = now + self.sweep_interval
+        overflow = self.entries - self.max_entries
+        if overflow > 0:
+            cursor.execute('''
+                DELETE FROM llm_response_cache WHERE key IN (
+                    SELECT key FROM llm_response_cache ORDER BY last_access ASC LIMIT ?
+                )
+            ''', (overflow,))
+            self.evictions += cursor.rowcount
+            self.entries -= cursor.rowcount
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute('DELETE FROM llm_response_cache')
+            self.conn.commit()
+            self.pending_touches.clear()
+            self.entries = 0
+
+    def stats(self):
+        with self.lock:
+            entries = self.entries
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': entries,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self._write_touches(self.conn.cursor())
+            self.conn.commit()
+            self.conn.close()
+
+
+# Path of the cache file that sits alongside a database file
+# e.g. agent.db -> agent-cache.db
+def cache_file_for(db_file):
+    if db_file == ':memory:':
+        return db_file
+    root, ext = os.path.splitext(db_file)
+    return f"{root}-cache{ext or '.db'}"
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+# Return the process-wide cache for cache_file
+def get_response_cache(cache_file):
+    with _caches_lock:
+        if cache_file not in _caches:
+            _caches[cache_file] = ResponseCache(cache_file)
+        return _caches[cache_file]
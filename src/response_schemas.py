@@ -0,0 +1,258 @@
+# src/response_schemas.py
+#
+# Schemas for the JSON the model is asked to answer with.
+#
+# A reply is parsed against the schema of its prompt. Replies that are not
+# quite JSON (a markdown code fence, text around the object, or an object cut
+# off by the token limit) are repaired where possible. Only when the reply
+# still does not match the schema is the model asked again, with the
+# validation error appended to the prompt, up to AGENT_RESPONSE_ATTEMPTS
+# attempts in total.
+#
+#   response, text = complete_validated(agent.get_response, prompt, ConversationResponse)
+#   response.agent_response
+#
+# pydantic is slow to import, so this module is imported on first use.
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+
+# Truncated replies are cut back at most this many list/object items
+MAX_REPAIR_CUTS = 8
+
+
+class ResponseValidationError(ValueError):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        # The reply that failed, for logging
+        self.response = response
+
+
+# The reply format of every conversation prompt
+class ConversationResponse(BaseModel):
+    # Prompts may ask for extra fields, they are kept
+    model_config = ConfigDict(extra='allow')
+
+    agent_response: str
+    next_agent_question: str
+    next_detected_state: Optional[str] = None
+    next_agent_action: Optional[str] = None
+    assistant_role: str = ""
+
+
+class AnalysisSection(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    score_understanding: str = ""
+    why_this_matters: str = ""
+    leveraging_this_strength: str = ""
+    an_interesting_fact: str = ""
+
+
+class AnalysisSummary(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    growth_summary: str = ""
+    strength_summary: str = ""
+    next_steps: str = ""
+
+
+# The Dimensional Analysis (see build_analysis_prompt)
+class DimensionAnalysisResponse(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    Strengths: Dict[str, AnalysisSection] = Field(min_length=1)
+    AreasForGrowth: Dict[str, AnalysisSection] = Field(min_length=1)
+    summary: Optional[AnalysisSummary] = None
+    assistant_role: str = ""
+
+
+# Any JSON object, for replies without a schema of their own
+class JsonObjectResponse(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+
+# Counts of how replies were handled, for monitoring
+class ResponseStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.parsed = 0
+        self.repaired = 0
+        self.retries = 0
+        self.failed = 0
+
+    def add(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'parsed': self.parsed,
+                'repaired': self.repaired,
+                'retries': self.retries,
+                'failed': self.failed,
+            }
+
+
+_stats = ResponseStats()
+
+
+def response_stats():
+    return _stats.snapshot()
+
+
+# Total attempts per prompt, the first request included
+def response_attempts():
+    return max(1, int(os.getenv("AGENT_RESPONSE_ATTEMPTS", 3)))
+
+
+# Decode the JSON object in a reply, repairing it if needed. Returns
+# (data, repaired).
+def load_json(text):
+    try:
+        return json.loads(text), False
+    except (TypeError, ValueError):
+        pass
+    if not isinstance(text, str):
+        raise ResponseValidationError("Empty response", text)
+
+    start = text.find('{')
+    if start < 0:
+        raise ResponseValidationError("No JSON object in the response", text)
+    candidate = text[start:]
+    decoder = json.JSONDecoder()
+    try:
+        # Ignores anything after the object, e.g. a closing code fence
+        return decoder.raw_decode(candidate)[0], True
+    except ValueError:
+        pass
+    for closed in close_truncated_json(candidate):
+        try:
+            return json.loads(closed), True
+        except ValueError:
+            continue
+    raise ResponseValidationError("Response is not valid JSON", text)
+
+
+# Ways to complete a JSON object that was cut off, most complete first: the
+# text with the open string and brackets closed, then cut back to each of the
+# last few item separators.
+def close_truncated_json(text):
+    stack = []
+    cuts = []
+    in_string = False
+    escape = False
+    for index, char in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == '\\':
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char == '{':
+            stack.append('}')
+        elif char == '[':
+            stack.append(']')
+        elif char in '}]':
+            if stack:
+                stack.pop()
+        elif char == ',':
+            cuts.append((index, ''.join(reversed(stack))))
+
+    closers = ''.join(reversed(stack))
+    tail = text
+    if in_string:
+        if escape:
+            tail = tail[:-1]
+        tail += '"'
+    tail = tail.rstrip()
+    if tail.endswith(','):
+        tail = tail[:-1]
+    elif tail.endswith(':'):
+        tail += ' null'
+    candidates = [tail + closers]
+    for index, cut_closers in reversed(cuts[-MAX_REPAIR_CUTS:]):
+        candidates.append(text[:index] + cut_closers)
+    return candidates
+
+
+# Parse and validate a reply. Raises ResponseValidationError.
+def parse_response(text, schema):
+    data, repaired = load_json(text)
+    try:
+        response = schema.model_validate(data)
+    except ValidationError as e:
+        errors = "; ".join(
+            f"{'.'.join(str(part) for part in error['loc']) or 'response'}: {error['msg']}"
+            for error in e.errors())
+        raise ResponseValidationError(f"Response does not match the format: {errors}", text)
+    _stats.add('repaired' if repaired else 'parsed')
+    return response
+
+
+# The prompt asking again after a reply failed validation
+def retry_prompt(prompt, error):
+    retry = dict(prompt)
+    retry['user_prompt'] = (
+        f"{prompt['user_prompt']}\n\n"
+        f"Your previous response could not be used ({str(error)[:500]}). "
+        f"Respond again with a single JSON object in the required format."
+    )
+    return retry
+
+
+# The validated reply to a prompt. complete(prompt) returns the model's JSON
+# text. response is a reply that was already received for prompt (e.g. a
+# streamed one), it is validated before anything is requested.
+# Returns (response model, normalized JSON text).
+def complete_validated(complete, prompt, schema, response=None, max_attempts=None):
+    max_attempts = max_attempts or response_attempts()
+    error = None
+    for attempt in range(max_attempts):
+        if attempt == 0 and response is not None:
+            text = response
+        elif attempt == 0:
+            text = complete(prompt)
+        else:
+            _stats.add('retries')
+            text = complete(retry_prompt(prompt, error))
+        try:
+            return normalized(parse_response(text, schema))
+        except ResponseValidationError as e:
+            error = e
+    _stats.add('failed')
+    raise error
+
+
+# Async version of complete_validated(), complete(prompt) is a coroutine function
+async def complete_validated_async(complete, prompt, schema, response=None, max_attempts=None):
+    max_attempts = max_attempts or response_attempts()
+    error = None
+    for attempt in range(max_attempts):
+        if attempt == 0 and response is not None:
+            text = response
+        elif attempt == 0:
+            text = await complete(prompt)
+        else:
+            _stats.add('retries')
+            text = await complete(retry_prompt(prompt, error))
+        try:
+            return normalized(parse_response(text, schema))
+        except ResponseValidationError as e:
+            error = e
+    _stats.add('failed')
+    raise error
+
+
+# (response, JSON text) with only the fields the model gave plus the defaults
+# the schema requires, so stored replies keep their original shape
+def normalized(response):
+    return response, json.dumps(response.model_dump(exclude_unset=True))
@@ -0,0 +1,142 @@
+# src/roadmap.py
+#
+# Deterministic roadmap engine.
+#
+# A roadmap is the few sub-dimensions the user should work on first. Picking
+# them is a ranking over the profile scores, so it is done locally: the
+# sub-dimension percentages are weighted and sorted in one vectorized pass and
+# a small greedy pass applies the dimension diversity rule. The same profile
+# always gives the same roadmap. The model is only asked to write the 'reason'
+# for each step, in a single call for all steps.
+#
+#   steps = rank_roadmap_steps(profile_data)
+#   roadmap = generate_roadmap(profile_data, complete=agent.get_response)
+#   # {'ThreeStepRoadmap': [{'dimension', 'subdimension', 'reason'}, ...]}
+import json
+import numpy as np
+from awareness_profile import Profile
+
+ROADMAP_STEPS = 3
+
+
+# Rank the sub-dimensions to work on, weakest first.
+#
+# weights: optional {dimension or sub-dimension label: multiplier}. A weight
+#     above 1 makes a sub-dimension more urgent (its shortfall from 100% is
+#     multiplied by the weight), so goals can pull related areas forward.
+# max_per_dimension: at most this many steps from one dimension. Relaxed when
+#     the profile does not have enough dimensions to fill the roadmap.
+#
+# Ties are broken by the weaker dimension first, then by profile order.
+# Returns [{'dimension', 'subdimension', 'score', 'dimension_score'}, ...]
+def rank_roadmap_steps(profile_data, steps=ROADMAP_STEPS, weights=None, max_per_dimension=1):
+    if not isinstance(profile_data, Profile):
+        profile_data = Profile.from_json(profile_data)
+    labels, sub_labels, _, _, dimension_index = profile_data.arrays
+    if not sub_labels:
+        return []
+
+    # Unrounded percentages so the ranking is not decided by rounding
+    sub_percentages = profile_data.sub_percentages
+    dimension_percentages = profile_data.dimension_percentages
+
+    weight = np.ones(len(sub_labels))
+    if weights:
+        dimension_weights = np.array([weights.get(label, 1.0) for label in labels])
+        sub_weights = np.array([weights.get(label, 1.0) for label in sub_labels])
+        weight = dimension_weights[dimension_index] * sub_weights
+    # Shortfall from the maximum, scaled by the weight. Rounded so float
+    # noise can't split real ties.
+    need = np.round((100.0 - sub_percentages) * weight, 6)
+    # lexsort sorts by the last key first: most need, then weakest dimension,
+    # then profile order
+    order = np.lexsort((np.arange(len(sub_labels)), dimension_percentages[dimension_index], -need))
+
+    selected = []
+    limit = max_per_dimension
+    while len(selected) < min(steps, len(sub_labels)):
+        used = np.bincount(dimension_index[selected], minlength=len(labels)) if selected else np.zeros(len(labels), dtype=int)
+        added = False
+        for index in order:
+            if index in selected or used[dimension_index[index]] >= limit:
+                continue
+            selected.append(index)
+            used[dimension_index[index]] += 1
+            added = True
+            if len(selected) == steps:
+                break
+        if not added:
+            # Not enough dimensions for the diversity rule, allow one more per dimension
+            limit += 1
+
+    return [{
+        'dimension': labels[dimension_index[index]],
+        'subdimension': sub_labels[index],
+        'score': int(round(sub_percentages[index])),
+        'dimension_score': int(round(dimension_percentages[dimension_index[index]])),
+    } for index in selected]
+
+
+# Prompt asking for the reason of every step in one call
+def build_reasons_prompt(steps, system_role):
+    step_lines = "\n".join(
+        f"{number}. {step['subdimension']} ({step['dimension']}): sub-dimension score {step['score']}%, dimension score {step['dimension_score']}%"
+        for number, step in enumerate(steps, 1))
+    return {
+        'system_role': system_role,
+        'user_prompt': f"""The following steps were chosen for the user's self-awareness roadmap, in order.
+They are the user's lowest scoring sub-dimensions, taking at most one from each dimension where possible.
+
+{step_lines}
+
+For each step write one or two sentences explaining to the user why it was chosen and what improving it
+will do for them. Be compassionate with non-judgmental, empathetic and supportive language.
+
+JSON Response Format:
+{{
+    "reasons": ["<reason for step 1>", "<reason for step 2>", ...]
+}}
+"""
+    }
+
+
+# Used when no model is given or its answer is unusable
+def default_reason(step, rank):
+    return (f"{step['subdimension']} ({step['dimension']}) scored {step['score']}%, one of your lowest "
+            f"sub-dimensions, so it is step {rank} of your roadmap.")
+
+
+# Build the roadmap. complete(prompt) returns the model's JSON text (for
+# example Agent.get_response). With batch_reasons=False the model is called
+# once per step instead.
+def generate_roadmap(profile_data, complete=None, system_role="", steps=ROADMAP_STEPS, weights=None,
+                     max_per_dimension=1, batch_reasons=True):
+    ranked = rank_roadmap_steps(profile_data, steps=steps, weights=weights, max_per_dimension=max_per_dimension)
+
+    reasons = [None] * len(ranked)
+    if complete is not None and ranked:
+        if batch_reasons:
+            reasons = parse_reasons(complete(build_reasons_prompt(ranked, system_role)), len(ranked))
+        else:
+            for index, step in enumerate(ranked):
+                reasons[index] = parse_reasons(complete(build_reasons_prompt([step], system_role)), 1)[0]
+
+    return {
+        'ThreeStepRoadmap': [{
+            'dimension': step['dimension'],
+            'subdimension': step['subdimension'],
+            'reason': reasons[index] or default_reason(step, index + 1),
+        } for index, step in enumerate(ranked)]
+    }
+
+
+# The reasons from the model's answer, None for any that are missing
+def parse_reasons(response, count):
+    try:
+        reasons = json.loads(response).get('reasons', [])
+    except (ValueError, AttributeError):
+        reasons = []
+    if not isinstance(reasons, list):
+        reasons = []
+    reasons = [reason if isinstance(reason, str) and reason.strip() else None for reason in reasons[:count]]
+    return reasons + [None] * (count - len(reasons))
@@ -0,0 +1,263 @@
+# src/server.py
+#
+# Multi-session server mode.
+#
+# Hosts many concurrent Agent sessions in one process using a simple line
+# protocol over TCP: the client sends its username as the first line and then
+# one line per user input; the agent's output is sent back as plain text.
+#
+# Every session gets its own Agent (and so its own StateManager) running on a
+# session thread. The asyncio event loop owns the sockets, and all sessions
+# share the pooled Database, the LLM client and the response cache. Clients
+# connecting while --max-sessions sessions are running are told the server is
+# busy and disconnected.
+#
+# With --async-agent the sessions run an AsyncAgent instead: the turns run on
+# the event loop and only the state handlers use threads.
+#
+# With --metrics-port, tracing is enabled (see tracing.py) and the span
+# latency histograms, token counts and cache/prefetch counters are served in
+# the Prometheus text format on GET /metrics.
+#
+#   python server.py --port 8765
+#   python server.py --port 8765 --metrics-port 9100
+#   nc localhost 8765
+import argparse
+import asyncio
+import functools
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Sessions have no display to open chart windows on
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from agent import Agent
+from async_agent import AsyncAgent
+from chart_renderer import get_chart_renderer
+from database import Database
+from model_router import routing_stats
+from prefetch import prefetch_stats
+from response_cache import cache_file_for, get_response_cache
+from tracing import configure_tracing, prometheus_text, register_metrics_source, tracing_enabled
+from usage_ledger import get_usage_ledger
+
+
+# Raised in a session thread when the client disconnects
+class SessionClosed(Exception):
+    pass
+
+
+# Agent input/output for a session connected over a socket. The methods are
+# called from the session thread and hand the socket work to the event loop.
+class SessionIO:
+    def __init__(self, loop, reader, writer):
+        self.loop = loop
+        self.reader = reader
+        self.writer = writer
+
+    def read_input(self, prompt):
+        self.write(prompt)
+        line = asyncio.run_coroutine_threadsafe(self.reader.readline(), self.loop).result()
+        if not line:
+            raise SessionClosed()
+        return line.decode('utf-8').rstrip('\r\n')
+
+    def print(self, text=""):
+        self.write(f"{text}\n")
+
+    def write(self, text):
+        self.loop.call_soon_threadsafe(self._write, text)
+
+    def flush(self):
+        pass
+
+    def _write(self, text):
+        if not self.writer.is_closing():
+            self.writer.write(text.encode('utf-8'))
+
+
+# Session input/output for an AsyncAgent. Called on the event loop thread.
+class AsyncSessionIO(SessionIO):
+    async def read_input(self, prompt):
+        self.write(prompt)
+        line = await self.reader.readline()
+        if not line:
+            raise SessionClosed()
+        return line.decode('utf-8').rstrip('\r\n')
+
+
+class AgentServer:
+    def __init__(self, db, host='127.0.0.1', port=8765, max_sessions=256, async_agent=False,
+                 metrics_port=None):
+        self.db = db
+        self.host = host
+        self.port = port
+        self.metrics_port = metrics_port
+        self.max_sessions = max_sessions
+        self.async_agent = async_agent
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix='agent-session')
+        self.active_sessions = 0
+        self.lock = threading.Lock()
+
+    # Take a session slot, False when all max_sessions are in use
+    def start_session(self):
+        with self.lock:
+            if self.active_sessions >= self.max_sessions:
+                return False
+            self.active_sessions += 1
+            return True
+
+    def end_session(self):
+        with self.lock:
+            self.active_sessions -= 1
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        if not self.start_session():
+            # Refused rather than left waiting for a session thread without a word
+            try:
+                writer.write(f"The server is busy ({self.max_sessions} sessions), please try again later.\n".encode('utf-8'))
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+            return
+        try:
+            if self.async_agent:
+                await self.run_async_session(AsyncSessionIO(loop, reader, writer))
+            else:
+                await loop.run_in_executor(self.executor, self.run_session, SessionIO(loop, reader, writer))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.end_session()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    # Runs on a session thread for the lifetime of the connection
+    def run_session(self, session_io):
+        agent = None
+        try:
+            session_io.print("Welcome to the Awareness Improvement Agent!")
+            username = session_io.read_input("Please enter your username: ").strip()
+            user_info = self.db.get_user_info(username)
+            if user_info['id'] is None:
+                session_io.print(f"Unknown user: {username}")
+                return
+            agent = Agent(user_info=user_info, db_connection=self.db, io=session_io)
+            agent.main_loop()
+        except (SessionClosed, SystemExit):
+            pass
+        except Exception:
+            traceback.print_exc()
+            session_io.print("The session ended because of an internal error.")
+        finally:
+            if agent is not None:
+                agent.shutdown()
+
+    # Runs on the event loop for the lifetime of the connection
+    async def run_async_session(self, session_io):
+        loop = asyncio.get_running_loop()
+        try:
+            session_io.print("Welcome to the Awareness Improvement Agent!")
+            username = (await session_io.read_input("Please enter your username: ")).strip()
+            user_info = await loop.run_in_executor(self.executor, self.db.get_user_info, username)
+            if user_info['id'] is None:
+                session_io.print(f"Unknown user: {username}")
+                return
+            # Building the Agent loads its state from the database
+            agent = await loop.run_in_executor(
+                self.executor,
+                functools.partial(AsyncAgent, user_info=user_info, db_connection=self.db, io=session_io))
+            await agent.main_loop_async()
+        except (SessionClosed, SystemExit):
+            pass
+        except Exception:
+            traceback.print_exc()
+            session_io.print("The session ended because of an internal error.")
+
+    # Counters from the shared components, added to the /metrics output
+    def register_metrics(self):
+        def session_stats():
+            return {'active': self.active_sessions, 'max': self.max_sessions}
+
+        def response_stats():
+            # Imported here with pydantic only when it is first scraped
+            from response_schemas import response_stats
+            return response_stats()
+
+        register_metrics_source('sessions', session_stats)
+        register_metrics_source('prefetch', prefetch_stats)
+        register_metrics_source('routing', routing_stats)
+        register_metrics_source('response_validation', response_stats)
+        register_metrics_source('chart', lambda: get_chart_renderer().stats())
+        register_metrics_source('llm_usage', lambda: get_usage_ledger(self.db).stats())
+        register_metrics_source('response_cache',
+                                lambda: get_response_cache(cache_file_for(self.db.db_file)).stats())
+
+    # Minimal HTTP handler for Prometheus scrapes
+    async def handle_metrics(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the headers
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, content_type = '200 OK', 'text/plain; version=0.0.4; charset=utf-8'
+                body = prometheus_text().encode('utf-8')
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain; charset=utf-8', b'Not Found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"Serving on {self.host}:{self.port}")
+        if self.metrics_port is not None:
+            if not tracing_enabled():
+                configure_tracing()
+            self.register_metrics()
+            self.metrics_server = await asyncio.start_server(self.handle_metrics, self.host, self.metrics_port)
+            print(f"Serving metrics on http://{self.host}:{self.metrics_port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Awareness Improvement Agent server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--db', default='agent.db', help="SQLite database file")
+    parser.add_argument('--max-sessions', type=int, default=256, help="Maximum concurrent sessions")
+    parser.add_argument('--db-pool-size', type=int, default=None, help="Database connections shared by the sessions")
+    parser.add_argument('--async-agent', action='store_true', help="Run the sessions on the async turn pipeline")
+    parser.add_argument('--metrics-port', type=int, default=None, help="Serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    db = Database(args.db, pool_size=args.db_pool_size)
+    server = AgentServer(db, args.host, args.port, args.max_sessions, async_agent=args.async_agent,
+                         metrics_port=args.metrics_port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
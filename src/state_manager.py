@@ -3,11 +3,42 @@ from transitions import Machine
 from states.state_onboarding import OnboardingState
 from states.state_dimension_analysis import DimensionAnalysisState
 from states.state_education import EducationState
+from prefetch import PrefetchScheduler
 import json
+import os
+import threading
+from tracing import span, traced
+
+
+# State objects by name. A state object is built the first time it is
+# looked up, so a session only pays for the states it actually visits.
+class StateObjects(dict):
+    def __init__(self, state_manager):
+        super().__init__()
+        self.state_manager = state_manager
+        self.lock = threading.Lock()
+        # {state: lock held while the state is built}
+        self.build_locks = {}
+
+    # A state looked up by two threads at once (e.g. a prefetch thread) is
+    # still built only once
+    def __missing__(self, state):
+        with self.lock:
+            build_lock = self.build_locks.setdefault(state, threading.RLock())
+        with build_lock:
+            if state in self:
+                return dict.__getitem__(self, state)
+            return self.state_manager.create_state(state)
+
 
 class StateManager:
     #states = ['Onboarding', 'Education', 'Practice', 'Reflection']
-    states = ['Onboarding']
+    states = ['Onboarding', 'DimensionAnalysis', 'Education']
+    state_classes = {
+        'Onboarding': OnboardingState,
+        'DimensionAnalysis': DimensionAnalysisState,
+        'Education': EducationState,
+    }
 
     def __init__(self, agent):
         self.agent = agent
@@ -16,23 +47,13 @@ class StateManager:
             'DimensionAnalysis': self.handle_DimensionAnalysis,
             'Education': self.handle_Education,
         }
-        # self.state_class_obj = {
-        #     'Onboarding': OnboardingState(self, agent),
-        #     'DimensionAnalysis': DimensionAnalysisState(self, agent),
-        #     'Education': EducationState(self, agent),
-        # }
-        # Automatically generate the self.stater_class_obj dictionary
-        self.state_class_obj = {}
-        for state in self.states:
-            # Check if the the f"{state}State" class exists in the global namepsace
-            # If it does, create an instance of it and add it to the state_class_obj dictionary
-            if f"{state}State" not in globals():
-                continue
-            state_class = globals()[f"{state}State"]
-            self.state_class_obj[state] = state_class(state, self)
-            self.state_class_obj[state].init_state()
-
-
+        # State objects are created on first use (see create_state)
+        self.state_class_obj = StateObjects(self)
+        self.lock = threading.Lock()
+        # Build the state detected in the conversation (next_detected_state)
+        # in the background while the user is still in the current one
+        self.prefetch_enabled = os.getenv("AGENT_PREFETCH_STATES", "1") != "0"
+        self.prefetcher = PrefetchScheduler(self)
 
         self.global_state = {
             'state': self.states[0],
@@ -46,21 +67,56 @@ class StateManager:
         self.machine.add_transition(trigger='to_DimensionAnalysis', source='Education', dest='DimensionAnalysis')
         self.machine.add_transition(trigger='to_Education', source='DimensionAnalysis', dest='Education')
 
+    # Build a state object, restoring its saved sub state
+    def build_state(self, state):
+        if state not in self.state_classes:
+            raise KeyError(state)
+        state_obj = self.state_classes[state](state, self)
+        saved = self.global_state['states'].get(state)
+        if saved is not None:
+            state_obj.state = saved['state']
+        state_obj.init_state()
+        return state_obj
+
+    # Called the first time a state object is looked up. Uses the object
+    # built in the background if a prefetch was started.
+    def create_state(self, state):
+        state_obj = None
+        # The session's starting state is built right away, not a transition
+        if state != self.initial_state:
+            # Entering the state, or another state (e.g. Education, also from
+            # its prefetch thread) using its data
+            state_obj = self.prefetcher.take(state, transition=state == self.state)
+        if state_obj is None:
+            state_obj = self.build_state(state)
+        with self.lock:
+            self.state_class_obj[state] = state_obj
+        self.prefetcher.release(state)
+        return state_obj
+
+    # Start building a state (and loading its data) in the background
+    def prefetch_state(self, state):
+        self.prefetcher.schedule(state)
+
+    # Stop prefetching, called when the session ends
+    def close(self):
+        self.prefetcher.close()
+
     @property
     def sub_state(self):
         return self.state_class_obj[self.state].state
 
     def load_state(self):
         saved_state_str = self.agent.db.get_agent_state(self.agent.user_id)
-        # Convert json string to dict
+        # Convert json string to dict. The saved sub states are applied when
+        # the state objects are built.
         if saved_state_str:
-            cur_state = json.loads(saved_state_str)
-            self.global_state = cur_state
-            for state in cur_state['states'].keys():
-                self.state_class_obj[state].state = cur_state['states'][state]['state']
+            self.global_state = json.loads(saved_state_str)
 
         self.state = self.global_state['state']
+        self.initial_state = self.state
 
+    @traced('state.save')
     def save_state(self):
 
         saved_state = {
@@ -73,14 +129,25 @@ class StateManager:
             # Check if the stat_class_obj exists
             if state in self.state_class_obj.keys():
                 saved_state['states'][state] = { 'state': self.state_class_obj[state].state }
+            elif state in self.global_state['states']:
+                # Not visited in this session, keep what was saved
+                saved_state['states'][state] = self.global_state['states'][state]
 
         new_state_str = json.dumps(saved_state)
-        breakpoint()
         self.agent.db.save_agent_state(self.agent.user_id, new_state_str)
 
     def process_state(self):
-        keep_going = self.handlers[self.state]()
-        self.save_state()
+        with span('turn', user_id=self.agent.user_id, state=self.state, sub_state=self.sub_state):
+            # Background results from the previous turn are saved first so they
+            # are part of this turn's context
+            self.agent.flush_background_work()
+            # The writes made during the turn are committed in one transaction,
+            # split where the turn waits on the user (Agent.read_input)
+            with self.agent.db.transaction():
+                keep_going = self.handlers[self.state]()
+                self.save_state()
+            if self.prefetch_enabled:
+                self.prefetcher.observe(self.agent.conversation_state)
         return True
 
     def handle_Onboarding(self):
@@ -100,10 +167,10 @@ class StateManager:
         pass
 
     def display_console_hud(self):
-        print("--------------------------------------------------------------------")
-        print(f"{self.state}.{self.sub_state}")
+        self.agent.print("--------------------------------------------------------------------")
+        self.agent.print(f"{self.state}.{self.sub_state}")
         state_obj = self.state_class_obj[self.state]
         command_menu = "    commands:    | "
         for command in state_obj.commands.keys():
             command_menu += f"{command} | "
-        print(f"{command_menu}\n")
\ No newline at end of file
+        self.agent.print(f"{command_menu}\n")
\ No newline at end of file
@@ -3,6 +3,9 @@ import json
 import textwrap
 
 class BaseState:
+    # States without their own role text only use the global system role
+    state_system_role = ""
+
     def __init__(self, state, state_manager):
         self.name = state
         self.agent = state_manager.agent
@@ -23,10 +26,19 @@ class BaseState:
     def init_state(self):
         pass
 
+    # Load the state's expensive data ahead of the first visit. Runs on a
+    # background thread.
+    def prefetch(self):
+        pass
+
     @property
     def system_role(self):
         return f"{self.state_system_role}"
 
+    @property
+    def assistant_role(self):
+        return f"{self.name} State: {self.state}"
+
     @property
     def state_class(self):
         return self.state_class_obj[self.state]
@@ -47,7 +59,8 @@ class BaseState:
         }
 
     def quit(self):
-        print("Quitting...")
+        self.agent.print("Quitting...")
+        self.agent.shutdown()
         exit()
 
 
@@ -16,12 +16,8 @@ class OnboardingGoalsState(BaseState):
 In the 'Goals' substate, the Agent helps the user define their short-term and long-term goals
 """
 
-        # Goals structure
-        self.user_goals = self.agent.db.get_user_goals(self.agent.user_id) or {
-            'short_term': [],
-            'long_term': [],
-            'completed': False
-        }
+        # Goals structure, loaded on first use
+        self._user_goals = None
 
         # Automate self.handlers
         for state in self.states:
@@ -30,6 +26,16 @@ In the 'Goals' substate, the Agent helps the user define their short-term and lo
 
         #self.machine.add_transition(trigger='to_RecommendGoals', source='UserGoals', dest='RecommendGoals')
 
+    @property
+    def user_goals(self):
+        if self._user_goals is None:
+            self._user_goals = self.agent.db.get_user_goals(self.agent.user_id) or {
+                'short_term': [],
+                'long_term': [],
+                'completed': False
+            }
+        return self._user_goals
+
     @property
     def assistant_role(self):
         return f"Onboarding Goals State: {self.state}"
@@ -42,16 +48,47 @@ In the 'Goals' substate, the Agent helps the user define their short-term and lo
         if len(self.user_goals['short_term']) or len(self.user_goals['long_term']) == 0:
             agent_prompt = "What are your goals?"
 
-        prompt_context = """"""
+        prompt_context = """
+JSON Response:
+Rules:
+user_goals: Every goal the user has given so far, split into short-term and long-term goals.
+Format:
+{
+    "agent_response": "<place the agent response to the user here, but DO NOT place the the agent's next question here.>",
+    "next_agent_question": "<agents next question here.>",
+    "user_goals": {"short_term": ["<goal>", ...], "long_term": ["<goal>", ...]}
+}
+"""
         # The Agent's Question
         # System Role: <Global Role><State Role><Substate Role>
         # Prompt Context:
-        self.agent.enter_conversation(
+        conversation = self.agent.enter_conversation(
             prompt_context=prompt_context,
             agent_prompt=agent_prompt, # To use the last agent prompt
             model='gpt-4o'
         )
-        breakpoint()
-        self.to_Roadmap()
+        # None when the input was a command or the reply was unusable, ask again
+        if conversation is None:
+            return True
+
+        self.save_user_goals(conversation['user_input'])
+        # Roadmap is the next sub state of Onboarding
+        self.state_manager.state_class_obj['Onboarding'].to_Roadmap()
         return True
 
+    # Save the goals the model extracted from the conversation, or the user's
+    # own words as a short-term goal when the reply has none
+    def save_user_goals(self, user_input):
+        extracted = self.agent.conversation_state.get('user_goals')
+        if not isinstance(extracted, dict):
+            extracted = {}
+        short_term = [str(goal) for goal in extracted.get('short_term') or []]
+        long_term = [str(goal) for goal in extracted.get('long_term') or []]
+        if not short_term and not long_term:
+            short_term = [user_input.strip()]
+
+        goals = self.user_goals
+        goals['short_term'] = short_term
+        goals['long_term'] = long_term
+        goals['completed'] = True
+        self.agent.db.save_user_goals(self.agent.user_id, goals)
@@ -1,24 +1,48 @@
 from .base_state import BaseState
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from math import pi
+from chart_renderer import get_chart_renderer
+from usage_ledger import usage_labels
+import logging
 import textwrap
+import threading
 import json
 
-# Enable interactive mode
-plt.ion()
+logger = logging.getLogger(__name__)
+
+# Shown when no valid Dimensional Analysis could be generated
+ANALYSIS_ERROR_MESSAGE = "Sorry, I wasn't able to prepare your Dimensional Analysis. I'll try again in a moment."
+
+# pyplot is only needed to open a chart window in the CLI, so it is loaded the
+# first time a chart is shown
+_pyplot = None
+
+def get_pyplot():
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib.pyplot as plt
+        # Enable interactive mode
+        plt.ion()
+        _pyplot = plt
+    return _pyplot
+
+# True when charts can be shown in a window (not in server mode or over ssh)
+def can_display_charts():
+    import matplotlib
+    return matplotlib.get_backend().lower() not in ('agg', 'pdf', 'ps', 'svg', 'cairo', 'template')
 
 def close_spider_chart():
+    plt = get_pyplot()
     plt.close('all')  # Closes all open figures
 
 def display_spider_chart(chart_file):
-    if plt.get_fignums():
-        plt.show()
-    else:
-        img = mpimg.imread(chart_file)
-        imgplot = plt.imshow(img)
-        plt.axis('off')  # Hide the axes
+    import matplotlib.image as mpimg
+    plt = get_pyplot()
+    img = mpimg.imread(chart_file)
+    # Reuse the chart window instead of opening a new figure every time
+    plt.figure('Spider Chart')
+    plt.clf()
+    plt.imshow(img)
+    plt.axis('off')  # Hide the axes
+    plt.show()
 
 def generate_spider_chart(data, output_file):
     """
@@ -33,43 +57,65 @@ def generate_spider_chart(data, output_file):
                          'scores': [Value1, Value2, ...]
                      }
                  }
+    output_file (str): Where to write the chart. The format follows the file
+                 extension (.png or .svg).
 
     Returns:
-    Displays a Spider Chart using Matplotlib.
+    The path of the written chart.
     """
+    fmt = 'svg' if output_file.endswith('.svg') else 'png'
+    content = get_chart_renderer().render(data, fmt=fmt)
+    with open(output_file, 'wb') as file:
+        file.write(content)
+    return output_file
+
+# The Dimensional Analysis prompt for a compact Awareness Profile. Shared by
+# the DimensionAnalysis state and the batch pipeline (batch_analysis.py).
+def build_analysis_prompt(profile_prompt, system_role):
+    return {
+        'system_role': system_role,
+        # User Prompt
+        'user_prompt': f"""Based on the user's self-awareness profile analyze their strengths and weaknesses:
 
-    # Extract labels and scores from the JSON data
-    labels = data['spiderChartData']['labels']
-    scores = data['spiderChartData']['scores']
-
-    # Number of variables we're plotting
-    num_vars = len(labels)
-
-    # Compute angle of each axis
-    angles = np.linspace(0, 2 * np.pi, num_vars, endpoint=False).tolist()
-
-    # Complete the loop for the radar chart
-    scores += scores[:1]
-    angles += angles[:1]
-
-    # Create the figure and axis for the spider chart with a larger figsize
-    fig, ax = plt.subplots(figsize=(8, 8), subplot_kw=dict(polar=True))
-
-    # Plot the data
-    ax.fill(angles, scores, color='red', alpha=0.25)
-    ax.plot(angles, scores, color='red', linewidth=2)
-
-    # Add the labels
-    ax.set_yticklabels([])
-    ax.set_xticks(angles[:-1])
-    ax.set_xticklabels(labels)
-
-    # Ensure layout doesn't cut off the chart
-    plt.tight_layout()
+            - Choose the top two highest scoring dimensions to highlight as their strengths.
+            - Choose the top two lowest scoring dimensions to highlight as areas for growth.
+            - Be compassionate with non-judgmental, empathetic and supportive language.
+            - Normalize the Experience and emphasize that everyone has areas to improve, and it's part of the human experience.
+            - Be aware of how different dimensions interact
+            - In the assistant_role save any information that will be useful when the user enters a conversation about the analysis.
+Awareness Profile:
+{profile_prompt}
 
-    plt.savefig(output_file)
+JSON Response Format:
+{{
+    "Strengths": {{
+        "<top strength dimension>": {{
+            "score_understanding": "<description of how this strength impacts their self-awareness>",
+            "why_this_matters": " "<description of how using this strength will benefit them>",
+            "leveraging_this_strength": "<description of how they can leverage this strength to improve their self-awareness>",
+            "an_interesting_fact": "<description that creates a sense of curiosity and awe to fostering epiphanies and insights>"
+        }},
+        "<second strength dimension>": {{ ... }},
+    }},
+    "AreasForGrowth": {{
+        "<top growth dimension>": {{
+            "score_understanding": "<description of how this weakness impacts their self-awareness>",
+            "why_this_matters": " "<description of how improving this weakness will benefit them>",
+            "leveraging_this_strength": "<description of how they can leverage this weakness to improve their self-awareness>",
+            "an_interesting_fact": "<description that creates a sense of curiosity and awe to fostering epiphanies and insights>"
+        }},
+        "<second strength dimension>": {{ ... }},
+    }},
+    "summary": {{
+        "growth_summary": "<summary of how the growth dimensions are releated and why they are important to address first and together>",
+        "strength_summary": "<summary of how the strength dimensions are releated and how they can be leveraged together>",
+        "next_steps": "<summary of how the agent will work with the user to improve their self-awareness moving forward>"
+    }},
+    "assistant_role": "<save info useful to the next prompt here>"
+}}
+"""
+    }
 
-    return plt
 
 class DimensionAnalysisState(BaseState):
     states = ['Analysis', 'SpiderChart']
@@ -86,13 +132,10 @@ class DimensionAnalysisState(BaseState):
             'SpiderChart': self.handle_SpiderChart,
         }
 
-        # Generate the Dimensional Analysis if it does not exist
-        self.analysis = None
-        self.analysis_json = self.agent.db.get_dimension_analysis(self.agent.user_id)
-        if self.analysis_json == None:
-            self.gen_analysis()
-        else:
-            self.analysis = json.loads(self.analysis_json)
+        # The Dimensional Analysis is loaded (or generated) on first use
+        self._analysis = None
+        self._analysis_json = None
+        self.analysis_lock = threading.RLock()
 
         # Spider Chart Data
         self.spider_chart_data_json = None
@@ -100,127 +143,111 @@ class DimensionAnalysisState(BaseState):
         self.machine.add_transition(trigger='to_SpiderChart', source='Analysis', dest='SpiderChart')
         self.machine.add_transition(trigger='to_Analysis', source='SpiderChart', dest='Analysis')
 
+    @property
+    def analysis(self):
+        self.use_analysis()
+        return self._analysis
+
+    @property
+    def analysis_json(self):
+        self.use_analysis()
+        return self._analysis_json
+
+    # Load the Dimensional Analysis for the user. If no valid analysis could
+    # be generated the user is told and it is generated again on the next use.
+    def use_analysis(self):
+        from response_schemas import ResponseValidationError
+        try:
+            self.load_analysis()
+        except ResponseValidationError as e:
+            logger.warning("Invalid dimension analysis: %s", e)
+            self.agent.write(f"\nAgent:\n{ANALYSIS_ERROR_MESSAGE}\n")
+
+    # Load the Dimensional Analysis, generating it if it does not exist.
+    # Raises ResponseValidationError if no valid analysis was generated.
+    def load_analysis(self):
+        with self.analysis_lock:
+            if self._analysis_json is not None:
+                return
+            analysis_json = self.agent.db.get_dimension_analysis(self.agent.user_id)
+            if analysis_json is None:
+                self.gen_analysis()
+            else:
+                self._analysis_json = analysis_json
+                self._analysis = json.loads(analysis_json)
+
+    def prefetch(self):
+        self.load_analysis()
+
     # Generate a Spider Chart based on the user's Awareness Profile
+    # The scores are computed locally from the profile data
     def display_spider_chart(self):
-        prompt = {
-            # System Role
-            'system_role': f"""You are a compassionate neuropsychologist helping {self.agent.user_info['username']}, born {self.agent.user_info['birthdate']}
-             from {self.agent.user_info['culture']}, who has recently completed a self-awareness assessment. Based on their Awareness scores and profile information:
-            {self.agent.user_info['dimensions']}
-            , you are tasked with analyzing and guiding the user to understand and improve their self awareness.
-            """,
-            # User Prompt
-            'user_prompt': f"""Based on the user's self-awareness profile analyze their strengths and weaknesses utilizing the following neuropsychological frameworks:
-
-            - Create the data necessary to create a Spider Chart for each Dimension to show which dimensions are weak. Weaker dimensions will pull the line to the center of the Spider Chart.
-
-JSON Response Format:
-{{
-    "spiderChartData": {{
-        "labels": [],
-        "scores": []
-    }}
-}}
-"""
-        }
-        json_results = self.agent.get_response(prompt=prompt)
-        results = json.loads(json_results)
-        self.spider_chart_data_json = json_results
-        tmp_profile_spider_chart_file = '/tmp/profile-spider-chart.png'
-        generate_spider_chart(results, tmp_profile_spider_chart_file)
-        display_spider_chart(tmp_profile_spider_chart_file)
+        from profile_scoring import compute_spider_chart_data
+        results = compute_spider_chart_data(self.agent.profile)
+        self.spider_chart_data_json = json.dumps(results)
+        # Rendered headless into a per-chart cache file, so repeated commands
+        # are a cache hit and concurrent users never share a file
+        chart_file = get_chart_renderer().render_to_file(results)
+        if can_display_charts():
+            display_spider_chart(chart_file)
+        self.agent.print(f"Spider Chart: {chart_file}")
         self.to_SpiderChart()
 
 
     def display_dimension_analysis(self):
+        if self.analysis is None:
+            return
         # Set the text width for wrapping and the indentation
         text_width = 100
         indent = ' ' * 4  # 4 spaces
         for category in ['Strengths', 'AreasForGrowth']:
             if category in self.analysis:
-                print('--------------------------')
-                print(category)
-                print('--------------------------')
+                self.agent.print('--------------------------')
+                self.agent.print(category)
+                self.agent.print('--------------------------')
                 dimensions = self.analysis[category]
                 for dimension, details in dimensions.items():
-                    print(dimension)
+                    self.agent.print(dimension)
                     for key, value in details.items():
                         # Format the section title
                         section_title = key.replace('_', ' ').capitalize()
-                        print(f"{indent}{section_title}:")
+                        self.agent.print(f"{indent}{section_title}:")
                         # Wrap the text with indentation
                         wrapped_text = textwrap.fill(value, width=text_width,
                                                     initial_indent=indent * 2,
                                                     subsequent_indent=indent * 2)
-                        print(wrapped_text + '\n')
-                    print('\n')
+                        self.agent.print(wrapped_text + '\n')
+                    self.agent.print('\n')
 
         # Display the summary section
         if 'summary' in self.analysis:
-            print('--------------------------')
-            print('Summary')
-            print('-------\n')
+            self.agent.print('--------------------------')
+            self.agent.print('Summary')
+            self.agent.print('-------\n')
             summary = self.analysis['summary']
             for key, value in summary.items():
                 # Format the section title
                 section_title = key.replace('_', ' ').capitalize()
-                print(f"{indent}{section_title}:")
+                self.agent.print(f"{indent}{section_title}:")
                 # Wrap the text with indentation
                 wrapped_text = textwrap.fill(value, width=text_width,
                                             initial_indent=indent * 2,
                                             subsequent_indent=indent * 2)
-                print(wrapped_text + '\n')
+                self.agent.print(wrapped_text + '\n')
         self.to_Analysis()
 
     def gen_analysis(self):
         # Use the agent to prompt ChatGPT to Analysis the profile and generate an
         # analysis and regommended next steps for the user
-        prompt = {
-            # User Prompt
-            'user_prompt': f"""Based on the user's self-awareness profile analyze their strengths and weaknesses:
-
-            - Choose the top two highest scoring dimensions to highlight as their strengths.
-            - Choose the top two lowest scoring dimensions to highlight as areas for growth.
-            - Be compassionate with non-judgmental, empathetic and supportive language.
-            - Normalize the Experience and emphasize that everyone has areas to improve, and it's part of the human experience.
-            - Be aware of how different dimensions interact
-            - In the assistant_role save any information that will be useful when the user enters a conversation about the analysis.
-Awareness Profile:
-{self.agent.user_info['dimensions']}
-
-JSON Response Format:
-{{
-    "Strengths": {{
-        "<top strength dimension>": {{
-            "score_understanding": "<description of how this strength impacts their self-awareness>",
-            "why_this_matters": " "<description of how using this strength will benefit them>",
-            "leveraging_this_strength": "<description of how they can leverage this strength to improve their self-awareness>",
-            "an_interesting_fact": "<description that creates a sense of curiosity and awe to fostering epiphanies and insights>"
-        }},
-        "<second strength dimension>": {{ ... }},
-    }},
-    "AreasForGrowth": {{
-        "<top growth dimension>": {{
-            "score_understanding": "<description of how this weakness impacts their self-awareness>",
-            "why_this_matters": " "<description of how improving this weakness will benefit them>",
-            "leveraging_this_strength": "<description of how they can leverage this weakness to improve their self-awareness>",
-            "an_interesting_fact": "<description that creates a sense of curiosity and awe to fostering epiphanies and insights>"
-        }},
-        "<second strength dimension>": {{ ... }},
-    }},
-    "summary": {{
-        "growth_summary": "<summary of how the growth dimensions are releated and why they are important to address first and together>",
-        "strength_summary": "<summary of how the strength dimensions are releated and how they can be leveraged together>",
-        "next_steps": "<summary of how the agent will work with the user to improve their self-awareness moving forward>"
-    }},
-    "assistant_role": "<save info useful to the next prompt here>"
-}}
-"""
-        }
-        json_results = self.agent.get_response(prompt=prompt, model='gpt-4o')
-        self.analysis_json = json_results
-        results = json.loads(json_results)
-        self.analysis = results
+        from response_schemas import DimensionAnalysisResponse
+        prompt = build_analysis_prompt(self.agent.get_profile_prompt(), self.agent.system_role)
+        # Repaired if possible, asked again only if the analysis is unusable.
+        # Counted under this state also when prefetched from another one.
+        with usage_labels(state=self.name, sub_state=self.state):
+            analysis, json_results = self.agent.get_validated_response(
+                prompt, DimensionAnalysisResponse, model='gpt-4o')
+        self._analysis_json = json_results
+        self._analysis = json.loads(json_results)
         self.agent.db.save_dimension_analysis(self.agent.user_id, json_results)
         return
 
@@ -247,7 +274,7 @@ You are now in a conversation with the user to discuss the analysis of their sel
 When you have detected the user would like to move on to the Eduaction state, indicate so in the json output.
 
 Awareness Profile:
-{self.agent.user_info['dimensions']}
+{self.agent.get_profile_prompt()}
 
 Dimensional Analysis:
 {self.analysis_json}
@@ -276,7 +303,7 @@ You have generated and displayed a Spider Chart of the users dimension profile.
 Have a conversation with the user to discuss the Spider Chart and answer any questions they may have.
 
 Awareness Profile:
-{self.agent.user_info['dimensions']}
+{self.agent.get_profile_prompt()}
 
 Spider Chart Data:
 {self.spider_chart_data_json}
@@ -1,9 +1,4 @@
 from .base_state import BaseState
-import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-from math import pi
-import textwrap
 import json
 
 class EducationState(BaseState):
@@ -24,6 +19,19 @@ class EducationState(BaseState):
             # 'Resources': self.handle_Resources,
         }
 
+    # The Dimensional Analysis is owned by the DimensionAnalysis state
+    @property
+    def analysis_json(self):
+        return self.state_manager.state_class_obj['DimensionAnalysis'].analysis_json
+
+    # Education builds on the Dimensional Analysis and the compact profile
+    def prefetch(self):
+        if 'DimensionAnalysis' in self.state_manager.state_class_obj:
+            self.state_manager.state_class_obj['DimensionAnalysis'].load_analysis()
+        else:
+            self.state_manager.prefetch_state('DimensionAnalysis')
+        self.agent.get_profile_prompt()
+
     # Handle the Conversation
     def handle_Introduction(self):
         # Enter a conversation with the user asking them if they have any questions about the analysis
@@ -32,7 +40,7 @@ You are now in a conversation with the user to provide Education on the top weak
 When you have detected the user would like to move on to the Practice state, indicate so in the json output.
 
 Awareness Profile:
-{self.agent.user_info['dimensions']}
+{self.agent.get_profile_prompt()}
 
 Awareness Analysis:
 {self.analysis_json}
@@ -54,6 +62,8 @@ Format:
             agent_prompt=None,
             model='gpt-4o',
         )
-        agent_response = json.loads(conversation['agent_response'])
+        # None when the input was a command or the reply was unusable
+        if conversation is None:
+            return
         #if agent_response['next_detected_state'] == 'Education':
         #    self.to_Education()
\ No newline at end of file
@@ -1,9 +1,10 @@
 from .base_state import BaseState
 from .onboarding.onboarding_goals import OnboardingGoalsState
+from profile_compactor import profile_hash
 
 class OnboardingState(BaseState):
     #states = ['Introduction', 'Questionnaire', 'Goals', 'Roadmap']
-    states = ['OnboardingGoals']
+    states = ['OnboardingGoals', 'Roadmap']
 
     def __init__(self, state, state_manager):
 
@@ -26,8 +27,10 @@ their self-awareness journey.
         # }
 
         for state in self.states:
-            state_class = globals()[f"{state}State"]
-            self.state_class_obj[state] = state_class(state, state_manager)
+            # Sub states without their own class are handled here
+            if f"{state}State" in globals():
+                state_class = globals()[f"{state}State"]
+                self.state_class_obj[state] = state_class(state, state_manager)
             if hasattr(self, f"handle_{state}"):
                 self.handlers[state] = getattr(self, f"handle_{state}")
 
@@ -37,11 +40,15 @@ their self-awareness journey.
 
     @property
     def system_role(self):
+        if self.state not in self.state_class_obj:
+            return self.state_system_role
         return f"{self.state_system_role}\n{self.state_class.system_role}"
 
     @property
     def assistant_role(self):
         state_assitant_role = f"Onboarding State: {self.state}"
+        if self.state not in self.state_class_obj:
+            return state_assitant_role
         return f"{state_assitant_role}\n{self.state_class.assistant_role}"
 
     # Agent Introductes itself to the user
@@ -56,6 +63,28 @@ their self-awareness journey.
     def handle_OnboardingGoals(self):
         self.state_class_obj['OnboardingGoals'].process_state()
 
+    # Show the user's roadmap and move on to the Dimensional Analysis
     def handle_Roadmap(self):
-        self.agent.write("Roadmap")
-        self.state_manager.to_Education()
+        roadmap = self.get_roadmap()
+        self.agent.print("--------------------------")
+        self.agent.print("Your Roadmap")
+        self.agent.print("--------------------------")
+        for number, step in enumerate(roadmap['ThreeStepRoadmap'], 1):
+            self.agent.print(f"{number}. {step['subdimension']} ({step['dimension']})")
+            self.agent.write(f"{step['reason']}\n")
+        self.state_manager.to_DimensionAnalysis()
+
+    # The steps are ranked locally from the profile scores (see roadmap.py),
+    # the model only writes the reasons. Stored until the profile changes.
+    def get_roadmap(self):
+        from roadmap import generate_roadmap
+        dimensions_hash = profile_hash(self.agent.profile)
+        saved = self.agent.db.get_roadmap(self.agent.user_id)
+        if saved is not None and saved[0] == dimensions_hash:
+            return saved[1]
+        roadmap = generate_roadmap(
+            self.agent.profile,
+            complete=self.agent.get_response,
+            system_role=self.agent.system_role)
+        self.agent.db.save_roadmap(self.agent.user_id, dimensions_hash, roadmap)
+        return roadmap
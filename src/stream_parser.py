@@ -0,0 +1,116 @@
+# src/stream_parser.py
+#
+# Incremental extraction of a string field from a JSON document that is
+# still being streamed.
+#
+# The agent's replies are JSON objects, but only the 'agent_response' field
+# is shown to the user. JsonFieldStreamer is fed the raw chunks as they
+# arrive from the model and returns the decoded characters of that field so
+# they can be printed before the whole document has been received.
+
+ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+
+class JsonFieldStreamer:
+    def __init__(self, field):
+        self.field = field
+        # True once the start of the field's value has been seen
+        self.found = False
+        # True once the whole value of the field has been seen
+        self.complete = False
+
+        # Scanner state
+        self.stack = []
+        self.in_string = False
+        self.string_is_key = False
+        self.capturing = False
+        self.expect_key = False
+        self.escape = None
+        self.high_surrogate = None
+        self.key = ''
+        self.current_key = None
+
+    # Feed the next chunk of the document. Returns the newly decoded text of
+    # the field (an empty string if none of it was in this chunk).
+    def feed(self, chunk):
+        out = []
+        for ch in chunk:
+            if self.in_string:
+                self._feed_string(ch, out)
+            else:
+                self._feed_structure(ch)
+        return ''.join(out)
+
+    def _feed_structure(self, ch):
+        if ch == '"':
+            self.in_string = True
+            self.string_is_key = self.expect_key
+            self.key = ''
+            # Only capture the value of the top level key
+            self.capturing = (not self.string_is_key
+                              and self.stack == ['{']
+                              and self.current_key == self.field
+                              and not self.complete)
+            if self.capturing:
+                self.found = True
+        elif ch in '{[':
+            self.stack.append(ch)
+            self.expect_key = ch == '{'
+        elif ch in '}]':
+            if self.stack:
+                self.stack.pop()
+            self.expect_key = False
+        elif ch == ',':
+            self.expect_key = bool(self.stack) and self.stack[-1] == '{'
+        elif ch == ':':
+            self.expect_key = False
+
+    def _feed_string(self, ch, out):
+        if self.escape is not None:
+            self.escape += ch
+            if self.escape[0] == 'u':
+                # \uXXXX may be split across chunks
+                if len(self.escape) < 5:
+                    return
+                decoded = self._decode_unicode(int(self.escape[1:], 16))
+            else:
+                decoded = ESCAPES.get(ch, ch)
+            self.escape = None
+            if decoded:
+                self._emit(decoded, out)
+        elif ch == '\\':
+            self.escape = ''
+        elif ch == '"':
+            self.in_string = False
+            if self.string_is_key:
+                self.current_key = self.key
+            elif self.capturing:
+                self.capturing = False
+                self.complete = True
+        else:
+            self._emit(ch, out)
+
+    # Combine UTF-16 surrogate pairs (e.g. emoji) into a single character
+    def _decode_unicode(self, code_point):
+        if 0xD800 <= code_point < 0xDC00:
+            self.high_surrogate = code_point
+            return ''
+        if 0xDC00 <= code_point < 0xE000 and self.high_surrogate is not None:
+            code_point = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code_point - 0xDC00)
+        self.high_surrogate = None
+        return chr(code_point)
+
+    def _emit(self, text, out):
+        if self.string_is_key:
+            self.key += text
+        elif self.capturing:
+            out.append(text)
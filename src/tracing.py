@@ -0,0 +1,291 @@
+# src/tracing.py
+#
+# Lightweight tracing for the turn hot path.
+#
+# A span times one operation and carries attributes (model, tokens,
+# state/sub_state, user_id, ...). Spans opened inside another span on the
+# same thread or asyncio task become its children, so a slow turn can be
+# broken down into its model calls, database calls and background extraction.
+#
+#   with span('llm.complete', model=model) as current:
+#       ...
+#       current.set(prompt_tokens=usage.prompt_tokens)
+#
+#   @traced('state.save')
+#   def save_state(self): ...
+#
+# Finished spans are aggregated into per-span latency histograms, served in
+# the Prometheus text format (prometheus_text(), /metrics in server mode),
+# and with AGENT_TRACE_FILE also appended to a JSON lines file.
+#
+# Tracing is off unless AGENT_TRACE=1, AGENT_TRACE_FILE is set or
+# configure_tracing() is called. When off, span() returns a shared no-op span
+# and @traced functions cost one flag check.
+import atexit
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    __slots__ = ('tracer', 'name', 'attributes', 'trace_id', 'span_id', 'parent_id',
+                 'timestamp', 'start', 'token')
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = f"{random.getrandbits(64):016x}"
+        if parent is None:
+            self.trace_id = self.span_id
+            self.parent_id = None
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self.token = _current_span.set(self)
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        try:
+            _current_span.reset(self.token)
+        except ValueError:
+            # Ended in a different context (e.g. a generator closed elsewhere)
+            pass
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.tracer.finish(self, duration)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        # {(span name, model): Histogram}
+        self.histograms = {}
+        # {(model, 'prompt' or 'completion'): tokens}
+        self.tokens = {}
+        self.file = None
+        # {name: function returning {metric: number}}
+        self.sources = {}
+
+    def configure(self, enabled=True, trace_file=None):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if trace_file:
+                self.file = open(trace_file, 'a', buffering=1 << 16)
+            self.enabled = enabled or self.file is not None
+
+    def finish(self, span, duration):
+        attributes = span.attributes
+        key = (span.name, attributes.get('model'))
+        line = None
+        if self.file is not None:
+            line = json.dumps({
+                'trace_id': span.trace_id,
+                'span_id': span.span_id,
+                'parent_id': span.parent_id,
+                'name': span.name,
+                'timestamp': round(span.timestamp, 6),
+                'duration_ms': round(duration * 1000.0, 3),
+                'thread': threading.current_thread().name,
+                'attributes': attributes,
+            }, default=str)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(duration)
+            if 'error' in attributes:
+                histogram.errors += 1
+            for kind in ('prompt', 'completion'):
+                tokens = attributes.get(f"{kind}_tokens")
+                if tokens:
+                    token_key = (attributes.get('model'), kind)
+                    self.tokens[token_key] = self.tokens.get(token_key, 0) + tokens
+            if line is not None and self.file is not None:
+                self.file.write(line + '\n')
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def prometheus_text(self):
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: (item[0][0], item[0][1] or ''))
+            snapshot = [(key, list(h.counts), h.sum, h.count, h.errors) for key, h in histograms]
+            tokens = sorted(self.tokens.items(), key=lambda item: (item[0][0] or '', item[0][1]))
+            sources = list(self.sources.items())
+
+        lines = [
+            "# HELP agent_span_duration_seconds Duration of traced operations",
+            "# TYPE agent_span_duration_seconds histogram",
+        ]
+        for (name, model), counts, total, count, _ in snapshot:
+            labels = label_text(span=name, model=model)
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'agent_span_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'agent_span_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"agent_span_duration_seconds_sum{{{labels}}} {total}")
+            lines.append(f"agent_span_duration_seconds_count{{{labels}}} {count}")
+        lines.append("# HELP agent_span_errors_total Traced operations that raised")
+        lines.append("# TYPE agent_span_errors_total counter")
+        for (name, model), _, _, _, errors in snapshot:
+            lines.append(f"agent_span_errors_total{{{label_text(span=name, model=model)}}} {errors}")
+        lines.append("# HELP agent_llm_tokens_total Tokens reported by the model")
+        lines.append("# TYPE agent_llm_tokens_total counter")
+        for (model, kind), count in tokens:
+            lines.append(f"agent_llm_tokens_total{{{label_text(model=model, type=kind)}}} {count}")
+
+        for source, collect in sources:
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for metric, value in sorted(values.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"agent_{source}_{metric}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def label_text(**labels):
+    return ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items() if value is not None)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def configure_tracing(enabled=True, trace_file=None):
+    _tracer.configure(enabled=enabled, trace_file=trace_file)
+
+
+def tracing_enabled():
+    return _tracer.enabled
+
+
+# Start a span. Use as a context manager.
+def span(name, **attributes):
+    if not _tracer.enabled:
+        return NOOP_SPAN
+    return Span(_tracer, name, attributes)
+
+
+# Decorator wrapping every call of a function in a span
+def traced(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return fn(*args, **kwargs)
+            with Span(_tracer, name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Bind fn to the current span so work handed to another thread is recorded
+# as part of the same trace
+def bind_context(fn):
+    if not _tracer.enabled:
+        return fn
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+def current_span():
+    return _current_span.get()
+
+
+# Make parent the current span in this context, e.g. in a coroutine that
+# continues a turn started on another thread
+def attach_span(parent):
+    if parent is not None:
+        _current_span.set(parent)
+
+
+# Add numbers from another component to the Prometheus output, e.g.
+# register_metrics_source('prefetch', prefetch_stats)
+def register_metrics_source(name, collect):
+    with _tracer.lock:
+        _tracer.sources[name] = collect
+
+
+def prometheus_text():
+    return _tracer.prometheus_text()
+
+
+if os.getenv("AGENT_TRACE") == "1" or os.getenv("AGENT_TRACE_FILE"):
+    configure_tracing(enabled=True, trace_file=os.getenv("AGENT_TRACE_FILE"))
+atexit.register(_tracer.close)
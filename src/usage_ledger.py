@@ -0,0 +1,228 @@
+# src/usage_ledger.py
+#
+# Token usage and cost accounting.
+#
+# Every model call made for a user is counted in the llm_usage table: one row
+# per user, state, sub_state, model and day with the number of calls, the
+# prompt and completion tokens and the cost. Calls are added up in memory and
+# written once per turn (Agent.flush_background_work), so accounting adds no
+# database write to the model call itself.
+#
+# Streamed replies don't report their usage; their token counts are estimated
+# with the prompt token counter and counted in estimated_calls.
+#
+# The state and sub_state are those of the session, unless the code making the
+# call names its own (background work such as the metadata extraction):
+#
+#   with usage_labels(sub_state='ConversationExtraction'):
+#       agent.get_response(prompt, model='gpt-4o')
+#
+# With AGENT_USER_DAILY_TOKEN_BUDGET set, a user that has used more tokens
+# than that today is switched to AGENT_BUDGET_MODEL (gpt-4o-mini) for the rest
+# of the day.
+#
+# Rollups:
+#
+#   python usage_ledger.py --db agent.db --by state,sub_state,model
+#   python usage_ledger.py --db agent.db --by user_id,day --since 2024-06-01
+import contextlib
+import contextvars
+import os
+import threading
+import weakref
+from datetime import date
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4-turbo': (10.00, 30.00),
+    'gpt-3.5-turbo': (0.50, 1.50),
+}
+
+_labels = contextvars.ContextVar('usage_labels', default=None)
+
+
+# Price of a model, also for dated versions (e.g. gpt-4o-2024-08-06).
+# Returns None for unknown models.
+def model_price(model):
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    # Longest prefix first, so gpt-4o-mini-... isn't priced as gpt-4o
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(f"{name}-"):
+            return MODEL_PRICES[name]
+    return None
+
+
+def usage_cost(model, prompt_tokens, completion_tokens):
+    price = model_price(model)
+    if price is None:
+        return 0.0
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1000000.0
+
+
+# Label the model calls made inside the block. Labels that are not given
+# are taken from the session.
+@contextlib.contextmanager
+def usage_labels(**labels):
+    token = _labels.set(dict(_labels.get() or {}, **labels))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_usage_labels():
+    return _labels.get() or {}
+
+
+class UsageLedger:
+    def __init__(self, db, daily_token_budget=None, budget_model=None):
+        self.db = db
+        # Tokens a user may use per day before being downgraded, 0 for no limit
+        if daily_token_budget is None:
+            daily_token_budget = os.getenv("AGENT_USER_DAILY_TOKEN_BUDGET", 0)
+        self.daily_token_budget = int(daily_token_budget)
+        self.budget_model = budget_model or os.getenv("AGENT_BUDGET_MODEL", "gpt-4o-mini")
+        self.lock = threading.Lock()
+        # Not yet saved: {(user_id, state, sub_state, model, day): [calls,
+        # estimated calls, prompt tokens, completion tokens, cost]}
+        self.pending = {}
+        # Tokens used today by the users whose budget was checked:
+        # {(user_id, day): tokens}, saved and pending
+        self.daily_tokens = {}
+        self.downgrades = 0
+
+    def record(self, user_id, state, sub_state, model, prompt_tokens, completion_tokens, estimated=False):
+        if user_id is None:
+            return
+        day = date.today().isoformat()
+        key = (user_id, state or '', sub_state or '', model, day)
+        cost = usage_cost(model, prompt_tokens, completion_tokens)
+        with self.lock:
+            totals = self.pending.get(key)
+            if totals is None:
+                totals = self.pending[key] = [0, 0, 0, 0, 0.0]
+            totals[0] += 1
+            totals[1] += 1 if estimated else 0
+            totals[2] += prompt_tokens
+            totals[3] += completion_tokens
+            totals[4] += cost
+            if (user_id, day) in self.daily_tokens:
+                self.daily_tokens[(user_id, day)] += prompt_tokens + completion_tokens
+
+    # Save the pending counts. Called once per turn and on shutdown.
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            rows = [key + tuple(totals) for key, totals in self.pending.items()]
+            self.pending = {}
+        # Outside the lock: the threads recording usage may hold the pooled
+        # connections this write waits for
+        try:
+            self.db.save_llm_usage(rows)
+        except Exception:
+            # Keep the counts for the next flush
+            with self.lock:
+                for row in rows:
+                    totals = self.pending.setdefault(row[:5], [0, 0, 0, 0, 0.0])
+                    for index, value in enumerate(row[5:]):
+                        totals[index] += value
+            raise
+
+    # Tokens the user has used today. Loaded from the database once per user
+    # and day, then kept up to date by record(). A flush running while it
+    # loads can make it off by that flush, which is fine for a budget.
+    def tokens_today(self, user_id):
+        day = date.today().isoformat()
+        with self.lock:
+            tokens = self.daily_tokens.get((user_id, day))
+        if tokens is not None:
+            return tokens
+        saved = self.db.get_llm_usage_tokens(user_id, day)
+        with self.lock:
+            if (user_id, day) not in self.daily_tokens:
+                self.daily_tokens[(user_id, day)] = saved + sum(
+                    totals[2] + totals[3] for key, totals in self.pending.items()
+                    if key[0] == user_id and key[4] == day)
+            return self.daily_tokens[(user_id, day)]
+
+    def over_budget(self, user_id):
+        if not self.daily_token_budget or user_id is None:
+            return False
+        return self.tokens_today(user_id) >= self.daily_token_budget
+
+    # The model to call for a user: model, or the budget model once the
+    # user's daily budget is used up
+    def choose_model(self, user_id, model):
+        if model == self.budget_model or not self.over_budget(user_id):
+            return model
+        with self.lock:
+            self.downgrades += 1
+        return self.budget_model
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending_rows': len(self.pending),
+                'downgrades': self.downgrades,
+            }
+
+
+_ledgers = weakref.WeakKeyDictionary()
+_ledgers_lock = threading.Lock()
+
+
+# Return the process-wide ledger of a Database
+def get_usage_ledger(db):
+    with _ledgers_lock:
+        ledger = _ledgers.get(db)
+        if ledger is None:
+            ledger = _ledgers[db] = UsageLedger(db)
+        return ledger
+
+
+def format_rollup(rows, group_by):
+    columns = list(group_by) + ['calls', 'estimated_calls', 'prompt_tokens', 'completion_tokens', 'cost_usd']
+    table = [columns]
+    for row in rows:
+        table.append([f"{row[column]:.4f}" if column == 'cost_usd' else str(row[column]) for column in columns])
+    widths = [max(len(line[index]) for line in table) for index in range(len(columns))]
+    return "\n".join("  ".join(value.ljust(width) for value, width in zip(line, widths)) for line in table)
+
+
+def main():
+    import argparse
+    import sqlite3
+    from database import LLM_USAGE_COLUMNS, Database
+
+    parser = argparse.ArgumentParser(description="Token usage and cost rollups")
+    parser.add_argument('--db', default='agent.db', help="SQLite database file")
+    parser.add_argument('--by', default='state,sub_state,model',
+                        help=f"Comma separated subset of: {', '.join(LLM_USAGE_COLUMNS)}")
+    parser.add_argument('--user', default=None, help="Only this username")
+    parser.add_argument('--since', default=None, help="First day (YYYY-MM-DD)")
+    parser.add_argument('--until', default=None, help="Last day (YYYY-MM-DD)")
+    args = parser.parse_args()
+
+    group_by = [column.strip() for column in args.by.split(',') if column.strip()]
+    # Only reads: the sessions' data is left as it is
+    db = Database(args.db, read_only=True)
+    try:
+        user_id = None
+        if args.user:
+            user_id = db.get_user_info(args.user)['id']
+            if user_id is None:
+                parser.error(f"unknown user: {args.user}")
+        rows = db.get_llm_usage(group_by=group_by, user_id=user_id, since=args.since, until=args.until)
+    except (ValueError, sqlite3.Error) as e:
+        parser.error(str(e))
+    finally:
+        db.close()
+    print(format_rollup(rows, group_by))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+# tests/test_agent.py
+import json
+
+import pytest
+
+from agent import Agent
+from llm_backends import Completion, FakeBackend, LLMBackend, Usage, configure_llm_backend
+from response_cache import ResponseCache
+from response_schemas import DimensionAnalysisResponse, ResponseValidationError
+
+VALID_ANALYSIS = json.dumps({
+    'Strengths': {'Mindfulness': {'score_understanding': 'good'}},
+    'AreasForGrowth': {'Emotional Regulation': {'why_this_matters': 'ok'}},
+})
+PROMPT = {'system_role': 'system', 'user_prompt': 'Analyse the profile'}
+
+
+class StubLedger:
+    def __init__(self):
+        self.records = []
+
+    def choose_model(self, user_id, model):
+        return model
+
+    def record(self, user_id, state, sub_state, model, prompt_tokens, completion_tokens, estimated=False):
+        self.records.append((prompt_tokens, completion_tokens, estimated))
+
+
+# The parts of an Agent get_validated_response uses, answering with replies
+class StubAgent:
+    user_id = 1
+
+    def __init__(self, cache, replies):
+        self.response_cache = cache
+        self.usage_ledger = StubLedger()
+        self.replies = list(replies)
+        self.calls = []
+
+    def completion_params(self):
+        return {}
+
+    def get_response(self, prompt, model="gpt-4o-mini", use_cache=True):
+        self.calls.append(use_cache)
+        return self.replies.pop(0)
+
+    get_validated_response = Agent.get_validated_response
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache.db'))
+    yield cache
+    cache.close()
+
+
+def test_only_validated_reply_is_cached(cache):
+    agent = StubAgent(cache, ['not json', VALID_ANALYSIS])
+    response, text = agent.get_validated_response(PROMPT, DimensionAnalysisResponse, model='gpt-4o')
+    assert 'Mindfulness' in response.Strengths
+    # Both attempts went to the model, not to the cache
+    assert agent.calls == [False, False]
+    assert cache.get(ResponseCache.make_key('gpt-4o', PROMPT, {})) == text
+
+    # Answered from the cache
+    agent = StubAgent(cache, [])
+    assert agent.get_validated_response(PROMPT, DimensionAnalysisResponse, model='gpt-4o')[1] == text
+
+
+def test_invalid_cached_reply_is_asked_again(cache):
+    key = ResponseCache.make_key('gpt-4o', PROMPT, {})
+    cache.put(key, 'gpt-4o', 'not json')
+    agent = StubAgent(cache, [VALID_ANALYSIS])
+    text = agent.get_validated_response(PROMPT, DimensionAnalysisResponse, model='gpt-4o')[1]
+    assert agent.calls == [False]
+    assert cache.get(key) == text
+
+
+def test_invalid_replies_are_not_cached(cache):
+    agent = StubAgent(cache, ['not json'] * 10)
+    with pytest.raises(ResponseValidationError):
+        agent.get_validated_response(PROMPT, DimensionAnalysisResponse, model='gpt-4o')
+    assert cache.get(ResponseCache.make_key('gpt-4o', PROMPT, {})) is None
+
+
+class UsageBackend(LLMBackend):
+    def complete(self, model, messages, params):
+        return Completion('{"agent_response": "Hi"}', Usage(120, 7))
+
+
+# The parts of an Agent get_response_stream uses
+class StreamingAgent:
+    user_id = 1
+
+    def __init__(self):
+        self.usage_ledger = StubLedger()
+
+    def completion_params(self):
+        return {}
+
+    build_messages = Agent.build_messages
+    calibrate_token_counter = Agent.calibrate_token_counter
+    record_usage = Agent.record_usage
+    record_stream_usage = Agent.record_stream_usage
+    get_response_stream = Agent.get_response_stream
+
+
+@pytest.fixture
+def backend():
+    yield configure_llm_backend
+    configure_llm_backend(None)
+
+
+def test_streamed_usage_is_recorded(backend):
+    backend(UsageBackend())
+    agent = StreamingAgent()
+    assert ''.join(agent.get_response_stream(PROMPT)) == '{"agent_response": "Hi"}'
+    assert agent.usage_ledger.records == [(120, 7, False)]
+
+
+def test_streamed_usage_is_estimated_without_a_report(backend):
+    backend(FakeBackend())
+    agent = StreamingAgent()
+    ''.join(agent.get_response_stream(PROMPT))
+    [(prompt_tokens, completion_tokens, estimated)] = agent.usage_ledger.records
+    assert estimated and prompt_tokens > 0 and completion_tokens > 0
@@ -0,0 +1,156 @@
+# tests/test_async_agent.py
+import asyncio
+import os
+
+import pytest
+
+from database import Database
+from llm_backends import Completion, FakeBackend, configure_llm_backend
+
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'kevin', 'profile-data.json')
+
+
+class InputExhausted(Exception):
+    pass
+
+
+# Answers the prompts with the given lines, then ends the session
+class ScriptedIO:
+    def __init__(self, lines, delay=0):
+        self.lines = list(lines)
+        self.delay = delay
+        self.output = []
+
+    async def read_input(self, prompt):
+        self.output.append(prompt)
+        await asyncio.sleep(self.delay)
+        if not self.lines:
+            raise InputExhausted()
+        return self.lines.pop(0)
+
+    def print(self, text=""):
+        self.output.append(text)
+
+    def write(self, text):
+        self.output.append(text)
+
+    def flush(self):
+        pass
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('AGENT_CACHE_DISABLED', '1')
+    monkeypatch.setenv('AGENT_PREFETCH_STATES', '0')
+    configure_llm_backend(FakeBackend())
+    db = Database(str(tmp_path / 'agent.db'))
+    yield db
+    db.close()
+    configure_llm_backend(None)
+
+
+def add_user(db, username):
+    with open(PROFILE_FILE) as f:
+        db.save_user_info({'username': username, 'birthdate': '2000-01-01', 'culture': '{}', 'dimensions': f.read()})
+    return db.get_user_info(username)
+
+
+# A new user's first turns write the compact profile and the dimension
+# analysis on the handler thread before the conversation state is saved
+def test_first_dimension_analysis_turn_is_saved(db, monkeypatch):
+    from async_agent import AsyncAgent
+
+    # The conversation state is part of the turn's transaction
+    in_transaction = []
+    save_conversation_state = db.save_conversation_state
+    def save_in_turn(*args):
+        in_transaction.append(db.transaction_depth > 0)
+        return save_conversation_state(*args)
+    monkeypatch.setattr(db, 'save_conversation_state', save_in_turn)
+
+    with open(PROFILE_FILE) as f:
+        db.save_user_info({'username': 'new-user', 'birthdate': '2000-01-01', 'culture': '{}', 'dimensions': f.read()})
+    user_info = db.get_user_info('new-user')
+    io = ScriptedIO(["I want to be calmer", "Tell me about my strengths"])
+    agent = AsyncAgent(user_info, db, io=io)
+    with pytest.raises(InputExhausted):
+        asyncio.run(agent.main_loop_async())
+
+    assert agent.state_manager.state == 'DimensionAnalysis'
+    assert db.get_dimension_analysis(user_info['id']) is not None
+    assert db.get_conversation_state(user_info['id']) == agent.conversation_state
+    assert in_transaction and all(in_transaction)
+    assert all('database is locked' not in text for text in io.output)
+
+
+# The quit command ends its own session, the others on the loop go on
+def test_quit_ends_only_its_session(db):
+    from async_agent import AsyncAgent
+
+    quitting_io = ScriptedIO(["quit"])
+    other_io = ScriptedIO(["I want to be calmer", "Tell me about my strengths"], delay=0.2)
+    quitting = AsyncAgent(add_user(db, 'quitting'), db, io=quitting_io)
+    other = AsyncAgent(add_user(db, 'other'), db, io=other_io)
+
+    async def run():
+        return await asyncio.gather(quitting.main_loop_async(), other.main_loop_async(), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[0] is None
+    assert isinstance(results[1], InputExhausted)
+    assert "Quitting..." in quitting_io.output
+    # Both turns of the other session were answered after the quit
+    output = ''.join(str(text) for text in other_io.output)
+    assert 'You said: I want to be calmer' in output
+    assert 'You said: Tell me about my strengths' in output
+
+
+# Conversation replies of the small model are not valid JSON
+class BrokenSmallModelBackend(FakeBackend):
+    def __init__(self):
+        super().__init__()
+        self.conversation_models = []
+
+    def broken(self, model, messages):
+        if "User input:" not in messages[-1]['content']:
+            return False
+        self.conversation_models.append(model)
+        return model == 'gpt-4o-mini'
+
+    async def complete_async(self, model, messages, params):
+        if self.broken(model, messages):
+            return Completion("Sorry, I can't answer in JSON")
+        return await super().complete_async(model, messages, params)
+
+    async def stream_async(self, model, messages, params, on_usage=None):
+        if self.broken(model, messages):
+            yield "Sorry, I can't answer in JSON"
+            return
+        async for text in super().stream_async(model, messages, params, on_usage=on_usage):
+            yield text
+
+
+# A routed turn whose small model reply fails validation is answered by
+# the requested model, and counted as an escalation
+def test_failed_small_model_reply_is_escalated(db):
+    from async_agent import AsyncAgent
+    from model_router import _stats, routing_stats
+
+    backend = BrokenSmallModelBackend()
+    configure_llm_backend(backend)
+    _stats.reset()
+    io = ScriptedIO(["ok thanks"])
+    agent = AsyncAgent(add_user(db, 'escalated'), db, io=io)
+    try:
+        with pytest.raises(InputExhausted):
+            asyncio.run(agent.main_loop_async())
+    finally:
+        stats = routing_stats()
+        _stats.reset()
+
+    assert backend.conversation_models[:2] == ['gpt-4o-mini', 'gpt-4o']
+    assert stats['routed'] == 1
+    assert stats['escalations'] == 1
+    output = ''.join(str(text) for text in io.output)
+    assert 'You said: ok thanks' in output
@@ -0,0 +1,63 @@
+# tests/test_awareness_profile.py
+import hashlib
+import json
+import os
+
+import pytest
+
+from awareness_profile import Profile
+from database import Database
+from profile_compactor import compact_profile, profile_hash
+
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'kevin', 'profile-data.json')
+
+
+@pytest.fixture
+def profile_data():
+    with open(PROFILE_FILE) as f:
+        return f.read()
+
+
+def test_from_json_keeps_only_the_scores(profile_data):
+    profile = Profile.from_json(profile_data)
+    assert len(profile.labels) == 10
+    assert len(profile) == 31
+    assert profile.sub_labels[0] == 'Emotional Awareness'
+    assert profile.sub_scores[0] == 21.0
+    assert profile.sub_max_scores[0] == 25.0
+    assert profile.scores[:3] == [82.0, 61.0, 42.0]
+    assert not hasattr(profile, 'raw')
+    assert not hasattr(profile, '__dict__')
+
+
+def test_sub_percentages(profile_data):
+    profile = Profile.from_json(profile_data)
+    assert profile.sub_percentages[0] == pytest.approx(84.0)
+    # Emotional Regulation Strategies: 11 of 25
+    index = profile.sub_labels.index('Emotional Regulation Strategies')
+    assert profile.sub_percentages[index] == pytest.approx(44.0)
+
+
+def test_hash_is_of_the_stored_json(profile_data):
+    profile = Profile.from_json(profile_data)
+    assert profile.hash == hashlib.sha1(profile_data.encode('utf-8')).hexdigest()
+    assert profile_hash(profile) == profile_hash(profile_data)
+    assert Profile.from_json(json.loads(profile_data)).hash == Profile.from_json(json.loads(profile_data)).hash
+
+
+def test_full_detail_level_is_the_stored_json(profile_data):
+    assert compact_profile(profile_data, 'full') == profile_data
+    compact = json.loads(compact_profile(Profile.from_json(profile_data), 'full'))
+    assert compact['sub_labels'][0] == 'Emotional Awareness'
+
+
+def test_user_info_holds_the_profile_not_the_json(tmp_path, profile_data):
+    db = Database(str(tmp_path / 'agent.db'))
+    try:
+        saved = db.save_user_info({'username': 'kevin', 'birthdate': '2000-01-01', 'culture': '{}', 'dimensions': profile_data})
+        user_info = db.get_user_info('kevin')
+        assert 'dimensions' not in saved and 'dimensions' not in user_info
+        assert user_info['profile'].hash == saved['profile'].hash
+        assert db.get_profile_data(user_info['id']) == profile_data
+    finally:
+        db.close()
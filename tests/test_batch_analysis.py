@@ -0,0 +1,46 @@
+# tests/test_batch_analysis.py
+import json
+
+import pytest
+
+from batch_analysis import BatchAnalyzer
+from llm_backends import Completion, LLMBackend, configure_llm_backend
+from response_schemas import ResponseValidationError
+
+VALID_ANALYSIS = json.dumps({
+    'Strengths': {'Mindfulness': {'score_understanding': 'good'}},
+    'AreasForGrowth': {'Emotional Regulation': {'why_this_matters': 'ok'}},
+})
+
+
+# Answers with the given replies in order
+class ScriptedBackend(LLMBackend):
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.calls = 0
+
+    def complete(self, model, messages, params):
+        self.calls += 1
+        return Completion(self.replies.pop(0))
+
+
+@pytest.fixture
+def analyzer(tmp_path):
+    yield BatchAnalyzer(str(tmp_path), artifacts=['analysis'])
+    configure_llm_backend(None)
+
+
+def test_analysis_is_validated_and_retried(analyzer):
+    # Not JSON, then JSON that isn't an analysis, then a valid one
+    backend = ScriptedBackend(['not json', '{"Strengths": {}}', VALID_ANALYSIS])
+    configure_llm_backend(backend)
+    analysis = json.loads(analyzer.generate('analysis', 'user', {}, 'profile'))
+    assert backend.calls == 3
+    assert list(analysis['Strengths']) == ['Mindfulness']
+
+
+def test_invalid_analysis_fails_the_artifact(analyzer, monkeypatch):
+    monkeypatch.setenv('AGENT_RESPONSE_ATTEMPTS', '2')
+    configure_llm_backend(ScriptedBackend(['not json', '[]']))
+    with pytest.raises(ResponseValidationError):
+        analyzer.generate('analysis', 'user', {}, 'profile')
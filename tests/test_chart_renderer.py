@@ -0,0 +1,82 @@
+# tests/test_chart_renderer.py
+import pytest
+
+from chart_renderer import ChartRenderer
+
+LABELS = ['Mindfulness', 'Empathy', 'Emotional Regulation', 'Metacognition']
+
+
+def chart(scores, labels=LABELS):
+    return {'spiderChartData': {'labels': list(labels), 'scores': list(scores)}}
+
+
+@pytest.fixture
+def renderer(tmp_path):
+    renderer = ChartRenderer(cache_dir=str(tmp_path), figsize=(2, 2), dpi=50)
+    yield renderer
+    renderer.close()
+
+
+def test_cache_hit_returns_the_same_bytes_without_rendering(renderer, monkeypatch):
+    png = renderer.render(chart([50, 60, 70, 80]))
+    assert png.startswith(b'\x89PNG')
+
+    def fail(*args):
+        raise AssertionError("rendered again")
+    monkeypatch.setattr(renderer, 'get_template', fail)
+    assert renderer.render(chart([50, 60, 70, 80])) == png
+    assert renderer.stats()['hits'] == 1
+    assert renderer.stats()['renders'] == 1
+
+
+def test_render_to_file_is_content_addressed(renderer):
+    path = renderer.render_to_file(chart([50, 60, 70, 80]))
+    assert renderer.render_to_file(chart([50, 60, 70, 80])) == path
+    assert renderer.render_to_file(chart([50, 60, 70, 81])) != path
+    with open(path, 'rb') as f:
+        assert f.read() == renderer.render(chart([50, 60, 70, 80]))
+
+
+def test_keys_differ_by_scores_format_and_labels(renderer):
+    key = renderer.make_key(LABELS, [50, 60, 70, 80], 'png')
+    assert renderer.make_key(LABELS, [50.0, 60.0, 70.0, 80.0], 'png') == key
+    assert renderer.make_key(LABELS, [50, 60, 70, 81], 'png') != key
+    assert renderer.make_key(LABELS, [50, 60, 70, 80], 'svg') != key
+    assert renderer.make_key(LABELS[::-1], [50, 60, 70, 80], 'png') != key
+    assert ChartRenderer(dpi=51).make_key(LABELS, [50, 60, 70, 80], 'png') != key
+
+
+def test_unknown_format(renderer):
+    with pytest.raises(ValueError):
+        renderer.render(chart([50, 60, 70, 80]), fmt='gif')
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    renderer = ChartRenderer(cache_dir=str(tmp_path), max_cached=2, figsize=(2, 2), dpi=50)
+    try:
+        first = renderer.make_key(LABELS, [10, 10, 10, 10], 'png')
+        renderer.render(chart([10, 10, 10, 10]))
+        renderer.render(chart([20, 20, 20, 20]))
+        # Used again, so the second chart is the oldest
+        renderer.render(chart([10, 10, 10, 10]))
+        renderer.render(chart([30, 30, 30, 30]))
+        assert len(renderer.cache) == 2
+        assert first in renderer.cache
+        assert renderer.make_key(LABELS, [20, 20, 20, 20], 'png') not in renderer.cache
+    finally:
+        renderer.close()
+
+
+def test_templates_are_bounded(tmp_path):
+    renderer = ChartRenderer(cache_dir=str(tmp_path), max_templates=2, figsize=(2, 2), dpi=50)
+    try:
+        for count in (3, 4, 5):
+            renderer.render(chart([50] * count, labels=LABELS[:1] + [f"D{index}" for index in range(count - 1)]))
+        assert renderer.stats()['templates'] == 2
+        # Only the two most recent label sets are kept
+        assert [len(labels) for labels in renderer.templates] == [4, 5]
+        # The same labels reuse their template
+        labels = next(reversed(renderer.templates))
+        assert renderer.get_template(tuple(labels)) is renderer.templates[labels]
+    finally:
+        renderer.close()
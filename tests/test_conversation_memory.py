@@ -0,0 +1,85 @@
+# tests/test_conversation_memory.py
+import json
+
+import pytest
+
+from assistants.conversation_memory import ConversationMemory
+from database import Database
+
+
+# The parts of an Agent the memory uses. Summaries list the events they were
+# given.
+class StubAgent:
+    user_id = 1
+
+    def __init__(self, db):
+        self.db = db
+        self.prompts = []
+
+    def get_response(self, prompt, model="gpt-4o-mini"):
+        self.prompts.append(prompt)
+        events = prompt['user_prompt'].split("New conversation events:\n", 1)[1]
+        return json.dumps({'summary': events.replace("\n", ",")})
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'agent.db'))
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def memory(db):
+    memory = ConversationMemory(StubAgent(db), summary_batch_size=3, recent_events=2, max_summary_events=4)
+    yield memory
+    memory.close()
+
+
+def add_events(db, *messages, state='Education'):
+    for message in messages:
+        db.save_conversation_event(1, state, message)
+
+
+def test_context_has_the_recent_events(db, memory):
+    add_events(db, 'e1', 'e2', 'e3')
+    assert memory.get_context() == "Recent conversation events:\ne2\ne3\n"
+    assert memory.get_context('Practice') == ""
+
+
+def test_no_update_below_the_batch_size(db, memory):
+    add_events(db, 'e1', 'e2')
+    memory.update('Education')
+    memory.flush(wait=True)
+    assert memory.agent.prompts == []
+    assert db.get_conversation_summary(1, None) is None
+
+
+def test_summary_is_flushed(db, memory):
+    add_events(db, 'e1', 'e2', 'e3')
+    memory.update('Education')
+    memory.flush(wait=True)
+    assert db.get_conversation_summary(1, None)[0] == 'e1,e2,e3'
+    assert db.get_conversation_summary(1, 'Education')[0] == 'e1,e2,e3'
+
+    # Summarized events are no longer repeated verbatim
+    add_events(db, 'e4')
+    assert memory.get_context() == "Conversation summary:\ne1,e2,e3\n\nRecent conversation events:\ne4\n"
+    assert memory.get_context('Education') == ("Conversation summary:\ne1,e2,e3\n\n"
+                                               "Conversation summary in the Education state:\ne1,e2,e3\n\n"
+                                               "Recent conversation events:\ne4\n")
+
+
+def test_summary_batch_is_capped(db, memory):
+    add_events(db, *[f"e{number}" for number in range(1, 11)])
+    memory.update()
+    memory.flush(wait=True)
+    # The oldest events first, the rest are left for the next update
+    assert db.get_conversation_summary(1, None)[0] == 'e1,e2,e3,e4'
+    memory.update()
+    memory.flush(wait=True)
+    assert db.get_conversation_summary(1, None)[0] == 'e5,e6,e7,e8'
+    assert db.count_conversation_events(1, after_id=db.get_conversation_summary(1, None)[1]) == 2
+    memory.update()
+    memory.flush(wait=True)
+    assert len(memory.agent.prompts) == 2
@@ -0,0 +1,83 @@
+# tests/test_database.py
+import sqlite3
+
+import pytest
+
+from database import HOT_QUERIES, Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'agent.db'))
+    yield db
+    db.close()
+
+
+def test_hot_queries_use_indexes(db):
+    plans = db.check_query_plans()
+    assert set(plans) == set(HOT_QUERIES)
+
+
+def test_save_dimension_analysis_replaces_previous(db):
+    db.save_dimension_analysis(1, {'version': 1})
+    db.save_dimension_analysis(1, {'version': 2})
+    db.save_dimension_analysis(2, {'version': 1})
+    assert db.get_dimension_analysis(1) == '{"version": 2}'
+    assert db.get_dimension_analysis(2) == '{"version": 1}'
+    with db.connection() as conn:
+        count = conn.execute('SELECT COUNT(*) FROM dimension_analysis WHERE user_id = 1').fetchone()[0]
+    assert count == 1
+
+
+def test_migration_keeps_latest_dimension_analysis(tmp_path):
+    db_file = str(tmp_path / 'agent.db')
+    db = Database(db_file)
+    db.close()
+    # A database written before dimension analyses were unique per user
+    conn = sqlite3.connect(db_file)
+    conn.execute('DROP INDEX idx_dimension_analysis_user')
+    conn.execute('CREATE INDEX idx_dimension_analysis_user ON dimension_analysis (user_id)')
+    conn.executemany('INSERT INTO dimension_analysis (user_id, analysis) VALUES (?, ?)',
+                     [(1, 'old'), (1, 'new'), (2, 'only')])
+    # Before migration 4
+    conn.execute('PRAGMA user_version = 3')
+    conn.commit()
+    conn.close()
+
+    db = Database(db_file)
+    try:
+        assert db.get_dimension_analysis(1) == 'new'
+        assert db.get_dimension_analysis(2) == 'only'
+        db.save_dimension_analysis(1, 'newer')
+        assert db.get_dimension_analysis(1) == 'newer'
+    finally:
+        db.close()
+
+
+def test_commit_pending_releases_connection(db):
+    other = sqlite3.connect(db.db_file)
+    try:
+        with db.transaction():
+            db.save_dimension_analysis(1, 'before input')
+            db.commit_pending()
+            # Committed and back in the pool while waiting on the user
+            assert getattr(db.local, 'conn', None) is None
+            assert other.execute('SELECT analysis FROM dimension_analysis WHERE user_id = 1').fetchone() == ('before input',)
+            # The block goes on as a transaction
+            db.save_dimension_analysis(2, 'after input')
+            assert other.execute('SELECT COUNT(*) FROM dimension_analysis WHERE user_id = 2').fetchone() == (0,)
+        assert other.execute('SELECT COUNT(*) FROM dimension_analysis WHERE user_id = 2').fetchone() == (1,)
+    finally:
+        other.close()
+
+
+def test_reopening_keeps_agent_state(tmp_path):
+    db_file = str(tmp_path / 'agent.db')
+    db = Database(db_file)
+    db.save_agent_state(1, '{"state": "Education"}')
+    db.close()
+    db = Database(db_file)
+    try:
+        assert db.get_agent_state(1) == '{"state": "Education"}'
+    finally:
+        db.close()
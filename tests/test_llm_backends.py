@@ -0,0 +1,93 @@
+# tests/test_llm_backends.py
+import asyncio
+import json
+
+import pytest
+
+from llm_backends import (Completion, FakeBackend, LLMBackend, RecordingBackend, RecordingStore, ReplayBackend,
+                          ReplayMissError, Usage, backend_from_env)
+
+PARAMS = {'temperature': 0.7}
+
+
+def messages(text):
+    return [{'role': 'system', 'content': 'system'}, {'role': 'user', 'content': text}]
+
+
+# Answers every request with a reply naming the request
+class EchoBackend(LLMBackend):
+    def __init__(self):
+        self.calls = 0
+
+    def complete(self, model, messages, params):
+        self.calls += 1
+        content = json.dumps({'agent_response': f"{model}: {messages[-1]['content']}" * 5})
+        return Completion(content, Usage(len(messages), len(content)))
+
+    async def complete_async(self, model, messages, params):
+        return self.complete(model, messages, params)
+
+
+def answers(backend):
+    completion = backend.complete('gpt-4o', messages('one'), PARAMS)
+    usages = []
+    streamed = ''.join(backend.stream('gpt-4o-mini', messages('two'), PARAMS, on_usage=usages.append))
+
+    async def complete_async():
+        return await backend.complete_async('gpt-4o', messages('three'), PARAMS)
+
+    async_completion = asyncio.run(complete_async())
+    return [
+        (completion.content, completion.usage.prompt_tokens, completion.usage.completion_tokens),
+        (streamed, usages[0].prompt_tokens, usages[0].completion_tokens),
+        (async_completion.content, async_completion.usage.prompt_tokens, async_completion.usage.completion_tokens),
+    ]
+
+
+def test_replay_returns_the_recorded_session(tmp_path):
+    path = str(tmp_path / 'recording.jsonl')
+    live = EchoBackend()
+    recorded = answers(RecordingBackend(live, RecordingStore(path)))
+    assert live.calls == 3
+
+    # A new process reading the recording
+    replay = ReplayBackend(RecordingStore(path))
+    assert answers(replay) == recorded
+    assert live.calls == 3
+
+
+def test_replay_miss_fails(tmp_path):
+    path = str(tmp_path / 'recording.jsonl')
+    RecordingBackend(EchoBackend(), RecordingStore(path)).complete('gpt-4o', messages('one'), PARAMS)
+    replay = ReplayBackend(RecordingStore(path))
+
+    # A different prompt, model or parameters is not the recorded request
+    with pytest.raises(ReplayMissError, match='gpt-4o'):
+        replay.complete('gpt-4o', messages('other'), PARAMS)
+    with pytest.raises(ReplayMissError):
+        replay.complete('gpt-4o-mini', messages('one'), PARAMS)
+    with pytest.raises(ReplayMissError):
+        list(replay.stream('gpt-4o', messages('one'), {'temperature': 0}))
+
+
+def test_replay_fallback(tmp_path):
+    replay = ReplayBackend(RecordingStore(str(tmp_path / 'recording.jsonl')), fallback=FakeBackend())
+    reply = json.loads(replay.complete('gpt-4o', messages("\nUser input:\nhello"), PARAMS).content)
+    assert reply['agent_response'] == "Thank you for sharing that. You said: hello"
+
+
+def test_partial_last_line_is_ignored(tmp_path):
+    path = tmp_path / 'recording.jsonl'
+    RecordingBackend(EchoBackend(), RecordingStore(str(path))).complete('gpt-4o', messages('one'), PARAMS)
+    with open(path, 'a') as file:
+        file.write('{"k": "trunc')
+    assert len(RecordingStore(str(path))) == 1
+
+
+def test_replay_backend_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv('AGENT_LLM_BACKEND', 'replay')
+    monkeypatch.setenv('AGENT_LLM_RECORDING', str(tmp_path / 'missing.jsonl'))
+    backend = backend_from_env()
+    assert isinstance(backend, ReplayBackend)
+    with pytest.raises(ReplayMissError):
+        backend.complete('gpt-4o', messages('one'), PARAMS)
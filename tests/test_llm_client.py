@@ -0,0 +1,142 @@
+# tests/test_llm_client.py
+#
+# The shared LLM client against a local stub of the chat completions API.
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_client
+from llm_backends import OpenAIBackend
+from llm_client import close_llm_client, configure_llm_client, get_async_llm_client, get_llm_client
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        request = json.loads(self.rfile.read(length))
+        self.server.client_ports.append(self.client_address[1])
+        time.sleep(self.server.delay)
+        if request.get('stream'):
+            self.send_stream(request)
+            return
+        body = json.dumps({
+            'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': request['model'],
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': 'pong'}}],
+            'usage': {'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4},
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Server-sent events, with a last usage chunk when it was asked for
+    def send_stream(self, request):
+        chunks = [{'index': 0, 'delta': {'role': 'assistant', 'content': text}, 'finish_reason': None}
+                  for text in ['po', 'ng']]
+        events = [{'choices': [choice]} for choice in chunks]
+        if request.get('stream_options', {}).get('include_usage'):
+            events.append({'choices': [], 'usage': {'prompt_tokens': 3, 'completion_tokens': 1, 'total_tokens': 4}})
+        body = ''.join(
+            'data: ' + json.dumps(dict(event, id='stub', object='chat.completion.chunk', created=0,
+                                       model=request['model'])) + '\n\n'
+            for event in events) + 'data: [DONE]\n\n'
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub_server(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.client_ports = []
+    server.delay = 0.0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv('OPENAI_BASE_URL', f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setenv('OPENAI_API_KEY', 'test-key')
+    monkeypatch.setenv('AGENT_LLM_MAX_RETRIES', '0')
+    monkeypatch.setenv('AGENT_LLM_READ_TIMEOUT', '0.5')
+    configure_llm_client()
+    yield server
+    close_llm_client()
+    server.shutdown()
+    server.server_close()
+
+
+def ask(client):
+    completion = client.chat.completions.create(
+        model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'ping'}])
+    return completion.choices[0].message.content
+
+
+def test_requests_reuse_one_pooled_connection(stub_server):
+    client = get_llm_client()
+    assert get_llm_client() is client
+    assert [ask(client) for _ in range(3)] == ['pong'] * 3
+    # Same client port: the connection was kept alive, not reopened
+    assert len(stub_server.client_ports) == 3
+    assert len(set(stub_server.client_ports)) == 1
+
+
+def test_read_timeout(stub_server):
+    import openai
+    stub_server.delay = 1.5
+    start = time.monotonic()
+    with pytest.raises(openai.APITimeoutError):
+        ask(get_llm_client())
+    assert time.monotonic() - start < 1.4
+
+
+def test_close_llm_client_closes_async_clients(stub_server):
+    loop = asyncio.new_event_loop()
+    try:
+        async def call():
+            client = get_async_llm_client()
+            completion = await client.chat.completions.create(
+                model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'ping'}])
+            return client, completion.choices[0].message.content
+
+        client, content = loop.run_until_complete(call())
+        assert content == 'pong'
+        assert loop in llm_client._async_clients
+        close_llm_client()
+        assert loop not in llm_client._async_clients
+        assert client.is_closed()
+    finally:
+        loop.close()
+
+
+def test_stream_reports_usage(stub_server):
+    usages = []
+    messages = [{'role': 'user', 'content': 'ping'}]
+    assert list(OpenAIBackend().stream('gpt-4o-mini', messages, {}, on_usage=usages.append)) == ['po', 'ng']
+    assert [(usage.prompt_tokens, usage.completion_tokens) for usage in usages] == [(3, 1)]
+
+
+def test_stream_async_reports_usage(stub_server):
+    usages = []
+    messages = [{'role': 'user', 'content': 'ping'}]
+
+    async def call():
+        try:
+            return [text async for text in OpenAIBackend().stream_async('gpt-4o-mini', messages, {},
+                                                                          on_usage=usages.append)]
+        finally:
+            close_llm_client()
+
+    assert asyncio.run(call()) == ['po', 'ng']
+    assert [(usage.prompt_tokens, usage.completion_tokens) for usage in usages] == [(3, 1)]
@@ -0,0 +1,54 @@
+# tests/test_model_router.py
+import pytest
+
+from model_router import ModelRouter, _stats, routing_stats
+from nlp_processor import NLPProcessor
+
+
+@pytest.fixture(autouse=True)
+def stats():
+    _stats.reset()
+    yield
+    _stats.reset()
+
+
+@pytest.mark.parametrize('user_input, category', [
+    ("", 'acknowledgement'),
+    ("ok", 'acknowledgement'),
+    ("Ok, thanks!", 'acknowledgement'),
+    ("got it, makes sense", 'acknowledgement'),
+    ("no", 'acknowledgement'),
+    ("next", 'navigation'),
+    ("Let's move on to education please", 'navigation'),
+    ("I'm ready", 'navigation'),
+    ("go back", 'navigation'),
+    ("What does my score mean?", 'question'),
+    ("explain the chart", 'question'),
+    ("ok?", 'question'),
+    ("I'm not ready", 'statement'),
+    ("I know my goals", 'statement'),
+    ("I'm done being anxious at work, it is exhausting", 'statement'),
+    ("I want to be calmer", 'statement'),
+    ("thanks, that really helped me understand my anger at my brother", 'statement'),
+])
+def test_classify_turn(user_input, category):
+    assert NLPProcessor().classify_turn(user_input)[0] == category
+
+
+def test_small_turns_go_to_the_small_model():
+    router = ModelRouter(small_model='gpt-4o-mini', enabled=True)
+    assert router.route("ok thanks", 'gpt-4o').model == 'gpt-4o-mini'
+    assert router.route("next", 'gpt-4o').routed
+    question = router.route("Why is that?", 'gpt-4o')
+    assert question.model == 'gpt-4o' and not question.routed
+    stats = routing_stats()
+    assert (stats['turns'], stats['routed'], stats['acknowledgement'], stats['navigation'], stats['question']) == (3, 2, 1, 1, 1)
+
+
+def test_routing_can_be_disabled(monkeypatch):
+    monkeypatch.setenv('AGENT_MODEL_ROUTING', '0')
+    router = ModelRouter()
+    decision = router.route("ok thanks", 'gpt-4o')
+    assert decision.category == 'acknowledgement'
+    assert decision.model == 'gpt-4o' and not decision.routed
+    assert routing_stats()['routed'] == 0
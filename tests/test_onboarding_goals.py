@@ -0,0 +1,78 @@
+# tests/test_onboarding_goals.py
+from states.onboarding.onboarding_goals import OnboardingGoalsState
+
+
+class StubDB:
+    def __init__(self):
+        self.goals = {}
+
+    def get_user_goals(self, user_id):
+        return self.goals.get(user_id)
+
+    def save_user_goals(self, user_id, goals):
+        self.goals[user_id] = dict(goals)
+
+
+# Answers enter_conversation with the given conversations, None standing for
+# a command or an invalid reply
+class StubAgent:
+    user_id = 1
+
+    def __init__(self, conversations):
+        self.db = StubDB()
+        self.conversations = list(conversations)
+        self.conversation_state = {}
+
+    def write(self, text):
+        pass
+
+    def enter_conversation(self, prompt_context, agent_prompt=None, model=None):
+        conversation, self.conversation_state = self.conversations.pop(0)
+        return conversation
+
+
+class StubOnboarding:
+    def __init__(self):
+        self.advanced = 0
+
+    def to_Roadmap(self):
+        self.advanced += 1
+
+
+class StubStateManager:
+    def __init__(self, agent):
+        self.agent = agent
+        self.state_class_obj = {'Onboarding': StubOnboarding()}
+
+
+def make_state(conversations):
+    state_manager = StubStateManager(StubAgent(conversations))
+    return OnboardingGoalsState('Goals', state_manager), state_manager
+
+
+def turn(user_input, **state):
+    return {'user_input': user_input, 'agent_response': '{}'}, dict(state, agent_response='', next_agent_question='')
+
+
+def test_stays_until_goals_are_given():
+    goals_state, state_manager = make_state([(None, {}), (None, {})])
+    goals_state.handle_UserGoals()
+    goals_state.handle_UserGoals()
+    assert state_manager.state_class_obj['Onboarding'].advanced == 0
+    assert state_manager.agent.db.goals == {}
+
+
+def test_goals_are_saved_before_the_roadmap():
+    extracted = {'short_term': ['Sleep more'], 'long_term': ['Be calmer at work']}
+    goals_state, state_manager = make_state([turn("Sleep more and be calmer at work", user_goals=extracted)])
+    goals_state.handle_UserGoals()
+    assert state_manager.state_class_obj['Onboarding'].advanced == 1
+    assert state_manager.agent.db.goals[1] == {'short_term': ['Sleep more'], 'long_term': ['Be calmer at work'],
+                                               'completed': True}
+
+
+def test_user_input_is_kept_when_the_reply_has_no_goals():
+    goals_state, state_manager = make_state([turn("  I want to listen better  ")])
+    goals_state.handle_UserGoals()
+    assert state_manager.agent.db.goals[1]['short_term'] == ['I want to listen better']
+    assert state_manager.state_class_obj['Onboarding'].advanced == 1
@@ -0,0 +1,61 @@
+# tests/test_prefetch.py
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from prefetch import PrefetchScheduler, _stats, prefetch_stats
+
+
+class StubState:
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+
+    def prefetch(self):
+        if self.fail:
+            raise RuntimeError("no analysis")
+
+
+class StubStateManager:
+    def __init__(self, fail=False):
+        self.state = 'Education'
+        self.state_class_obj = {}
+        self.fail = fail
+
+    def build_state(self, state):
+        return StubState(state, fail=self.fail)
+
+
+@pytest.fixture
+def executor():
+    _stats.reset()
+    executor = ThreadPoolExecutor(max_workers=1)
+    yield executor
+    executor.shutdown()
+    _stats.reset()
+
+
+def test_data_lookup_is_not_a_miss(executor):
+    scheduler = PrefetchScheduler(StubStateManager(), executor=executor)
+    assert scheduler.take('DimensionAnalysis', transition=False) is None
+    assert prefetch_stats()['misses'] == 0
+    assert scheduler.take('Education') is None
+    assert prefetch_stats()['misses'] == 1
+
+
+def test_prefetched_state_is_a_hit(executor):
+    scheduler = PrefetchScheduler(StubStateManager(), executor=executor)
+    scheduler.schedule('DimensionAnalysis')
+    state_obj = scheduler.take('DimensionAnalysis', transition=False)
+    assert state_obj.name == 'DimensionAnalysis'
+    stats = prefetch_stats()
+    assert stats['hits'] + stats['late_hits'] == 1
+    assert stats['misses'] == 0
+
+
+def test_failed_prefetch_is_logged(executor, caplog):
+    scheduler = PrefetchScheduler(StubStateManager(fail=True), executor=executor)
+    scheduler.schedule('DimensionAnalysis')
+    assert scheduler.take('DimensionAnalysis') is None
+    assert prefetch_stats()['failed'] == 1
+    assert "Prefetch of state DimensionAnalysis failed: no analysis" in caplog.text
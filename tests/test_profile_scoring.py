@@ -0,0 +1,46 @@
+# tests/test_profile_scoring.py
+import json
+import os
+
+import pytest
+
+from awareness_profile import Profile
+from profile_compactor import compact_profile
+from profile_scoring import compute_dimension_scores, compute_spider_chart_data
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'kevin')
+
+
+@pytest.fixture
+def profile_data():
+    with open(os.path.join(DATA_DIR, 'profile-data.json')) as f:
+        return f.read()
+
+
+def test_dimension_scores_match_the_snapshot(profile_data):
+    with open(os.path.join(DATA_DIR, 'profile-snapshot.json')) as f:
+        snapshot = json.load(f)
+    labels, scores = compute_dimension_scores(profile_data)
+    assert scores == [82, 61, 42, 62, 46, 57, 51, 61, 59, 64]
+    assert scores == snapshot['spiderChartData']['scores']
+    assert compute_spider_chart_data(Profile.from_json(profile_data))['spiderChartData']['scores'] == scores
+
+
+def test_prompt_uses_the_stored_dimension_scores(profile_data):
+    prompt = compact_profile(profile_data, 'dimensions')
+    assert "External Self-Awareness: 61%" in prompt
+    assert "Emotional Regulation: 42%" in prompt
+
+
+def test_dimension_without_score_is_aggregated():
+    profile_data = {
+        'Mindfulness': {
+            'Acceptance': {'score': 15, 'questions': [{'answer': 3}] * 5},
+            'Present-Moment Awareness': {'score': 10, 'questions': [{'answer': 2}] * 5},
+        },
+        'Empathy': {
+            'score': 70,
+            'Listening': {'score': 20, 'questions': [{'answer': 4}] * 5},
+        },
+    }
+    assert compute_dimension_scores(profile_data) == (['Mindfulness', 'Empathy'], [50, 70])
@@ -0,0 +1,69 @@
+# tests/test_prompt_builder.py
+import pytest
+
+from prompt_builder import TRIM_MARKER, PromptBuilder, TokenCounter
+
+
+# One token per character, so the expected sizes are exact
+@pytest.fixture
+def counter():
+    counter = TokenCounter(chars_per_token=1.0)
+    counter.encoding = None
+    return counter
+
+
+def test_truncate_keeps_tail_or_head(counter):
+    text = 'abcdefghijklmnopqrstuvwxyz'
+    assert counter.truncate(text, 26) == text
+    assert counter.truncate(text, 15, keep='tail') == TRIM_MARKER + 'qrstuvwxyz'
+    assert counter.truncate(text, 15, keep='head') == 'abcdefghij' + TRIM_MARKER
+    assert counter.count(counter.truncate(text, 15)) == 15
+
+
+def test_truncate_without_room_for_the_marker(counter):
+    assert counter.truncate('abcdefghij', len(TRIM_MARKER)) == ''
+    assert counter.truncate('abcdefghij', 0) == ''
+
+
+def test_section_budget(counter):
+    builder = PromptBuilder(max_tokens=1000, counter=counter)
+    builder.add_section('history', 'assistant_role', 'h' * 50 + 'recent', budget=16, trim='tail')
+    builder.add_section('role', 'assistant_role', 'role text', trim='head')
+    prompt = builder.build()
+    assert prompt['assistant_role'] == f"{TRIM_MARKER}hhhhhrecent\nrole text"
+
+    usage = builder.usage()['sections']
+    assert usage['history'] == {'tokens': 16, 'original_tokens': 56, 'budget': 16, 'trimmed': True}
+    assert not usage['role']['trimmed']
+
+
+def test_lowest_priority_is_trimmed_first(counter):
+    builder = PromptBuilder(max_tokens=60, counter=counter)
+    builder.add_section('system_role', 'system_role', 's' * 20, priority=100, trim=None)
+    builder.add_section('state_role', 'system_role', 'r' * 20, priority=90, trim='head')
+    builder.add_section('history', 'assistant_role', 'h' * 30, priority=10, trim='tail')
+    builder.build()
+    usage = builder.usage()
+    assert usage['total_tokens'] == 60
+    # The 10 tokens over the limit all came out of the history
+    assert usage['sections']['history']['tokens'] == 20
+    assert usage['sections']['state_role']['tokens'] == 20
+
+
+def test_trimming_moves_on_to_the_next_priority(counter):
+    builder = PromptBuilder(max_tokens=30, counter=counter)
+    builder.add_section('system_role', 'system_role', 's' * 20, priority=100, trim=None)
+    builder.add_section('state_role', 'system_role', 'r' * 20, priority=90, trim='head')
+    builder.add_section('history', 'assistant_role', 'h' * 20, priority=10, trim='tail')
+    prompt = builder.build()
+    assert builder.total_tokens() == 30
+    # The history could not give enough, then the state role was cut at its end
+    assert prompt['assistant_role'] == ''
+    assert prompt['system_role'] == 's' * 20 + '\nrrrrr' + TRIM_MARKER
+
+
+def test_untrimmable_sections_are_kept(counter):
+    builder = PromptBuilder(max_tokens=10, counter=counter)
+    builder.add_section('user_input', 'user_prompt', 'u' * 30, priority=100, trim=None)
+    assert builder.build() == {'user_prompt': 'u' * 30}
+    assert builder.total_tokens() == 30
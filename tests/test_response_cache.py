@@ -0,0 +1,91 @@
+# tests/test_response_cache.py
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, 'time', clock.time)
+    return clock
+
+
+def make_cache(tmp_path, **kwargs):
+    return ResponseCache(str(tmp_path / 'cache.db'), **kwargs)
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100)
+    cache.put('a', 'gpt-4o', 'A')
+    clock.now += 100
+    assert cache.get('a') == 'A'
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.stats()['entries'] == 0
+    cache.close()
+
+
+def test_expired_entries_are_swept_on_insert(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100)
+    cache.put('a', 'gpt-4o', 'A')
+    clock.now += 150
+    cache.put('b', 'gpt-4o', 'B')
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['evictions'] == 1
+    cache.close()
+
+
+def test_least_recently_used_is_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2, touch_interval=10)
+    cache.put('a', 'gpt-4o', 'A')
+    clock.now += 1
+    cache.put('b', 'gpt-4o', 'B')
+    clock.now += 10
+    assert cache.get('a') == 'A'
+    clock.now += 1
+    cache.put('c', 'gpt-4o', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
+    assert cache.stats()['entries'] == 2
+    cache.close()
+
+
+def test_hits_within_the_touch_interval_are_not_written(tmp_path, clock):
+    cache = make_cache(tmp_path, touch_interval=10)
+    cache.put('a', 'gpt-4o', 'A')
+    clock.now += 5
+    assert cache.get('a') == 'A'
+    assert cache.pending_touches == {}
+    clock.now += 5
+    assert cache.get('a') == 'A'
+    assert cache.pending_touches == {'a': clock.now}
+    # Not written until the next insert
+    assert cache.conn.total_changes == 1
+    cache.put('b', 'gpt-4o', 'B')
+    assert cache.pending_touches == {}
+    last_access = cache.conn.execute("SELECT last_access FROM llm_response_cache WHERE key = 'a'").fetchone()[0]
+    assert last_access == clock.now
+    cache.close()
+
+
+def test_count_survives_reopening(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put('a', 'gpt-4o', 'A')
+    cache.put('a', 'gpt-4o', 'A2')
+    cache.put('b', 'gpt-4o', 'B')
+    assert cache.stats()['entries'] == 2
+    cache.close()
+    cache = make_cache(tmp_path)
+    assert cache.stats()['entries'] == 2
+    assert cache.get('a') == 'A2'
+    cache.close()
@@ -0,0 +1,73 @@
+# tests/test_roadmap.py
+from roadmap import rank_roadmap_steps
+
+
+# A profile where every sub-dimension has one question answered with score
+def make_profile(dimensions):
+    profile = {}
+    for dimension, (dimension_score, sub_dimensions) in dimensions.items():
+        profile[dimension] = {
+            sub_label: {'score': score, 'questions': [{'answer': score}]}
+            for sub_label, score in sub_dimensions.items()
+        }
+        if dimension_score is not None:
+            profile[dimension]['score'] = dimension_score
+    return profile
+
+
+def picked(steps):
+    return [step['subdimension'] for step in steps]
+
+
+def test_weakest_sub_dimensions_first():
+    profile = make_profile({
+        'A': (None, {'a1': 4, 'a2': 1}),
+        'B': (None, {'b1': 2}),
+        'C': (None, {'c1': 5}),
+    })
+    steps = rank_roadmap_steps(profile)
+    assert picked(steps) == ['a2', 'b1', 'c1']
+    assert steps[0] == {'dimension': 'A', 'subdimension': 'a2', 'score': 20, 'dimension_score': 50}
+
+
+def test_ties_go_to_the_weaker_dimension_then_profile_order():
+    # Every sub-dimension is at 60%, only the stored dimension scores differ
+    profile = make_profile({
+        'A': (70, {'a1': 3}),
+        'B': (40, {'b1': 3}),
+        'C': (55, {'c1': 3}),
+        'D': (55, {'d1': 3}),
+    })
+    assert picked(rank_roadmap_steps(profile, steps=4)) == ['b1', 'c1', 'd1', 'a1']
+
+
+def test_weights_pull_areas_forward():
+    profile = make_profile({
+        'A': (None, {'a1': 2}),
+        'B': (None, {'b1': 3, 'b2': 4}),
+        'C': (None, {'c1': 4}),
+    })
+    assert picked(rank_roadmap_steps(profile, steps=1)) == ['a1']
+    # (100 - 60) * 2 beats (100 - 40)
+    assert picked(rank_roadmap_steps(profile, steps=1, weights={'B': 2})) == ['b1']
+    # A sub-dimension weight only applies to that sub-dimension
+    assert picked(rank_roadmap_steps(profile, steps=1, weights={'c1': 4})) == ['c1']
+
+
+def test_one_step_per_dimension():
+    profile = make_profile({
+        'A': (None, {'a1': 1, 'a2': 1, 'a3': 1}),
+        'B': (None, {'b1': 3}),
+        'C': (None, {'c1': 4}),
+    })
+    assert picked(rank_roadmap_steps(profile)) == ['a1', 'b1', 'c1']
+    assert picked(rank_roadmap_steps(profile, max_per_dimension=2)) == ['a1', 'a2', 'b1']
+
+
+def test_diversity_rule_is_relaxed_without_enough_dimensions():
+    profile = make_profile({
+        'A': (None, {'a1': 1, 'a2': 2, 'a3': 3}),
+        'B': (None, {'b1': 4}),
+    })
+    assert picked(rank_roadmap_steps(profile)) == ['a1', 'b1', 'a2']
+    assert len(rank_roadmap_steps(profile, steps=10)) == 4
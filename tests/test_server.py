@@ -0,0 +1,40 @@
+# tests/test_server.py
+import asyncio
+
+import pytest
+
+from database import Database
+from server import AgentServer
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'agent.db'))
+    yield db
+    db.close()
+
+
+def test_connections_beyond_max_sessions_are_refused(db):
+    server = AgentServer(db, max_sessions=1)
+
+    async def run():
+        listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            # The first session waits for its username
+            assert b'username' in await reader.readuntil(b': ')
+            busy_reader, busy_writer = await asyncio.open_connection('127.0.0.1', port)
+            busy = await asyncio.wait_for(busy_reader.read(), 5)
+            busy_writer.close()
+            # The slot is free again once the session ends
+            writer.write(b'nobody\n')
+            await writer.drain()
+            unknown = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return busy, unknown
+
+    busy, unknown = asyncio.run(run())
+    assert b'busy' in busy
+    assert b'Unknown user: nobody' in unknown
+    assert server.active_sessions == 0
@@ -0,0 +1,73 @@
+# tests/test_state_manager.py
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from state_manager import StateManager
+
+
+class StubDB:
+    def get_agent_state(self, user_id):
+        return None
+
+
+class StubAgent:
+    user_id = 1
+    db = StubDB()
+
+
+class StubState:
+    def __init__(self, name):
+        self.name = name
+        self.state = None
+
+
+# Counts the state objects built
+class CountingStateManager(StateManager):
+    def __init__(self, agent):
+        self.built = []
+        self.built_lock = threading.Lock()
+        super().__init__(agent)
+
+    def build_state(self, state):
+        if state not in self.state_classes:
+            raise KeyError(state)
+        # Long enough for concurrent lookups to overlap
+        time.sleep(0.05)
+        with self.built_lock:
+            self.built.append(state)
+        return StubState(state)
+
+
+@pytest.fixture
+def state_manager(monkeypatch):
+    monkeypatch.setenv('AGENT_PREFETCH_STATES', '0')
+    state_manager = CountingStateManager(StubAgent())
+    yield state_manager
+    state_manager.close()
+
+
+def test_states_are_built_on_first_lookup(state_manager):
+    assert state_manager.built == []
+    assert len(state_manager.state_class_obj) == 0
+
+    education = state_manager.state_class_obj['Education']
+    assert state_manager.built == ['Education']
+    assert state_manager.state_class_obj['Education'] is education
+    assert state_manager.state_class_obj.get('Onboarding') is None
+    assert state_manager.built == ['Education']
+
+
+def test_concurrent_lookups_build_once(state_manager):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        states = list(executor.map(lambda _: state_manager.state_class_obj['DimensionAnalysis'], range(4)))
+    assert state_manager.built == ['DimensionAnalysis']
+    assert all(state is states[0] for state in states)
+
+
+def test_unknown_state(state_manager):
+    with pytest.raises(KeyError):
+        state_manager.state_class_obj['Unknown']
+    assert 'Unknown' not in state_manager.state_class_obj
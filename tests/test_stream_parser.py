@@ -0,0 +1,101 @@
+# tests/test_stream_parser.py
+import json
+
+import pytest
+
+from agent import Agent
+from stream_parser import JsonFieldStreamer
+
+
+# Feed the document in the given chunks and return the decoded field
+def stream(document, chunks):
+    streamer = JsonFieldStreamer('agent_response')
+    text = ''.join(streamer.feed(chunk) for chunk in chunks)
+    return text, streamer
+
+
+def split(document, size):
+    return [document[i:i + size] for i in range(0, len(document), size)]
+
+
+@pytest.mark.parametrize('value', [
+    'She said "hello"',
+    'C:\\Users\\kevin',
+    'first line\nsecond line\ttabbed',
+    'caf\u00e9',
+])
+def test_escapes(value):
+    document = json.dumps({'agent_response': value})
+    for size in (1, 2, 3, len(document)):
+        assert stream(document, split(document, size))[0] == value
+
+
+def test_unicode_escape():
+    document = '{"agent_response": "caf\\u00e9 \\u00E9"}'
+    assert stream(document, split(document, 1))[0] == 'caf\u00e9 \u00e9'
+
+
+def test_surrogate_pair_split_at_every_boundary():
+    value = 'hi \U0001F600!'
+    document = json.dumps({'agent_response': value})
+    assert '\\ud83d\\ude00' in document
+    for cut in range(1, len(document)):
+        text, streamer = stream(document, [document[:cut], document[cut:]])
+        assert text == value
+        assert streamer.complete
+
+
+def test_field_after_other_fields():
+    document = json.dumps({
+        'next_agent_action': 'Conversation',
+        'nested': {'agent_response': 'not this one', 'list': ['agent_response', '"']},
+        'assistant_role': 'agent_response',
+        'agent_response': 'this one',
+        'next_agent_question': 'and not this',
+    })
+    text, streamer = stream(document, split(document, 4))
+    assert text == 'this one'
+    assert streamer.found and streamer.complete
+
+
+def test_missing_field():
+    text, streamer = stream('{"next_agent_question": "why?"}', ['{"next_agent_question": "why?"}'])
+    assert text == ''
+    assert not streamer.found
+
+
+class RecordingIO:
+    def __init__(self):
+        self.output = []
+
+    def print(self, text=""):
+        self.output.append(text + '\n')
+
+    def write(self, text):
+        self.output.append(text)
+
+    def flush(self):
+        pass
+
+
+class StreamingAgent:
+    def __init__(self, chunks):
+        self.io = RecordingIO()
+        self.chunks = chunks
+
+    def get_response_stream(self, prompt, model):
+        return iter(self.chunks)
+
+    write = Agent.write
+    stream_conversation_response = Agent.stream_conversation_response
+
+
+# The header is on its own line and the reply starts on the next one
+def test_header_is_written_before_the_reply():
+    document = json.dumps({'agent_response': 'Hello there', 'next_agent_question': 'How are you?'})
+    agent = StreamingAgent(split(document, 3))
+    text, found = agent.stream_conversation_response({}, model='gpt-4o')
+    assert text == document and found
+    lines = ''.join(agent.io.output).splitlines()
+    assert [line.strip() for line in lines] == ['Agent:', 'Hello there']
+    assert lines[1] == '    Hello there'
@@ -0,0 +1,128 @@
+# tests/test_tracing.py
+import asyncio
+import json
+import re
+
+import pytest
+
+from database import Database
+from server import AgentServer
+from tracing import BUCKETS, configure_tracing, get_tracer, register_metrics_source, span, traced
+
+# name{labels} value
+SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{([a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*",?)*\})? (\S+)$')
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    tracer = get_tracer()
+    trace_file = tmp_path / 'trace.jsonl'
+    configure_tracing(enabled=True, trace_file=str(trace_file))
+    yield trace_file
+    configure_tracing(enabled=False)
+    with tracer.lock:
+        tracer.histograms.clear()
+        tracer.tokens.clear()
+        tracer.sources.clear()
+
+
+def read_spans(trace_file):
+    get_tracer().flush()
+    with open(trace_file) as file:
+        return {span['name']: span for span in map(json.loads, file)}
+
+
+@traced('state.save')
+def save_state():
+    pass
+
+
+def test_span_tree(trace_file):
+    with span('turn', user_id=7) as turn:
+        with span('llm.complete', model='gpt-4o') as current:
+            current.set(prompt_tokens=120, completion_tokens=30)
+        save_state()
+        turn.set(state='Education')
+    with pytest.raises(ValueError):
+        with span('failing'):
+            raise ValueError()
+
+    spans = read_spans(trace_file)
+    root = spans['turn']
+    assert root['parent_id'] is None
+    assert root['trace_id'] == root['span_id']
+    assert root['attributes'] == {'user_id': 7, 'state': 'Education'}
+    for name in ('llm.complete', 'state.save'):
+        assert spans[name]['parent_id'] == root['span_id']
+        assert spans[name]['trace_id'] == root['trace_id']
+    assert spans['llm.complete']['attributes'] == {'model': 'gpt-4o', 'prompt_tokens': 120, 'completion_tokens': 30}
+    # A span after the turn starts a new trace
+    assert spans['failing']['parent_id'] is None
+    assert spans['failing']['trace_id'] != root['trace_id']
+    assert spans['failing']['attributes'] == {'error': 'ValueError'}
+    assert spans['llm.complete']['duration_ms'] <= root['duration_ms']
+
+
+def get_metrics(db):
+    server = AgentServer(db)
+
+    async def run():
+        listener = await asyncio.start_server(server.handle_metrics, '127.0.0.1', 0)
+        port = listener.sockets[0].getsockname()[1]
+        async with listener:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return response
+
+    head, body = asyncio.run(run()).split(b'\r\n\r\n', 1)
+    return head.decode('latin-1'), body.decode('utf-8')
+
+
+def test_metrics_format(trace_file, tmp_path):
+    for _ in range(3):
+        with span('llm.complete', model='gpt-4o') as current:
+            current.set(prompt_tokens=10, completion_tokens=2)
+    with pytest.raises(RuntimeError):
+        with span('db "call"'):
+            raise RuntimeError()
+    register_metrics_source('cache', lambda: {'hits': 4, 'hit_rate': 0.5, 'enabled': True, 'name': 'x'})
+
+    db = Database(str(tmp_path / 'agent.db'))
+    try:
+        head, body = get_metrics(db)
+    finally:
+        db.close()
+    assert head.startswith('HTTP/1.1 200 OK')
+    assert 'Content-Type: text/plain; version=0.0.4' in head
+
+    samples = {}
+    types = {}
+    for line in body.splitlines():
+        if line.startswith('# TYPE'):
+            _, _, name, kind = line.split()
+            types[name] = kind
+            continue
+        if line.startswith('#'):
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        samples[line.rsplit(' ', 1)[0]] = float(match.group(4))
+
+    assert types['agent_span_duration_seconds'] == 'histogram'
+    assert types['agent_llm_tokens_total'] == 'counter'
+    labels = 'span="llm.complete",model="gpt-4o"'
+    buckets = [samples[f'agent_span_duration_seconds_bucket{{{labels},le="{bound}"}}'] for bound in BUCKETS]
+    # Buckets are cumulative and end at the count
+    assert buckets == sorted(buckets)
+    assert samples[f'agent_span_duration_seconds_bucket{{{labels},le="+Inf"}}'] == 3
+    assert samples[f'agent_span_duration_seconds_count{{{labels}}}'] == 3
+    assert samples['agent_span_errors_total{span="db \\"call\\""}'] == 1
+    assert samples['agent_llm_tokens_total{model="gpt-4o",type="prompt"}'] == 30
+    assert samples['agent_llm_tokens_total{model="gpt-4o",type="completion"}'] == 6
+    # Only numbers from the sources
+    assert samples['agent_cache_hits'] == 4
+    assert types['agent_cache_hit_rate'] == 'gauge'
+    assert 'agent_cache_enabled' not in samples and 'agent_cache_name' not in samples
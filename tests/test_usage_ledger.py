@@ -0,0 +1,43 @@
+# tests/test_usage_ledger.py
+import sqlite3
+import sys
+
+import pytest
+
+import usage_ledger
+from database import Database
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / 'agent.db')
+    db = Database(db_file)
+    db.save_user_info({'username': 'alice', 'birthdate': '2000-01-01', 'culture': '{}', 'dimensions': '{}'})
+    user_id = db.get_user_info('alice')['id']
+    db.save_agent_state(user_id, '{"state": "Education"}')
+    db.save_llm_usage([(user_id, 'Education', 'Introduction', 'gpt-4o', '2024-06-01', 2, 0, 1000, 200, 0.0045)])
+    db.close()
+    return db_file
+
+
+def test_rollup_reads_without_changing_the_database(db_file, monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['usage_ledger.py', '--db', db_file, '--by', 'user_id,model'])
+    usage_ledger.main()
+    output = capsys.readouterr().out
+    assert 'gpt-4o' in output and '1000' in output
+
+    db = Database(db_file, read_only=True)
+    try:
+        assert db.get_agent_state(1) == '{"state": "Education"}'
+        with pytest.raises(sqlite3.OperationalError):
+            db.save_agent_state(1, '{}')
+    finally:
+        db.close()
+
+
+def test_rollup_of_missing_database_fails(tmp_path, monkeypatch):
+    db_file = tmp_path / 'missing.db'
+    monkeypatch.setattr(sys, 'argv', ['usage_ledger.py', '--db', str(db_file)])
+    with pytest.raises(SystemExit):
+        usage_ledger.main()
+    assert not db_file.exists()